@@ -0,0 +1,255 @@
+import base64
+import json
+import threading
+import time
+import uuid
+from collections import Counter
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import List, Optional, Set, Tuple
+from urllib.parse import urlparse, parse_qsl
+
+from builder.memory_dal import MemoryStorageDal
+from builder.model import RobustaPermissionScope, RobustaPermissionGroup, User
+from builder.storage_backend import PERMISSION_SCOPES_TABLE, PERMISSION_GROUPS_TABLE, USER_GROUPS_TABLE
+
+TABLE_KEYS = {
+    PERMISSION_SCOPES_TABLE: "scope_id",
+    PERMISSION_GROUPS_TABLE: "group_id",
+}
+
+
+def fake_jwt(expires_in: int = 3600) -> str:
+    def encode(content: dict) -> str:
+        return base64.urlsafe_b64encode(json.dumps(content).encode()).decode().rstrip("=")
+
+    payload = {"sub": str(uuid.uuid4()), "role": "authenticated", "exp": int(time.time()) + expires_in}
+    return f"{encode({'alg': 'HS256', 'typ': 'JWT'})}.{encode(payload)}.c2lnbmF0dXJl"
+
+
+def parse_filter(value: str) -> Tuple[str, object]:
+    operator, _, operand = value.partition(".")
+    if operator == "in":
+        return operator, [item.strip('"') for item in operand.strip("()").split(",") if item]
+    return operator, operand
+
+
+class FakePostgrest:
+    """
+    In-process HTTP server imitating the PostgREST, rpc and auth endpoints StorageDal uses, over a MemoryStorageDal.
+    Every request is delayed by latency seconds, to imitate a remote platform.
+    If max_rows is set, selects return at most max_rows rows, like the PostgREST db-max-rows setting.
+    Tokens revoked with revoke_tokens are rejected, like expired tokens
+    """
+
+    def __init__(
+            self,
+            latency: float = 0.0,
+            users: Optional[List[User]] = None,
+            port: int = 0,
+            max_rows: Optional[int] = None,
+    ):
+        self.latency = latency
+        self.max_rows = max_rows
+        self.dal = MemoryStorageDal(users=users)
+        self.requests: Counter = Counter()
+        self.lock = threading.Lock()
+        self.issued_tokens: List[str] = []
+        self.revoked_tokens: Set[str] = set()
+        self.server = ThreadingHTTPServer(("127.0.0.1", port), self.__handler())
+        self.server.daemon_threads = True
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def start(self) -> "FakePostgrest":
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def reset_counters(self):
+        with self.lock:
+            self.requests.clear()
+
+    def issue_token(self) -> str:
+        token = fake_jwt()
+        with self.lock:
+            self.issued_tokens.append(token)
+        return token
+
+    def revoke_tokens(self):
+        with self.lock:
+            self.revoked_tokens.update(self.issued_tokens)
+
+    def token_revoked(self, authorization: Optional[str]) -> bool:
+        with self.lock:
+            return (authorization or "").removeprefix("Bearer ") in self.revoked_tokens
+
+    def count_request(self, method: str, path: str):
+        with self.lock:
+            self.requests[f"{method} {path}"] += 1
+
+    def __rows(self, table: str) -> List[dict]:
+        if table == PERMISSION_SCOPES_TABLE:
+            return list(self.dal.scopes.values())
+        if table == PERMISSION_GROUPS_TABLE:
+            return list(self.dal.groups.values())
+        if table == USER_GROUPS_TABLE:
+            return [
+                {"user_id": user_id, "group_id": group_id}
+                for user_id, group_ids in self.dal.user_groups.items() for group_id in group_ids
+            ]
+        raise KeyError(table)
+
+    @staticmethod
+    def __matches(row: dict, filters: List[Tuple[str, str, object]]) -> bool:
+        for column, operator, operand in filters:
+            value = str(row.get(column))
+            if operator == "eq" and value != operand:
+                return False
+            if operator == "in" and value not in operand:
+                return False
+        return True
+
+    def select(self, table: str, params: List[Tuple[str, str]]) -> List[dict]:
+        filters = []
+        columns = None
+        order: List[str] = []
+        offset = 0
+        limit = None
+        for key, value in params:
+            if key == "select":
+                columns = None if value == "*" else value.split(",")
+            elif key == "order":
+                order = [column.split(".")[0] for column in value.split(",")]
+            elif key == "offset":
+                offset = int(value)
+            elif key == "limit":
+                limit = int(value)
+            else:
+                filters.append((key, *parse_filter(value)))
+
+        with self.dal.lock:
+            rows = [row for row in self.__rows(table) if self.__matches(row, filters)]
+        if order:
+            rows.sort(key=lambda row: tuple(str(row.get(column)) for column in order))
+        if self.max_rows is not None:
+            limit = min(limit, self.max_rows) if limit is not None else self.max_rows
+        rows = rows[offset:offset + limit if limit is not None else None]
+        if columns:
+            rows = [{column: row.get(column) for column in columns} for row in rows]
+        return rows
+
+    def upsert(self, table: str, body):
+        rows = body if isinstance(body, list) else [body]
+        if table == PERMISSION_SCOPES_TABLE:
+            self.dal.upsert_scopes([RobustaPermissionScope(**row) for row in rows])
+        elif table == PERMISSION_GROUPS_TABLE:
+            self.dal.upsert_groups([RobustaPermissionGroup(**row) for row in rows])
+        else:
+            raise KeyError(table)
+
+    def delete(self, table: str, params: List[Tuple[str, str]]):
+        key = TABLE_KEYS[table]
+        filters = [(column, *parse_filter(value)) for column, value in params]
+        with self.dal.lock:
+            rows = [row for row in self.__rows(table) if self.__matches(row, filters)]
+            for account_id in {row["account_id"] for row in rows}:
+                ids = [row[key] for row in rows if row["account_id"] == account_id]
+                if table == PERMISSION_SCOPES_TABLE:
+                    self.dal.delete_scopes(account_id, ids)
+                else:
+                    self.dal.delete_groups(account_id, ids)
+
+    def rpc(self, func_name: str, params: dict):
+        if func_name == "relay_get_all_users":
+            return [{"id": user.id, "email": user.email} for user in self.dal.get_robusta_users()]
+        if func_name == "set_user_external_rbac_groups":
+            self.dal.set_user_groups(params["_user_id"], params["_group_ids"])
+            return None
+        return self.dal.sync_rpc(func_name, params)["data"]
+
+    def __handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def __send(self, status: int, content=None):
+                body = json.dumps(content).encode() if content is not None else b""
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def __body(self):
+                length = int(self.headers.get("Content-Length") or 0)
+                return json.loads(self.rfile.read(length)) if length else None
+
+            def __handle(self, method: str):
+                url = urlparse(self.path)
+                params = parse_qsl(url.query, keep_blank_values=True)
+                body = self.__body()
+                fake.count_request(method, url.path.split("?")[0])
+                if fake.latency:
+                    time.sleep(fake.latency)
+
+                try:
+                    if url.path.startswith("/auth/v1/"):
+                        return self.__auth(url.path[len("/auth/v1/"):])
+                    if fake.token_revoked(self.headers.get("Authorization")):
+                        return self.__send(401, {"code": "PGRST301", "message": "JWT expired", "details": None,
+                                                 "hint": None})
+                    if url.path.startswith("/rest/v1/rpc/"):
+                        return self.__send(200, fake.rpc(url.path[len("/rest/v1/rpc/"):], body or {}))
+                    table = url.path[len("/rest/v1/"):]
+                    if method == "GET":
+                        return self.__send(200, fake.select(table, params))
+                    if method == "POST":
+                        fake.upsert(table, body)
+                        return self.__send(201)
+                    if method == "DELETE":
+                        fake.delete(table, params)
+                        return self.__send(204)
+                    return self.__send(405, {"message": f"Unsupported method {method}"})
+                except KeyError as e:
+                    return self.__send(404, {"code": "42P01", "message": f"Unknown {e}"})
+                except Exception as e:
+                    return self.__send(409, {"code": "23503", "message": str(e), "details": None, "hint": None})
+
+            def __auth(self, path: str):
+                user = {
+                    "id": str(uuid.uuid4()), "aud": "authenticated", "role": "authenticated",
+                    "app_metadata": {}, "user_metadata": {}, "created_at": "2024-01-01T00:00:00Z",
+                }
+                if path == "token":
+                    return self.__send(200, {
+                        "access_token": fake.issue_token(), "refresh_token": "refresh", "token_type": "bearer",
+                        "expires_in": 3600, "user": user,
+                    })
+                if path == "user":
+                    return self.__send(200, user)
+                return self.__send(204)
+
+            def do_GET(self):
+                self.__handle("GET")
+
+            def do_POST(self):
+                self.__handle("POST")
+
+            def do_DELETE(self):
+                self.__handle("DELETE")
+
+            def do_PATCH(self):
+                self.__handle("PATCH")
+
+        return Handler
@@ -0,0 +1,91 @@
+import argparse
+import uuid
+from typing import Dict
+
+import yaml
+
+try:
+    from yaml import CSafeDumper as SafeDumper
+except ImportError:
+    from yaml import SafeDumper
+
+
+def generate_config(
+        scopes: int,
+        clusters_per_scope: int,
+        namespaces_per_cluster: int,
+        groups: int,
+        scopes_per_group: int = 2,
+        clusters: int = 100,
+        account_id: str = "",
+) -> Dict:
+    """
+    Synthetic, valid definitions.yaml content. Every 10th scope is a 'cluster' scope, and every 10th group is a
+    'cluster' group assigned to cluster scopes only
+    """
+    account_id = account_id or str(uuid.uuid4())
+    scope_definitions = []
+    for index in range(scopes):
+        cluster_scope = index % 10 == 0
+        scope_clusters = {}
+        for cluster_index in range(clusters_per_scope):
+            cluster_name = f"cluster-{(index + cluster_index) % clusters}"
+            scope_clusters[cluster_name] = ["*"] if cluster_scope else [
+                f"namespace-{(index + namespace_index) % 1000}" for namespace_index in range(namespaces_per_cluster)
+            ]
+        scope_definitions.append({
+            "name": f"scope-{index}",
+            "type": "cluster" if cluster_scope else "namespace",
+            "clusters": scope_clusters,
+        })
+
+    cluster_scopes = [scope["name"] for scope in scope_definitions if scope["type"] == "cluster"]
+    group_definitions = []
+    for index in range(groups):
+        cluster_group = index % 10 == 0 and cluster_scopes
+        if cluster_group:
+            group_scopes = [
+                cluster_scopes[(index + offset) % len(cluster_scopes)] for offset in range(scopes_per_group)
+            ]
+        else:
+            group_scopes = [f"scope-{(index + offset) % scopes}" for offset in range(scopes_per_group)]
+        group_definitions.append({
+            "name": f"group-{index}",
+            "type": "cluster" if cluster_group else "namespace",
+            "provider_group_id": str(uuid.uuid5(uuid.NAMESPACE_OID, f"{account_id}/{index}")),
+            "scopes": sorted(set(group_scopes)),
+            "permissions": ["NODE_DRAIN", "POD_LOGS"] if cluster_group else ["POD_LOGS", "METRICS_VIEW"],
+        })
+
+    return {"account_id": account_id, "scopes": scope_definitions, "groups": group_definitions}
+
+
+def write_config(config: Dict, file_name: str):
+    with open(file_name, "w") as config_file:
+        yaml.dump(config, config_file, Dumper=SafeDumper, sort_keys=False)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Generate a synthetic rbac builder configuration")
+    parser.add_argument("--scopes", type=int, default=1000)
+    parser.add_argument("--clusters-per-scope", type=int, default=3)
+    parser.add_argument("--namespaces", type=int, default=5, help="namespaces per cluster of namespace scopes")
+    parser.add_argument("--groups", type=int, default=200)
+    parser.add_argument("--scopes-per-group", type=int, default=2)
+    parser.add_argument("--clusters", type=int, default=100, help="distinct cluster names")
+    parser.add_argument("--account-id", default="")
+    parser.add_argument("--output", required=True)
+    args = parser.parse_args()
+
+    write_config(
+        generate_config(
+            scopes=args.scopes,
+            clusters_per_scope=args.clusters_per_scope,
+            namespaces_per_cluster=args.namespaces,
+            groups=args.groups,
+            scopes_per_group=args.scopes_per_group,
+            clusters=args.clusters,
+            account_id=args.account_id,
+        ),
+        args.output
+    )
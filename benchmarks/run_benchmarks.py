@@ -0,0 +1,202 @@
+import argparse
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Callable, Dict, List
+
+from benchmarks.fake_postgrest import FakePostgrest, fake_jwt
+from benchmarks.generate_config import generate_config, write_config
+from builder.config_builder import compile_config_file, load_account_configs
+from builder.model import User
+from builder.reconciler import RbacReconciler
+from builder.robusta_store import RobustaStore
+from builder.storage_dal import StorageDal
+from builder.user_sync import UsersGroupsSync
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# modules of the platform client. The validate command must never load them
+NETWORK_MODULES = ["supabase", "postgrest", "gotrue", "httpx", "requests", "urllib3", "certifi"]
+
+# modules the interpreter loaded at startup, for example from .pth files, are not counted
+COLD_START_SCRIPT = """
+import sys
+preloaded = set(sys.modules)
+import argparse, json, time
+start = time.perf_counter()
+import builder.main
+imported = time.perf_counter()
+exit_code = builder.main.run_validate(argparse.Namespace(config=sys.argv[1]))
+print(json.dumps({
+    "import_seconds": imported - start,
+    "validate_seconds": time.perf_counter() - imported,
+    "exit_code": exit_code,
+    "network_modules": sorted(set(sys.argv[2].split(",")) & set(sys.modules) - preloaded),
+}))
+"""
+
+
+def measure_cold_start(config_file_name: str, repeat: int) -> Dict:
+    """
+    Run the validate command in a new interpreter, repeat times, and record the import and validation time of
+    the best run. Fails if the platform client modules were loaded
+    """
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = subprocess.run(
+            [sys.executable, "-c", COLD_START_SCRIPT, config_file_name, ",".join(NETWORK_MODULES)],
+            cwd=REPO_DIR, env={**os.environ, "PYTHONPATH": REPO_DIR}, stdout=subprocess.PIPE, check=True, text=True,
+        ).stdout
+        run_result = json.loads(output.strip().splitlines()[-1])
+        run_result["total_seconds"] = time.perf_counter() - start
+        runs.append(run_result)
+
+    best = min(runs, key=lambda run_result: run_result["total_seconds"])
+    if best["exit_code"] != 0:
+        raise Exception(f"validate failed on {config_file_name}")
+    if best["network_modules"]:
+        raise Exception(f"validate imported the network modules {best['network_modules']}")
+
+    result = {
+        "scenario": "cold_start_validate",
+        "best_seconds": round(best["total_seconds"], 6),
+        "mean_seconds": round(sum(run_result["total_seconds"] for run_result in runs) / len(runs), 6),
+        "import_seconds": round(best["import_seconds"], 6),
+        "validate_seconds": round(best["validate_seconds"], 6),
+        "requests": 0,
+    }
+    logging.info(f"cold_start_validate: best {result['best_seconds']}s, imports {result['import_seconds']}s")
+    return result
+
+
+class BenchmarkRunner:
+
+    def __init__(self, fake: FakePostgrest, repeat: int):
+        self.fake = fake
+        self.repeat = repeat
+        self.results: List[Dict] = []
+
+    def measure(self, scenario: str, func: Callable[[], object], setup: Callable[[], None] = lambda: None):
+        """
+        Run the scenario repeat times, and record the best and mean wall time, and the requests of the last run
+        """
+        durations = []
+        for _ in range(self.repeat):
+            setup()
+            self.fake.reset_counters()
+            start = time.perf_counter()
+            func()
+            durations.append(time.perf_counter() - start)
+
+        result = {
+            "scenario": scenario,
+            "best_seconds": round(min(durations), 6),
+            "mean_seconds": round(sum(durations) / len(durations), 6),
+            "requests": sum(self.fake.requests.values()),
+            "requests_by_endpoint": dict(self.fake.requests),
+        }
+        logging.info(f"{scenario}: best {result['best_seconds']}s, {result['requests']} requests")
+        self.results.append(result)
+
+
+def run(args) -> Dict:
+    config = generate_config(
+        scopes=args.scopes,
+        clusters_per_scope=args.clusters_per_scope,
+        namespaces_per_cluster=args.namespaces,
+        groups=args.groups,
+        scopes_per_group=args.scopes_per_group,
+    )
+    users = [User(id=f"user-{index}", email=f"user-{index}@example.com") for index in range(args.users)]
+    fake = FakePostgrest(latency=args.latency, users=users).start()
+    runner = BenchmarkRunner(fake, args.repeat)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        config_file_name = os.path.join(temp_dir, "definitions.yaml")
+        write_config(config, config_file_name)
+
+        runner.measure("parse_validate", lambda: compile_config_file(config_file_name))
+        runner.measure("compile", lambda: load_account_configs(config_file_name))
+        runner.results.append(measure_cold_start(config_file_name, args.repeat))
+        config_reader = load_account_configs(config_file_name)[config["account_id"]]
+
+    account_id = config_reader.get_account_id()
+    scopes = config_reader.get_scopes()
+    groups = config_reader.get_groups()
+
+    dal = StorageDal(
+        url=fake.url,
+        key=fake_jwt(),
+        email="benchmark@example.com",
+        password="benchmark",
+        batch_size=args.batch_size,
+        max_concurrency=args.concurrency,
+    )
+    robusta_store = RobustaStore(dal=dal)
+    reconciler = RbacReconciler(robusta_store)
+
+    def clear_account():
+        fake.dal.delete_account_groups(account_id)
+        fake.dal.delete_account_scopes(account_id)
+
+    try:
+        runner.measure("apply_incremental_initial", lambda: reconciler.sync(account_id, scopes, groups), clear_account)
+        runner.measure("apply_incremental_unchanged", lambda: reconciler.sync(account_id, scopes, groups))
+        runner.measure("apply_atomic_initial",
+                       lambda: robusta_store.apply_account_rbac(account_id, scopes, groups), clear_account)
+        runner.measure("apply_atomic_unchanged", lambda: robusta_store.apply_account_rbac(account_id, scopes, groups))
+
+        users_sync = UsersGroupsSync(
+            robusta_store,
+            allowed_users=[user.email for user in users],
+            cluster_admin_groups={"cluster-0": [user.email for user in users[::10]]},
+            account_sso_group=groups[0].name if groups else "",
+        )
+
+        def clear_users_groups():
+            fake.dal.user_groups.clear()
+
+        runner.measure("user_sync_initial", lambda: users_sync.sync(account_id), clear_users_groups)
+        runner.measure("user_sync_unchanged", lambda: users_sync.sync(account_id))
+    finally:
+        robusta_store.close()
+        fake.stop()
+
+    return {
+        "timestamp": time.time(),
+        "python": platform.python_version(),
+        "params": vars(args),
+        "results": runner.results,
+    }
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Benchmark the rbac builder against a local fake platform")
+    parser.add_argument("--scopes", type=int, default=1000)
+    parser.add_argument("--clusters-per-scope", type=int, default=3)
+    parser.add_argument("--namespaces", type=int, default=5)
+    parser.add_argument("--groups", type=int, default=200)
+    parser.add_argument("--scopes-per-group", type=int, default=2)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--latency", type=float, default=0.01, help="injected latency per request, in seconds")
+    parser.add_argument("--batch-size", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--output", help="json results file. Printed to stdout if not set")
+    args = parser.parse_args()
+
+    logging.basicConfig(format='%(asctime)s.%(msecs)03d %(levelname)-8s %(message)s', level=logging.INFO,
+                        datefmt='%Y-%m-%d %H:%M:%S')
+
+    results = run(args)
+    if args.output:
+        with open(args.output, "w") as output_file:
+            json.dump(results, output_file, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
@@ -0,0 +1,77 @@
+import json
+from typing import Dict
+
+from builder.config_builder import ConfigBuilder, CompiledConfig, RobustaUsersDefinition
+from builder.file_utils import open_text
+from builder.fingerprint import config_fingerprint
+from builder.model import RobustaPermissionScope, RobustaPermissionGroup
+
+ARTIFACT_VERSION = 1
+
+
+def write_artifact(configs: Dict[str, ConfigBuilder], file_name: str):
+    """
+    Write the compiled configuration of every account as json lines, ready to be sent to the platform.
+    Every account starts with an 'account' line, followed by its 'scope' and 'group' lines.
+    Files ending with .gz are compressed
+    """
+    with open_text(file_name, "w") as artifact_file:
+        for account_id, config_reader in configs.items():
+            header = {
+                "kind": "account",
+                "version": ARTIFACT_VERSION,
+                "account_id": account_id,
+                "fingerprint": config_fingerprint(account_id, config_reader.get_scopes(), config_reader.get_groups()),
+                "users": config_reader.get_users_config(),
+            }
+            artifact_file.write(json.dumps(header) + "\n")
+            for scope in config_reader.get_scopes():
+                artifact_file.write(json.dumps({"kind": "scope", "row": scope.dict()}) + "\n")
+            for group in config_reader.get_groups():
+                artifact_file.write(json.dumps({"kind": "group", "row": group.dict()}) + "\n")
+
+
+def read_artifact(file_name: str) -> Dict[str, ConfigBuilder]:
+    """
+    Load a compiled artifact. The rows were validated when the artifact was compiled, so they are not validated again.
+    The fingerprint of every account is checked, so a corrupted or edited artifact is never applied
+    """
+    accounts: Dict[str, CompiledConfig] = {}
+    fingerprints: Dict[str, str] = {}
+    account = None
+    with open_text(file_name, "r") as artifact_file:
+        for line_number, line in enumerate(artifact_file, start=1):
+            if not line.strip():
+                continue
+            record = json.loads(line)
+            kind = record.get("kind")
+            if kind == "account":
+                if record.get("version") != ARTIFACT_VERSION:
+                    raise Exception(f"Unsupported artifact version {record.get('version')} in {file_name}")
+                users = RobustaUsersDefinition(**record["users"]) if record.get("users") is not None else None
+                account = CompiledConfig.model_construct(
+                    account_id=record["account_id"], scopes=[], groups=[], users=users
+                )
+                accounts[account.account_id] = account
+                fingerprints[account.account_id] = record.get("fingerprint")
+            elif account is None:
+                raise Exception(f"Artifact {file_name} line {line_number}: {kind} row before any account")
+            elif kind in ("scope", "group"):
+                if record["row"].get("account_id") != account.account_id:
+                    raise Exception(f"Artifact {file_name} line {line_number}: {kind} of another account")
+                if kind == "scope":
+                    account.scopes.append(RobustaPermissionScope.model_construct(**record["row"]))
+                else:
+                    account.groups.append(RobustaPermissionGroup.model_construct(**record["row"]))
+            else:
+                raise Exception(f"Artifact {file_name} line {line_number}: unknown record kind {kind}")
+
+    for account_id, account in accounts.items():
+        if config_fingerprint(account_id, account.scopes, account.groups) != fingerprints[account_id]:
+            raise Exception(f"Artifact {file_name} account {account_id} doesn't match its fingerprint. "
+                            f"The artifact is corrupted or was edited, compile it again")
+
+    # scopes were optimized when the artifact was compiled
+    return {
+        account_id: ConfigBuilder.from_compiled(account, optimize=False) for account_id, account in accounts.items()
+    }
@@ -0,0 +1,93 @@
+import json
+import logging
+import time
+from typing import Dict, List
+
+from builder.file_utils import open_text, atomic_text_file
+from builder.fingerprint import config_fingerprint
+from builder.plan import AccountPlan
+from builder.reconciler import SyncPlan
+from builder.robusta_store import RobustaStore
+from builder.state_snapshot import AccountState, fetch_account_state
+from builder.user_sync import compute_users_groups_plan
+
+BACKUP_VERSION = 1
+
+
+def take_backup(robusta_store: RobustaStore, account_ids: List[str]) -> Dict[str, AccountState]:
+    """
+    The stored scopes, groups and users groups of the accounts. Users are not part of the rbac, so they're not kept
+    """
+    return {
+        account_id: fetch_account_state(robusta_store, account_id, include_users=False) for account_id in account_ids
+    }
+
+
+def write_backup(states: Dict[str, AccountState], file_name: str):
+    content = {
+        "version": BACKUP_VERSION,
+        "created_at": time.time(),
+        "accounts": {account_id: state.model_dump(exclude={"users"}) for account_id, state in states.items()},
+    }
+    with atomic_text_file(file_name) as backup_file:
+        json.dump(content, backup_file, separators=(",", ":"))
+
+
+def read_backup(file_name: str) -> Dict[str, AccountState]:
+    with open_text(file_name, "r") as backup_file:
+        content = json.load(backup_file)
+    if content.get("version") != BACKUP_VERSION:
+        raise Exception(f"Unsupported backup version {content.get('version')} in {file_name}")
+    return {account_id: AccountState(**state) for account_id, state in content["accounts"].items()}
+
+
+def compute_restore_plan(backup: AccountState, current: AccountState) -> AccountPlan:
+    """
+    The changes that bring the account back to the backup: scopes and groups are diffed by id, so they're restored
+    with their original ids, and the users groups references stay valid.
+    Scopes and groups created after the backup are deleted, and the users groups are restored for the backup groups
+    """
+    plan = SyncPlan(account_id=backup.account_id)
+
+    current_scope_ids = {scope.scope_id for scope in current.scopes}
+    stored_scopes = {scope.canonical for scope in current.scopes}
+    for scope in backup.scopes:
+        if scope.canonical not in stored_scopes:
+            (plan.scopes_to_update if scope.scope_id in current_scope_ids else plan.scopes_to_create).append(scope)
+    backup_scope_ids = {scope.scope_id for scope in backup.scopes}
+    plan.scopes_to_delete = [scope for scope in current.scopes if scope.scope_id not in backup_scope_ids]
+
+    current_group_ids = {group.group_id for group in current.groups}
+    stored_groups = {group.canonical for group in current.groups}
+    for group in backup.groups:
+        if group.canonical not in stored_groups:
+            (plan.groups_to_update if group.group_id in current_group_ids else plan.groups_to_create).append(group)
+    backup_group_ids = {group.group_id for group in backup.groups}
+    plan.groups_to_delete = [group for group in current.groups if group.group_id not in backup_group_ids]
+
+    # users with account groups now, and none in the backup, lose their account groups
+    desired = {user_id: set() for user_id in current.users_groups}
+    desired.update({user_id: set(group_ids) for user_id, group_ids in backup.users_groups.items()})
+    users_plan = compute_users_groups_plan(
+        backup.account_id, desired, current.users_groups, backup_group_ids
+    )
+
+    return AccountPlan(
+        account_id=backup.account_id,
+        # the fingerprint of the configuration that was applied when the backup was taken
+        fingerprint=config_fingerprint(backup.account_id, backup.scopes, backup.groups),
+        state_created_at=current.created_at,
+        rbac=plan,
+        users=users_plan,
+    )
+
+
+def compute_restore_plans(robusta_store: RobustaStore, backups: Dict[str, AccountState]) -> List[AccountPlan]:
+    plans = []
+    for account_id, backup in backups.items():
+        current = fetch_account_state(robusta_store, account_id, include_users=False)
+        plan = compute_restore_plan(backup, current)
+        logging.info(f"Account {account_id} restore to the backup of "
+                     f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(backup.created_at))}: {plan.summary()}")
+        plans.append(plan)
+    return plans
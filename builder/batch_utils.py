@@ -0,0 +1,39 @@
+from concurrent.futures import ThreadPoolExecutor, FIRST_EXCEPTION, wait
+from typing import Iterable, Iterator, List, TypeVar, Callable
+
+T = TypeVar("T")
+
+
+def chunks(items: Iterable[T], size: int) -> Iterator[List[T]]:
+    """Split items into consecutive lists of at most size items"""
+    if size <= 0:
+        raise ValueError(f"Batch size must be positive, got {size}")
+
+    chunk: List[T] = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def run_concurrently(func: Callable[[T], None], items: Iterable[T], max_workers: int):
+    """
+    Call func on every item, with at most max_workers calls in flight.
+    Returns when all the calls are done. If any call fails, the pending calls are cancelled and the error is raised
+    """
+    items = list(items)
+    if max_workers <= 1 or len(items) <= 1:
+        for item in items:
+            func(item)
+        return
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        futures = [executor.submit(func, item) for item in items]
+        done, not_done = wait(futures, return_when=FIRST_EXCEPTION)
+        for future in not_done:
+            future.cancel()
+        for future in done:
+            future.result()
@@ -0,0 +1,235 @@
+import hashlib
+import json
+import logging
+import re
+import threading
+from bisect import bisect_left
+from fnmatch import translate
+from functools import lru_cache
+from typing import Dict, List, Optional, Pattern, Tuple
+
+import yaml
+
+from builder.file_utils import atomic_text_file
+from builder.model import RobustaPermissionScope, ALL_NAMESPACES
+
+try:
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+REGEX_SELECTOR_PREFIX = "re:"
+GLOB_CHARS = "*?["
+REGEX_CHARS = set(".^$*+?{}[]\\|()")
+INVENTORY_CACHE_VERSION = 1
+
+
+def is_selector(name: str) -> bool:
+    """
+    Cluster and namespace names starting with 're:' are regular expressions, and names with '*', '?' or '[' are globs.
+    Both must match the whole name
+    """
+    return name.startswith(REGEX_SELECTOR_PREFIX) or any(char in name for char in GLOB_CHARS)
+
+
+@lru_cache(maxsize=None)
+def compile_selector(selector: str) -> Pattern:
+    if selector.startswith(REGEX_SELECTOR_PREFIX):
+        return re.compile(selector[len(REGEX_SELECTOR_PREFIX):])
+    return re.compile(translate(selector))
+
+
+def validate_selector(selector: str):
+    try:
+        compile_selector(selector)
+    except re.error as e:
+        raise ValueError(f"Invalid selector {selector}: {e}")
+
+
+def literal_prefix(selector: str) -> str:
+    """
+    The prefix every name matching the selector starts with
+    """
+    if not selector.startswith(REGEX_SELECTOR_PREFIX):
+        end = min([selector.index(char) for char in GLOB_CHARS if char in selector], default=len(selector))
+        return selector[:end]
+
+    pattern = selector[len(REGEX_SELECTOR_PREFIX):]
+    # alternatives may start with anything
+    if "|" in pattern:
+        return ""
+    pattern = pattern[1:] if pattern.startswith("^") else pattern
+    end = 0
+    while end < len(pattern) and pattern[end] not in REGEX_CHARS:
+        end += 1
+    # a quantifier makes the character before it optional
+    if end < len(pattern) and pattern[end] in "*?{":
+        end -= 1
+    return pattern[:max(end, 0)]
+
+
+class NameIndex:
+    """
+    Sorted names. A selector is matched only against the names sharing its literal prefix, found by binary search
+    """
+
+    def __init__(self, names: List[str]):
+        self.names = sorted(set(names))
+        self.name_set = set(self.names)
+
+    def match(self, selector: str) -> List[str]:
+        if not is_selector(selector):
+            return [selector] if selector in self.name_set else []
+        prefix = literal_prefix(selector)
+        start = bisect_left(self.names, prefix)
+        end = bisect_left(self.names, prefix + "\U0010ffff") if prefix else len(self.names)
+        pattern = compile_selector(selector)
+        return [name for name in self.names[start:end] if pattern.fullmatch(name)]
+
+
+class ClusterInventory:
+    """
+    The clusters, and the namespaces of every cluster, that scope selectors are resolved against.
+    Resolved selectors are kept by the inventory content hash, and can be saved to a cache file, so the selectors
+    are matched again, and the inventory is parsed, only when the inventory changes
+    """
+
+    def __init__(self, file_name: str, content: bytes, cache_file: str = ""):
+        self.file_name = file_name
+        self.content = content
+        self.content_hash = hashlib.sha256(content).hexdigest()
+        self.cache_file = cache_file
+        self.lock = threading.Lock()
+        self.clusters: Optional[Dict[str, List[str]]] = None
+        self.cluster_index: Optional[NameIndex] = None
+        self.namespace_indexes: Dict[str, NameIndex] = {}
+        # selector key -> matched names
+        self.resolved: Dict[str, List[str]] = {}
+        self.cache_changed = False
+        if cache_file:
+            self.__read_cache()
+
+    def __read_cache(self):
+        try:
+            with open(self.cache_file, "r") as cache:
+                content = json.load(cache)
+        except FileNotFoundError:
+            return
+        except Exception:
+            logging.warning(f"Failed to read the inventory cache {self.cache_file}, ignoring it", exc_info=True)
+            return
+        if content.get("version") == INVENTORY_CACHE_VERSION and content.get("inventory_hash") == self.content_hash:
+            self.resolved = content.get("resolved", {})
+
+    def save_cache(self):
+        if not self.cache_file or not self.cache_changed:
+            return
+        with self.lock:
+            content = {
+                "version": INVENTORY_CACHE_VERSION,
+                "inventory_hash": self.content_hash,
+                "resolved": self.resolved,
+            }
+            self.cache_changed = False
+        with atomic_text_file(self.cache_file) as cache:
+            json.dump(content, cache)
+
+    def __load(self):
+        # the inventory is parsed only when a selector isn't resolved yet
+        if self.clusters is not None:
+            return
+        content = yaml.load(self.content, Loader=SafeLoader) or {}
+        clusters = content.get("clusters") or {}
+        if not isinstance(clusters, dict):
+            raise Exception(f"Inventory {self.file_name} 'clusters' must map cluster names to their namespaces")
+        self.clusters = {str(cluster): [str(namespace) for namespace in namespaces or []]
+                         for cluster, namespaces in clusters.items()}
+        self.cluster_index = NameIndex(list(self.clusters))
+        logging.info(f"Loaded {len(self.clusters)} clusters from the inventory {self.file_name}")
+
+    def __resolve(self, key: str, match) -> List[str]:
+        with self.lock:
+            names = self.resolved.get(key)
+            if names is None:
+                self.__load()
+                names = match()
+                self.resolved[key] = names
+                self.cache_changed = True
+            return names
+
+    def match_clusters(self, selector: str) -> List[str]:
+        return self.__resolve(f"cluster/{selector}", lambda: self.cluster_index.match(selector))
+
+    def match_namespaces(self, cluster: str, selector: str) -> List[str]:
+        def match() -> List[str]:
+            index = self.namespace_indexes.get(cluster)
+            if index is None:
+                index = self.namespace_indexes[cluster] = NameIndex(self.clusters.get(cluster, []))
+            return index.match(selector)
+
+        return self.__resolve(f"namespace/{cluster}/{selector}", match)
+
+    def expand_scope_data(self, scope_data: Dict[str, List[str]]) -> Dict[str, List[str]]:
+        """
+        Replace the cluster and namespace selectors with the matching names. Clusters left without namespaces
+        are dropped
+        """
+        expanded: Dict[str, List[str]] = {}
+        for cluster_selector, namespaces in scope_data.items():
+            clusters = self.match_clusters(cluster_selector) if is_selector(cluster_selector) else [cluster_selector]
+            for cluster in clusters:
+                cluster_namespaces = expanded.setdefault(cluster, [])
+                for namespace in namespaces:
+                    if namespace != ALL_NAMESPACES and is_selector(namespace):
+                        cluster_namespaces.extend(self.match_namespaces(cluster, namespace))
+                    else:
+                        cluster_namespaces.append(namespace)
+        return {cluster: namespaces for cluster, namespaces in expanded.items() if namespaces}
+
+
+# inventories by content hash, so long running processes resolve the selectors again only if the inventory changed
+_INVENTORIES: Dict[str, ClusterInventory] = {}
+
+
+def load_inventory(file_name: str, cache_file: str = "") -> ClusterInventory:
+    with open(file_name, "rb") as inventory_file:
+        content = inventory_file.read()
+    content_hash = hashlib.sha256(content).hexdigest()
+    inventory = _INVENTORIES.get(content_hash)
+    if inventory is None or inventory.file_name != file_name:
+        inventory = ClusterInventory(file_name, content, cache_file)
+        _INVENTORIES.clear()
+        _INVENTORIES[content_hash] = inventory
+    return inventory
+
+
+def uses_selectors(scope_data: Dict[str, List[str]]) -> bool:
+    return any(
+        is_selector(cluster) or any(namespace != ALL_NAMESPACES and is_selector(namespace) for namespace in namespaces)
+        for cluster, namespaces in scope_data.items()
+    )
+
+
+def expand_scopes(
+        scopes: List[RobustaPermissionScope],
+        inventory: Optional[ClusterInventory],
+) -> Tuple[List[RobustaPermissionScope], List[str]]:
+    """
+    Resolve the selectors of the scopes against the inventory. Returns the expanded scopes, and the errors
+    """
+    expanded_scopes: List[RobustaPermissionScope] = []
+    errors: List[str] = []
+    for scope in scopes:
+        if not uses_selectors(scope.scope_data):
+            expanded_scopes.append(scope)
+            continue
+        if inventory is None:
+            errors.append(f"Account {scope.account_id}: scope {scope.name} uses cluster or namespace selectors, "
+                          f"but no cluster inventory is set (CLUSTER_INVENTORY_FILE)")
+            continue
+        scope_data = inventory.expand_scope_data(scope.scope_data)
+        if not scope_data:
+            logging.warning(f"Account {scope.account_id} scope {scope.name} selectors don't match any cluster "
+                            f"in the inventory {inventory.file_name}")
+        expanded_scopes.append(scope.model_copy(update={"scope_data": scope_data}))
+    return expanded_scopes, errors
@@ -1,21 +1,33 @@
+import glob
+import logging
+import os
 import uuid
-from typing import List, Dict
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Dict, Optional, Tuple
 
 import pydantic
 import yaml
-from pydantic import BaseModel, field_validator
+from pydantic import BaseModel, field_validator, PrivateAttr
 
-from builder.model import RobustaPermissionScope, RobustaPermissionGroup
+from builder.cluster_inventory import ClusterInventory, is_selector, validate_selector, expand_scopes
+from builder.env_vars import ALLOWED_USERS, CLUSTER_ADMIN_GROUPS, ACCOUNT_SSO_GROUP, SYNC_USERS_GROUPS, \
+    USERS_EMAIL_DOMAIN
+from builder.metrics import METRICS
+from builder.model import RobustaPermissionScope, RobustaPermissionGroup, ALL_NAMESPACES
+from builder.scope_optimizer import optimize_scopes, ScopeOptimizationReport
+from builder.permissions import PERMISSIONS, MINIMAL_CLUSTER_MASK, MINIMAL_NAMESPACE_MASK, CLUSTER_MASK, \
+    NAMESPACE_MASK
+from builder.yaml_stream import stream_mapping
 
-MINIMAL_NAMESPACE_PERMISSIONS: List[str] = ["APP_VIEW","JOB_VIEW","TIMELINE_VIEW"]
-MINIMAL_CLUSTER_PERMISSIONS: List[str] = ["APP_VIEW","JOB_VIEW","TIMELINE_VIEW","NODE_VIEW","CLUSTER_VIEW"]
+# namespace for the scope and group ids. Never change it, or every stored id will change
+RBAC_ID_NAMESPACE = uuid.UUID("4f0b5a53-2d1c-4b4e-9a6e-2f3c7d8e9b10")
 
-NAMESPACE_PERMISSIONS: List[str] = ["APP_VIEW","JOB_VIEW","TIMELINE_VIEW","APP_RESTART","JOB_DELETE","POD_LOGS",
-                                    "POD_DELETE","KRR_VIEW","POPEYE_VIEW","METRICS_VIEW"]
-CLUSTER_PERMISSIONS: List[str] = ["APP_VIEW","JOB_VIEW","TIMELINE_VIEW","NODE_VIEW","CLUSTER_VIEW","APP_RESTART",
-                                  "JOB_DELETE","POD_LOGS","POD_DELETE","METRICS_VIEW","NODE_DRAIN","NODE_CORDON",
-                                  "NODE_UNCORDON","CLUSTER_DELETE","KRR_SCAN","KRR_VIEW","POPEYE_VIEW","POPEYE_SCAN",
-                                  "ALERT_CONFIG_EDIT","ALERT_CONFIG_VIEW","SILENCES_VIEW","SILENCES_EDIT"]
+
+def stable_id(account_id: str, entity_type: str, name: str) -> str:
+    """
+    Deterministic id of a scope or group, so re-running the same configuration yields the same ids
+    """
+    return str(uuid.uuid5(RBAC_ID_NAMESPACE, f"{account_id}/{entity_type}/{name}"))
 
 
 class RobustaScopeDefinition(BaseModel):
@@ -36,6 +48,8 @@ class RobustaGroupDefinition(BaseModel):
     provider_group_id: str
     scopes: List[str]
     permissions: List[str]
+    # the expanded permissions, including the minimal permissions. Set when the config is validated
+    _permissions_mask: int = PrivateAttr(default=0)
 
     @field_validator("type", mode="after")
     def validate_type(cls, v):
@@ -43,95 +57,325 @@ class RobustaGroupDefinition(BaseModel):
             raise ValueError("Group type must be either 'namespace' or 'cluster'")
         return v
 
+    @property
+    def permissions_mask(self) -> int:
+        return self._permissions_mask
 
-class ConfigDefinition(BaseModel):
-    account_id: str
-    scopes: List[RobustaScopeDefinition]
-    groups: List[RobustaGroupDefinition]
-
-    @field_validator("scopes", mode="after")
-    def validate_scopes(cls, scopes):
-        if not isinstance(scopes, List):
-            raise ValueError("Scopes must be a list")
-
-        for scope in scopes:
-            if not isinstance(scope, RobustaScopeDefinition):
-                raise ValueError(f"Unknown scope type {type(scope)}")
-
-            if scope.type == "cluster":
-                for cluster_namespaces in scope.clusters.values():
-                    if len(cluster_namespaces) != 1 or "*" not in cluster_namespaces:
-                        raise ValueError("Cluster scope must contain only one '*' and not specific namespaces")
-
-        return scopes
-
-    @field_validator("groups", mode="after")
-    def validate_groups(cls, groups):
-        if not isinstance(groups, List):
-            raise ValueError("Groups must be a list")
-
-        for group in groups:
-            if not isinstance(group, RobustaGroupDefinition):
-                raise ValueError(f"Unknown group type {type(group)}")
 
-            minimal_permissions = MINIMAL_CLUSTER_PERMISSIONS if group.type == "cluster" \
-                else MINIMAL_NAMESPACE_PERMISSIONS
-            all_permissions = CLUSTER_PERMISSIONS if group.type == "cluster" else NAMESPACE_PERMISSIONS
-            group_permissions: List[str] = []
-            group_permissions.extend(minimal_permissions)
-
-            for permission in group.permissions:
-                if permission not in all_permissions:
-                    raise ValueError(f"Unknown permission {permission}")
-                if permission not in group_permissions:
-                    group_permissions.append(permission)
-
-            group.permissions = group_permissions
-
-        return groups
+class RobustaUsersDefinition(BaseModel):
+    """
+    The users groups assignment of the account. Same settings as the ALLOWED_USERS, ACCOUNT_SSO_GROUP,
+    CLUSTER_ADMIN_GROUPS and USERS_EMAIL_DOMAIN env vars
+    """
+    allowed_users: List[str] = []
+    account_sso_group: str = ""
+    cluster_admin_groups: Dict[str, List[str]] = {}
+    email_domain: str = ""
 
     @pydantic.model_validator(mode="after")
-    def validate_config(self):
-        groups = self.groups
-        scopes = {scope.name: scope for scope in self.scopes}
-        for group in groups:
-            for group_scope_name in group.scopes:
-                scope = scopes.get(group_scope_name, None)
-                if not scope:
-                    raise ValueError(f"Group {group.name} scope {group_scope_name} doesn't exist")
-                if group.type == "cluster" and scope.type == "namespace":
-                    raise ValueError(f"Group {group.name} is 'cluster' type. "
-                                     f"Cannot be assigned to namespace scope {group_scope_name}")
+    def validate_users(self):
+        # platform users are not filtered by account, so only the listed users are managed
+        if not self.allowed_users:
+            raise ValueError("allowed_users is required. Platform users of every account would be managed otherwise")
+        names = self.allowed_users + [name for names in self.cluster_admin_groups.values() for name in names]
+        if not self.email_domain and any("@" not in name for name in names):
+            raise ValueError("Users must be listed by email, unless email_domain is set")
         return self
 
 
+def validate_scope_definition(scope: RobustaScopeDefinition):
+    if scope.type == "cluster":
+        for cluster_namespaces in scope.clusters.values():
+            if len(cluster_namespaces) != 1 or ALL_NAMESPACES not in cluster_namespaces:
+                raise ValueError("Cluster scope must contain only one '*' and not specific namespaces")
+    for cluster, cluster_namespaces in scope.clusters.items():
+        for name in [cluster, *cluster_namespaces]:
+            if is_selector(name):
+                validate_selector(name)
+
+
+def expand_group_permissions(group: RobustaGroupDefinition):
+    """
+    Validate the group permissions, and add the minimal permissions of the group type
+    """
+    group_mask = MINIMAL_CLUSTER_MASK if group.type == "cluster" else MINIMAL_NAMESPACE_MASK
+    allowed_mask = CLUSTER_MASK if group.type == "cluster" else NAMESPACE_MASK
+
+    for permission in group.permissions:
+        bit = PERMISSIONS.bit(permission)
+        if bit is None or not bit & allowed_mask:
+            raise ValueError(f"Unknown permission {permission}")
+        group_mask |= bit
+
+    group._permissions_mask = group_mask
+    group.permissions = PERMISSIONS.names(group_mask)
+
+
+def validate_group_scope(group_name: str, group_type: str, scope_name: str, scope_type: Optional[str]):
+    if not scope_type:
+        raise ValueError(f"Group {group_name} scope {scope_name} doesn't exist")
+    if group_type == "cluster" and scope_type == "namespace":
+        raise ValueError(f"Group {group_name} is 'cluster' type. "
+                         f"Cannot be assigned to namespace scope {scope_name}")
+
+
+class ConfigValidationError(ValueError):
+    """
+    All the validation errors found in the configuration
+    """
+
+    def __init__(self, errors: List[str]):
+        self.errors = errors
+        super().__init__(f"{len(errors)} configuration errors:\n" + "\n".join(errors))
+
+
+def validation_messages(error: Exception) -> List[str]:
+    if isinstance(error, pydantic.ValidationError):
+        return [
+            f"{'.'.join(str(loc) for loc in details['loc'])}: {details['msg']}" if details["loc"] else details["msg"]
+            for details in error.errors()
+        ]
+    return [str(error)]
+
+
+class CompiledConfig(BaseModel):
+    """
+    Scopes and groups compiled from one or more configuration files of an account.
+    Groups may reference scopes compiled from other files, so the references are validated when the account
+    configuration is complete
+    """
+    account_id: str = ""
+    scopes: List[RobustaPermissionScope] = []
+    groups: List[RobustaPermissionGroup] = []
+    scope_types: Dict[str, str] = {}
+    # group name -> (group type, scope names)
+    group_scopes: Dict[str, Tuple[str, List[str]]] = {}
+    users: Optional[RobustaUsersDefinition] = None
+    errors: List[str] = []
+
+
+def compile_config_file(config_file_name: str) -> CompiledConfig:
+    """
+    Compile a configuration file, streaming and validating its scopes and groups one at a time.
+    Only the compiled scopes and groups are kept in memory, and all the validation errors are collected
+    """
+    compiled = CompiledConfig()
+    # definitions found before the account_id, which is needed to compile them
+    pending: List[Tuple[str, int, BaseModel]] = []
+
+    def add_error(location: str, error: Exception):
+        compiled.errors.extend(f"{config_file_name}: {location}: {message}" for message in validation_messages(error))
+
+    def compile_definition(key: str, index: int, definition: BaseModel):
+        if key == "scopes":
+            if definition.name in compiled.scope_types:
+                add_error(f"scopes[{index}]", ValueError(f"Scope {definition.name} defined more than once"))
+                return
+            compiled.scope_types[definition.name] = definition.type
+            compiled.scopes.append(RobustaPermissionScope(
+                account_id=compiled.account_id,
+                scope_type=definition.type,
+                scope_id=stable_id(compiled.account_id, "scope", definition.name),
+                name=definition.name,
+                scope_data=definition.clusters
+            ))
+        else:
+            if definition.name in compiled.group_scopes:
+                add_error(f"groups[{index}]", ValueError(f"Group {definition.name} defined more than once"))
+                return
+            compiled.group_scopes[definition.name] = (definition.type, definition.scopes)
+            compiled.groups.append(RobustaPermissionGroup(
+                account_id=compiled.account_id,
+                group_id=stable_id(compiled.account_id, "group", definition.name),
+                provider_group_id=definition.provider_group_id,
+                name=definition.name,
+                scope_type=definition.type,
+                # scope ids are derived from the scope names, so they're known before the scopes are compiled
+                scopes=[stable_id(compiled.account_id, "scope", scope) for scope in definition.scopes],
+                permissions=definition.permissions
+            ))
+
+    indexes = {"scopes": 0, "groups": 0}
+    try:
+        with open(config_file_name, "r") as conf_file:
+            for key, value in stream_mapping(conf_file, list_keys=indexes.keys()):
+                if key == "account_id":
+                    compiled.account_id = str(value) if value else ""
+                    for pending_definition in pending:
+                        compile_definition(*pending_definition)
+                    pending = []
+                    continue
+                if key == "users":
+                    try:
+                        compiled.users = RobustaUsersDefinition.model_validate(value)
+                    except pydantic.ValidationError as e:
+                        add_error("users", e)
+                    continue
+                if key not in indexes:
+                    continue
+
+                index = indexes[key]
+                indexes[key] += 1
+                try:
+                    if key == "scopes":
+                        definition = RobustaScopeDefinition.model_validate(value)
+                        validate_scope_definition(definition)
+                    else:
+                        definition = RobustaGroupDefinition.model_validate(value)
+                        expand_group_permissions(definition)
+                except (pydantic.ValidationError, ValueError) as e:
+                    add_error(f"{key}[{index}]", e)
+                    continue
+
+                if compiled.account_id:
+                    compile_definition(key, index, definition)
+                else:
+                    pending.append((key, index, definition))
+    except yaml.YAMLError as e:
+        add_error("yaml", e)
+
+    if not compiled.account_id:
+        add_error("account_id", ValueError("Account id not found in configuration file."))
+    return compiled
+
+
+def merge_compiled_configs(compiled_configs: List[CompiledConfig]) -> Dict[str, CompiledConfig]:
+    """
+    Merge the compiled configuration files of every account, and run the account level validations.
+    Raises ConfigValidationError with the errors of all the files
+    """
+    errors: List[str] = []
+    accounts: Dict[str, CompiledConfig] = {}
+    for compiled in compiled_configs:
+        errors.extend(compiled.errors)
+        if not compiled.account_id:
+            continue
+
+        account = accounts.setdefault(compiled.account_id, CompiledConfig(account_id=compiled.account_id))
+        for scope in compiled.scopes:
+            if scope.name in account.scope_types:
+                errors.append(f"Scope {scope.name} defined more than once for account {account.account_id}")
+            account.scope_types[scope.name] = scope.scope_type
+        for group in compiled.groups:
+            if group.name in account.group_scopes:
+                errors.append(f"Group {group.name} defined more than once for account {account.account_id}")
+        if compiled.users is not None:
+            if account.users is not None:
+                errors.append(f"Users defined more than once for account {account.account_id}")
+            account.users = compiled.users
+        account.scopes.extend(compiled.scopes)
+        account.groups.extend(compiled.groups)
+        account.group_scopes.update(compiled.group_scopes)
+
+    for account in accounts.values():
+        for group_name, (group_type, scope_names) in account.group_scopes.items():
+            for scope_name in scope_names:
+                try:
+                    validate_group_scope(group_name, group_type, scope_name, account.scope_types.get(scope_name))
+                except ValueError as e:
+                    errors.append(f"Account {account.account_id}: {e}")
+
+    if errors:
+        raise ConfigValidationError(errors)
+    return accounts
+
+
+def find_config_files(config_path: str) -> List[str]:
+    """
+    config_path is either a configuration file, a directory of yaml files or a glob pattern
+    """
+    if os.path.isdir(config_path):
+        file_names = glob.glob(os.path.join(config_path, "*.yaml")) + glob.glob(os.path.join(config_path, "*.yml"))
+    elif os.path.isfile(config_path):
+        file_names = [config_path]
+    else:
+        file_names = glob.glob(config_path, recursive=True)
+
+    if not file_names:
+        raise Exception(f"No configuration files found in {config_path}")
+    return sorted(file_names)
+
+
+def load_account_configs(
+        config_path: str,
+        max_workers: Optional[int] = None,
+        merge_scopes: bool = False,
+        inventory: Optional[ClusterInventory] = None,
+) -> Dict[str, "ConfigBuilder"]:
+    """
+    Read all the configuration files in config_path, and build the configuration of every account.
+    Files are compiled in parallel, in a process pool.
+    Scopes cluster and namespace selectors are resolved against the inventory.
+    If merge_scopes is set, identical scopes of an account are merged into one
+    """
+    file_names = find_config_files(config_path)
+    logging.info(f"Reading {len(file_names)} configuration files from {config_path}")
+    with METRICS.phase("parse_validate"):
+        if len(file_names) == 1 or max_workers == 1:
+            compiled_configs = [compile_config_file(file_name) for file_name in file_names]
+        else:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                compiled_configs = list(executor.map(compile_config_file, file_names))
+
+    with METRICS.phase("merge_validate"):
+        merged = merge_compiled_configs(compiled_configs)
+    with METRICS.phase("optimize_scopes"):
+        configs = {
+            account_id: ConfigBuilder.from_compiled(compiled, merge_scopes=merge_scopes, inventory=inventory)
+            for account_id, compiled in merged.items()
+        }
+    if inventory:
+        inventory.save_cache()
+    return configs
+
+
 class ConfigBuilder:
 
-    def __init__(self, config_file_name: str):
-        with open(config_file_name, "r") as conf_file:
-            yaml_content = yaml.safe_load(conf_file)
-            self.config = ConfigDefinition(**yaml_content)
-
-        self.account_id = self.config.account_id
-        self.scopes = [RobustaPermissionScope(
-            account_id=self.account_id,
-            scope_type=scope.type,
-            scope_id=str(uuid.uuid4()),
-            name=scope.name,
-            scope_data=scope.clusters
-        ) for scope in self.config.scopes]
-
-        scopes_by_name = {scope.name: scope for scope in self.scopes}
-
-        self.groups = [RobustaPermissionGroup(
-            account_id=self.account_id,
-            group_id=str(uuid.uuid4()),
-            provider_group_id=group.provider_group_id,
-            name=group.name,
-            scope_type=group.type,
-            scopes=[scopes_by_name[scope].scope_id for scope in group.scopes],  # convert to reference by id
-            permissions=group.permissions
-        ) for group in self.config.groups]
+    def __init__(
+            self,
+            config_file_name: str,
+            merge_scopes: bool = False,
+            inventory: Optional[ClusterInventory] = None,
+    ):
+        compiled = merge_compiled_configs([compile_config_file(config_file_name)])
+        self.__build(next(iter(compiled.values())), optimize=True, merge_scopes=merge_scopes, inventory=inventory)
+
+    @classmethod
+    def from_compiled(
+            cls,
+            compiled: CompiledConfig,
+            optimize: bool = True,
+            merge_scopes: bool = False,
+            inventory: Optional[ClusterInventory] = None,
+    ) -> "ConfigBuilder":
+        """
+        Scopes selectors are expanded, and scopes are normalized, unless optimize is unset, for configurations that
+        were already optimized when compiled
+        """
+        builder = cls.__new__(cls)
+        builder.__build(compiled, optimize, merge_scopes, inventory)
+        return builder
+
+    def __build(
+            self,
+            compiled: CompiledConfig,
+            optimize: bool,
+            merge_scopes: bool,
+            inventory: Optional[ClusterInventory] = None,
+    ):
+        self.account_id = compiled.account_id
+        self.scopes = compiled.scopes
+        self.groups = compiled.groups
+        self.users = compiled.users
+        self.optimization_report: Optional[ScopeOptimizationReport] = None
+        if optimize:
+            self.scopes, errors = expand_scopes(self.scopes, inventory)
+            if errors:
+                raise ConfigValidationError(errors)
+            self.scopes, self.groups, self.optimization_report = optimize_scopes(
+                self.account_id, self.scopes, self.groups, merge_scopes
+            )
+            logging.info(f"Account {self.account_id} {self.optimization_report.summary()}")
 
     def get_scopes(self) -> List[RobustaPermissionScope]:
         return self.scopes
@@ -140,4 +384,47 @@ class ConfigBuilder:
         return self.groups
 
     def get_account_id(self) -> str:
-        return self.account_id
\ No newline at end of file
+        return self.account_id
+
+    def get_users_config(self) -> Optional[Dict]:
+        """
+        The UsersGroupsSync settings of the account, if set in its configuration
+        """
+        return self.users.model_dump() if self.users is not None else None
+
+
+def env_users_config() -> Optional[Dict]:
+    # without any users configuration, users groups are managed elsewhere and must not be touched
+    if not (ALLOWED_USERS or CLUSTER_ADMIN_GROUPS or ACCOUNT_SSO_GROUP):
+        return None
+    try:
+        users = RobustaUsersDefinition(
+            allowed_users=ALLOWED_USERS,
+            cluster_admin_groups=CLUSTER_ADMIN_GROUPS,
+            account_sso_group=ACCOUNT_SSO_GROUP,
+            email_domain=USERS_EMAIL_DOMAIN,
+        )
+    except pydantic.ValidationError as e:
+        raise ConfigValidationError([f"Users env vars: {message}" for message in validation_messages(e)])
+    return users.model_dump()
+
+
+def accounts_users_configs(configs: Dict[str, ConfigBuilder]) -> Dict[str, Optional[Dict]]:
+    """
+    The users configuration of every account, None if its users groups are not managed.
+    Users groups are synced only if SYNC_USERS_GROUPS is set. Platform users are not filtered by account, so the
+    env vars users configuration is used only when a single account is configured. With several accounts, every
+    account sets its users in its configuration
+    """
+    if not SYNC_USERS_GROUPS:
+        if env_users_config() or any(config_reader.get_users_config() for config_reader in configs.values()):
+            logging.warning("Users are configured, but SYNC_USERS_GROUPS isn't set. Users groups are not synced")
+        return {account_id: None for account_id in configs}
+
+    env_config = env_users_config()
+    if env_config and len(configs) > 1:
+        raise ConfigValidationError(["ALLOWED_USERS, ACCOUNT_SSO_GROUP and CLUSTER_ADMIN_GROUPS can't be used with "
+                                     "multiple accounts. Set the users of every account in its configuration instead"])
+    return {
+        account_id: config_reader.get_users_config() or env_config for account_id, config_reader in configs.items()
+    }
@@ -0,0 +1,295 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from typing import Callable, Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from builder.config_builder import ConfigBuilder, find_config_files
+from builder.metrics import METRICS
+from builder.runner import RbacRunner, AccountResult, log_results, FAILED, UNCHANGED, APPLIED
+
+INVALID_CONFIG = "invalid_config"
+
+
+class ConfigWatcher:
+    """
+    Detects changes of the configuration files by polling them.
+    The files modification times and sizes are checked on every poll, and their content is hashed only once those
+    stopped changing for debounce seconds. Saving a file without changing it is not a change
+    """
+
+    def __init__(self, config_path: str, debounce: float, extra_files: Optional[List[str]] = None):
+        self.config_path = config_path
+        self.debounce = debounce
+        # other files the configuration depends on
+        self.extra_files = extra_files or []
+        self.stats: Optional[Tuple] = None
+        # when the files were last seen changing, if the change wasn't reported yet
+        self.changed_at: Optional[float] = None
+        self.content_hash: Optional[str] = None
+
+    def __stats(self) -> Tuple:
+        try:
+            file_names = find_config_files(self.config_path)
+        except Exception:
+            # no configuration files, for example while they're replaced
+            file_names = []
+        file_names = file_names + self.extra_files
+        stats = []
+        for file_name in file_names:
+            try:
+                stat = os.stat(file_name)
+            except FileNotFoundError:
+                continue
+            stats.append((file_name, stat.st_mtime_ns, stat.st_size))
+        return tuple(stats)
+
+    @staticmethod
+    def __hash(stats: Tuple) -> str:
+        digest = hashlib.sha256()
+        for file_name, _, _ in stats:
+            digest.update(file_name.encode())
+            try:
+                with open(file_name, "rb") as config_file:
+                    for chunk in iter(lambda: config_file.read(1 << 20), b""):
+                        digest.update(chunk)
+            except FileNotFoundError:
+                continue
+        return digest.hexdigest()
+
+    def poll(self) -> bool:
+        """
+        True if the configuration content changed since the last reported change, and the files weren't modified
+        in the last debounce seconds. The first poll after the debounce period always reports a change
+        """
+        stats = self.__stats()
+        now = time.monotonic()
+        if stats != self.stats:
+            self.stats = stats
+            self.changed_at = now
+            return False
+        if self.changed_at is None or now - self.changed_at < self.debounce:
+            return False
+
+        self.changed_at = None
+        content_hash = self.__hash(stats)
+        if content_hash == self.content_hash:
+            return False
+        self.content_hash = content_hash
+        return True
+
+
+class DaemonStatus(BaseModel):
+    started_at: float
+    config_hash: Optional[str] = None
+    last_poll_at: Optional[float] = None
+    applying: bool = False
+    last_apply_at: Optional[float] = None
+    last_apply_reason: Optional[str] = None
+    # applied, unchanged, failed or invalid_config
+    last_apply_status: Optional[str] = None
+    last_apply_duration: float = 0
+    last_error: Optional[str] = None
+    applies: int = 0
+    failures: int = 0
+    accounts: List[AccountResult] = []
+
+
+class RbacDaemon:
+    """
+    Applies the configuration whenever it changes, and periodically, to fix changes made outside the builder.
+    The runner, and its platform session, are kept between applies, so an apply doesn't sign in again.
+    Accounts whose configuration didn't change are not applied again, and the reconciler writes only the changed
+    scopes and groups of the others.
+    A failed apply is retried after retry_backoff seconds, doubled after every failed retry up to retry_max_backoff
+    """
+
+    def __init__(
+            self,
+            runner: RbacRunner,
+            load_configs: Callable[[], Dict[str, ConfigBuilder]],
+            watcher: ConfigWatcher,
+            poll_interval: float,
+            resync_interval: float = 0,
+            retry_backoff: float = 10,
+            retry_max_backoff: float = 600,
+            on_applied: Optional[Callable[[List[AccountResult]], None]] = None,
+    ):
+        self.runner = runner
+        self.load_configs = load_configs
+        self.watcher = watcher
+        self.poll_interval = poll_interval
+        self.resync_interval = resync_interval
+        self.retry_backoff = retry_backoff
+        self.retry_max_backoff = retry_max_backoff
+        self.on_applied = on_applied
+        self.stop_event = threading.Event()
+        self.lock = threading.Lock()
+        self.status = DaemonStatus(started_at=time.time())
+        self.last_apply_time = time.monotonic()
+        # when to retry the last failed apply, and the delay of the next retry
+        self.retry_at: Optional[float] = None
+        self.retry_delay = retry_backoff
+        self.retry_force = False
+
+    def get_status(self) -> DaemonStatus:
+        with self.lock:
+            return self.status.model_copy(deep=True)
+
+    def healthy(self) -> bool:
+        """
+        The daemon is healthy while it polls the configuration. A long apply doesn't make it unhealthy
+        """
+        with self.lock:
+            if self.status.applying:
+                return True
+            last_poll_at = self.status.last_poll_at or self.status.started_at
+        return time.time() - last_poll_at < max(60.0, 3 * self.poll_interval)
+
+    def __apply(self, force: bool) -> Tuple[str, Optional[str], List[AccountResult]]:
+        try:
+            configs = self.load_configs()
+        except Exception as e:
+            # the last applied configuration stays in place until the configuration is fixed
+            logging.exception("Invalid rbac configuration, not applying it")
+            return INVALID_CONFIG, str(e), []
+
+        try:
+            results = self.runner.run(configs, force=force)
+        except Exception as e:
+            logging.exception("Error applying the rbac configuration")
+            return FAILED, str(e), []
+
+        if any(result.status == FAILED for result in results):
+            status = FAILED
+        elif all(result.status == UNCHANGED for result in results):
+            status = UNCHANGED
+        else:
+            status = APPLIED
+        return status, next((result.error for result in results if result.error), None), results
+
+    def apply(self, reason: str, force: bool = False) -> List[AccountResult]:
+        logging.info(f"Applying the rbac configuration: {reason}")
+        start = time.time()
+        self.last_apply_time = time.monotonic()
+        with self.lock:
+            self.status.applying = True
+            self.status.last_apply_reason = reason
+        with METRICS.run():
+            status, error, results = self.__apply(force)
+
+        if results:
+            log_results(results)
+            if self.on_applied:
+                try:
+                    self.on_applied(results)
+                except Exception:
+                    logging.exception("Error handling the applied results")
+
+        self.__schedule_retry(status, force)
+        with self.lock:
+            self.status.applying = False
+            self.status.last_apply_at = start
+            self.status.last_apply_status = status
+            self.status.last_apply_duration = round(time.time() - start, 3)
+            self.status.last_error = error
+            self.status.applies += 1
+            self.status.failures += status in (FAILED, INVALID_CONFIG)
+            self.status.accounts = results
+        return results
+
+    def __schedule_retry(self, status: str, force: bool):
+        if status != FAILED:
+            # an invalid configuration is applied again only once it changes
+            self.retry_at = None
+            self.retry_delay = self.retry_backoff
+            self.retry_force = False
+            return
+        logging.info(f"Retrying the failed apply in {self.retry_delay}s")
+        self.retry_at = time.monotonic() + self.retry_delay
+        self.retry_delay = min(self.retry_delay * 2, self.retry_max_backoff)
+        # accounts skipped by a forced apply only because their configuration didn't change must be retried too
+        self.retry_force = self.retry_force or force
+
+    def run(self):
+        logging.info(f"Watching {self.watcher.config_path} every {self.poll_interval}s")
+        while not self.stop_event.is_set():
+            with self.lock:
+                self.status.last_poll_at = time.time()
+            try:
+                if self.watcher.poll():
+                    with self.lock:
+                        self.status.config_hash = self.watcher.content_hash
+                    self.apply("configuration changed")
+                elif self.resync_interval and time.monotonic() - self.last_apply_time >= self.resync_interval:
+                    self.apply("periodic resync", force=True)
+                elif self.retry_at is not None and time.monotonic() >= self.retry_at:
+                    self.apply("retrying the failed apply", force=self.retry_force)
+            except Exception:
+                logging.exception("Error in the rbac daemon loop")
+            self.stop_event.wait(self.poll_interval)
+        logging.info("Rbac daemon stopped")
+
+    def stop(self):
+        self.stop_event.set()
+
+
+class StatusServer:
+    """
+    Local http endpoints of the daemon:
+    /healthz - 200 while the daemon is running, 503 otherwise
+    /status - json status of the last apply
+    /metrics - run metrics, in prometheus text format
+    """
+
+    def __init__(self, daemon: RbacDaemon, host: str, port: int):
+        self.daemon = daemon
+        self.server = ThreadingHTTPServer((host, port), self.__handler())
+        self.server.daemon_threads = True
+        self.thread: Optional[threading.Thread] = None
+
+    def start(self) -> "StatusServer":
+        host, port = self.server.server_address[:2]
+        logging.info(f"Serving the daemon status on http://{host}:{port}")
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __handler(self):
+        daemon = self.daemon
+
+        class Handler(BaseHTTPRequestHandler):
+
+            def log_message(self, format, *args):
+                logging.debug(f"Status request {format % args}")
+
+            def __send(self, status: int, body: str, content_type: str):
+                content = body.encode()
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(content)))
+                self.end_headers()
+                self.wfile.write(content)
+
+            def do_GET(self):
+                path = self.path.split("?")[0]
+                if path == "/healthz":
+                    healthy = daemon.healthy()
+                    self.__send(200 if healthy else 503, "ok\n" if healthy else "unhealthy\n", "text/plain")
+                elif path == "/status":
+                    self.__send(200, json.dumps(daemon.get_status().model_dump(), indent=2), "application/json")
+                elif path == "/metrics":
+                    self.__send(200, METRICS.prometheus(), "text/plain; version=0.0.4")
+                else:
+                    self.__send(404, "not found\n", "text/plain")
+
+        return Handler
@@ -17,16 +17,98 @@ VIEWER_PERMISSIONS: List[str] = os.environ.get(
     "APP_VIEW,JOB_VIEW,TIMELINE_VIEW,POD_LOGS,METRICS_VIEW,KRR_VIEW,POPEYE_VIEW").split(",")
 
 # db store
+# storage backend:
+# supabase - the Robusta platform DB
+# memory - in memory tables, discarded when the run ends. For profiling and tests
+# sqlite - a local SQLite database file, at STORE_SQLITE_PATH
+STORE_BACKEND = os.environ.get("STORE_BACKEND", "supabase")
+STORE_SQLITE_PATH = os.environ.get("STORE_SQLITE_PATH", "rbac-builder.db")
 STORE_URL = os.environ.get("STORE_URL", "")
 STORE_API_KEY = os.environ.get("STORE_API_KEY", "")
 STORE_USER = os.environ.get("STORE_USER", "")
 STORE_PASSWORD = os.environ.get("STORE_PASSWORD", "")
+# max rows sent in a single bulk upsert or delete request
+STORE_BATCH_SIZE = int(os.environ.get("STORE_BATCH_SIZE", "500"))
+# max rows read in a single request
+STORE_PAGE_SIZE = int(os.environ.get("STORE_PAGE_SIZE", "1000"))
+# max concurrent write requests. 1 means all the writes are sent sequentially
+STORE_MAX_CONCURRENCY = int(os.environ.get("STORE_MAX_CONCURRENCY", "1"))
+# http connection pool used for rpc calls
+STORE_HTTP_POOL_SIZE = int(os.environ.get("STORE_HTTP_POOL_SIZE", "10"))
+STORE_HTTP_TIMEOUT = float(os.environ.get("STORE_HTTP_TIMEOUT", "60"))
+# retries of requests failing on a transient error (throttling, 5xx, connection errors), with a jittered exponential
+# backoff starting at STORE_HTTP_BACKOFF seconds
+STORE_HTTP_RETRIES = int(os.environ.get("STORE_HTTP_RETRIES", "3"))
+STORE_HTTP_BACKOFF = float(os.environ.get("STORE_HTTP_BACKOFF", "0.5"))
+# max requests per second. Halved when the platform throttles (429, 5xx), and raised back gradually. 0 disables it
+STORE_RATE_LIMIT = float(os.environ.get("STORE_RATE_LIMIT", "100"))
+STORE_MIN_RATE_LIMIT = float(os.environ.get("STORE_MIN_RATE_LIMIT", "1"))
+
+# configuration file, directory of yaml files, or glob pattern. Files may define several accounts
+CONFIG_PATH = os.environ.get("CONFIG_PATH", "../config/definitions.yaml")
+# processes used to parse and validate the configuration files. Defaults to the number of cpus
+CONFIG_PARSE_WORKERS = int(os.environ.get("CONFIG_PARSE_WORKERS", "0")) or None
+# merge scopes of the same type with the same clusters and namespaces into a single scope, and point their groups
+# to it. Scope data is always normalized: sorted, without duplicate namespaces, and collapsed to '*' if listed
+DEDUPE_SCOPES = os.environ.get("DEDUPE_SCOPES", "false").lower() == "true"
+# clusters, and their namespaces, that scope selectors (globs, or regular expressions starting with 're:') are
+# resolved against. yaml or json: {"clusters": {"cluster-name": ["namespace", ...]}}
+CLUSTER_INVENTORY_FILE = os.environ.get("CLUSTER_INVENTORY_FILE", "")
+# resolved selectors, reused until the inventory changes
+CLUSTER_INVENTORY_CACHE_FILE = os.environ.get("CLUSTER_INVENTORY_CACHE_FILE", "")
+# accounts applied concurrently
+ACCOUNTS_CONCURRENCY = int(os.environ.get("ACCOUNTS_CONCURRENCY", "4"))
+
+# how to apply the configuration:
+# incremental - diff against the stored scopes and groups, and write only the changes
+# atomic - send the whole account configuration in a single transactional rpc call
+APPLY_MODE = os.environ.get("APPLY_MODE", "incremental")
+
+# local file with the fingerprint of the last applied configuration. If set, and the configuration didn't change
+# since the last successful apply, nothing is applied
+APPLIED_FINGERPRINT_FILE = os.environ.get("APPLIED_FINGERPRINT_FILE", "")
+FORCE_APPLY = os.environ.get("FORCE_APPLY", "false").lower() == "true"
+# exit code when the apply is skipped because the configuration didn't change
+UNCHANGED_EXIT_CODE = int(os.environ.get("UNCHANGED_EXIT_CODE", "0"))
+
+# local snapshot of the stored scopes, groups and users groups, used by the plan command. Not kept if not set.
+# It holds the users emails, so it's readable by its owner only
+STATE_SNAPSHOT_FILE = os.environ.get("STATE_SNAPSHOT_FILE", "")
+# accounts states in the snapshot younger than this (in seconds) are reused instead of read again
+STATE_SNAPSHOT_MAX_AGE = float(os.environ.get("STATE_SNAPSHOT_MAX_AGE", "300"))
+# plans based on states older than this (in seconds) are rejected by apply --plan
+PLAN_MAX_AGE = float(os.environ.get("PLAN_MAX_AGE", "3600"))
+
+# daemon command: apply the configuration whenever it changes
+# seconds between checks of the configuration files
+DAEMON_POLL_INTERVAL = float(os.environ.get("DAEMON_POLL_INTERVAL", "5"))
+# seconds the configuration files must stay unchanged before applying them, so a change saved in parts, or a git
+# checkout, is applied once
+DAEMON_DEBOUNCE = float(os.environ.get("DAEMON_DEBOUNCE", "2"))
+# seconds between full applies, even if the configuration didn't change. 0 disables them
+DAEMON_RESYNC_INTERVAL = float(os.environ.get("DAEMON_RESYNC_INTERVAL", "3600"))
+# seconds before retrying a failed apply. Doubled after every failed retry, up to DAEMON_RETRY_MAX_BACKOFF
+DAEMON_RETRY_BACKOFF = float(os.environ.get("DAEMON_RETRY_BACKOFF", "10"))
+DAEMON_RETRY_MAX_BACKOFF = float(os.environ.get("DAEMON_RETRY_MAX_BACKOFF", "600"))
+# local status http endpoint (/healthz, /status, /metrics). Port 0 disables it
+DAEMON_STATUS_HOST = os.environ.get("DAEMON_STATUS_HOST", "127.0.0.1")
+DAEMON_STATUS_PORT = int(os.environ.get("DAEMON_STATUS_PORT", "8080"))
+
+# run metrics: wall time per phase, requests per storage method and table, and rows changed
+# json summary file
+METRICS_FILE = os.environ.get("METRICS_FILE", "")
+# prometheus text format file, for the node exporter textfile collector, or to push to a Pushgateway
+METRICS_PROMETHEUS_FILE = os.environ.get("METRICS_PROMETHEUS_FILE", "")
 
 # robusta platform
 ACCOUNT_NAME = os.environ.get("ACCOUNT_NAME", "")
 ACCOUNT_SSO_GROUP = os.environ.get("ACCOUNT_SSO_GROUP", "")
 
+# users groups are synced only if set, and only for the allowed users
+SYNC_USERS_GROUPS = os.environ.get("SYNC_USERS_GROUPS", "false").lower() == "true"
 ALLOWED_USERS = [user.strip() for user in os.environ.get("ALLOWED_USERS", "").split(",") if user]
+# users listed by their email name (before the '@') match only emails of this domain
+USERS_EMAIL_DOMAIN = os.environ.get("USERS_EMAIL_DOMAIN", "")
 CLUSTER_ADMIN_GROUPS_VAR = os.environ.get("CLUSTER_ADMIN_GROUPS", "")
 
 # format is: "eu-at-5:arik,natan,christine|eu-at-10:xxx,yyy,zzz"
@@ -0,0 +1,35 @@
+import gzip
+import os
+from contextlib import contextmanager
+from typing import IO, Iterator
+
+
+def open_text(file_name: str, mode: str) -> IO:
+    """
+    Open a utf-8 text file. Files ending with .gz are gzip compressed
+    """
+    if file_name.endswith(".gz"):
+        return gzip.open(file_name, mode + "t", encoding="utf-8")
+    return open(file_name, mode, encoding="utf-8")
+
+
+@contextmanager
+def atomic_text_file(file_name: str, private: bool = False) -> Iterator[IO]:
+    """
+    Write a text file through a temporary file, replacing the file only once it's completely written.
+    A crash never leaves a half written file behind, and readers never see one.
+    Private files are readable and writable by their owner only
+    """
+    # keep the extension, so the temporary file is compressed the same way
+    temp_file_name = f"{file_name}.tmp.gz" if file_name.endswith(".gz") else f"{file_name}.tmp"
+    try:
+        if private:
+            # created with the owner permissions, so the content is never readable by others, even briefly
+            os.close(os.open(temp_file_name, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600))
+            os.chmod(temp_file_name, 0o600)
+        with open_text(temp_file_name, "w") as temp_file:
+            yield temp_file
+        os.replace(temp_file_name, file_name)
+    finally:
+        if os.path.exists(temp_file_name):
+            os.remove(temp_file_name)
@@ -0,0 +1,92 @@
+import hashlib
+import json
+import logging
+import threading
+from typing import List, Dict, Optional
+
+from builder.file_utils import atomic_text_file
+from builder.model import RobustaPermissionScope, RobustaPermissionGroup
+from builder.permissions import PERMISSIONS
+
+
+def config_fingerprint(
+        account_id: str,
+        scopes: List[RobustaPermissionScope],
+        groups: List[RobustaPermissionGroup]
+) -> str:
+    """
+    Content hash of the compiled configuration. It doesn't depend on the order of scopes, groups, namespaces or
+    permissions in the configuration file
+    """
+    content = {
+        "account_id": account_id,
+        "scopes": sorted(
+            [
+                scope.scope_type, scope.scope_id, scope.name,
+                sorted([cluster, sorted(namespaces)] for cluster, namespaces in scope.scope_data.items())
+            ]
+            for scope in scopes
+        ),
+        "groups": sorted(
+            [
+                group.group_id, group.provider_group_id, group.name, group.scope_type,
+                sorted(group.scopes), PERMISSIONS.names(group.permissions_mask)
+            ]
+            for group in groups
+        ),
+    }
+    return hashlib.sha256(json.dumps(content, separators=(",", ":")).encode()).hexdigest()
+
+
+class FingerprintStore:
+    """
+    Fingerprints of the last successfully applied configuration of every account, kept in a local json file
+    """
+
+    def __init__(self, file_name: str):
+        self.file_name = file_name
+        # accounts may be applied concurrently
+        self.lock = threading.Lock()
+
+    def __load(self) -> Dict[str, str]:
+        try:
+            with open(self.file_name, "r") as state_file:
+                return json.load(state_file)
+        except FileNotFoundError:
+            return {}
+        except Exception:
+            logging.warning(f"Failed to read applied fingerprints from {self.file_name}", exc_info=True)
+            return {}
+
+    def get(self, account_id: str) -> Optional[str]:
+        return self.__load().get(account_id)
+
+    def save(self, account_id: str, fingerprint: str):
+        with self.lock:
+            fingerprints = self.__load()
+            fingerprints[account_id] = fingerprint
+            with atomic_text_file(self.file_name) as state_file:
+                json.dump(fingerprints, state_file)
+
+
+class MemoryFingerprintStore:
+    """
+    Fingerprints of the configurations applied by the current process, for long running processes without a
+    fingerprint file
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.fingerprints: Dict[str, str] = {}
+
+    def get(self, account_id: str) -> Optional[str]:
+        with self.lock:
+            return self.fingerprints.get(account_id)
+
+    def save(self, account_id: str, fingerprint: str):
+        with self.lock:
+            self.fingerprints[account_id] = fingerprint
+
+    def clear(self):
+        with self.lock:
+            self.fingerprints.clear()
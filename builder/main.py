@@ -9,58 +9,391 @@ if add_custom_certificate(ADDITIONAL_CERTIFICATE):
 
 # DO NOT ADD IMPORTS ABOVE THIS LINE. IT MAY CAUSE CACHED HTTP CLIENT WHICH DOESN'T RESPECT CUSTOM CERTIFICATES
 
-from builder.config_builder import ConfigBuilder
+import argparse
 import logging
-from typing import Optional
+import signal
+import time
+from typing import Optional, Dict, List
 
-from builder.env_vars import LOG_LEVEL
-from builder.robusta_store import RobustaStore
+from builder.cluster_inventory import ClusterInventory, load_inventory
+from builder.config_builder import load_account_configs, ConfigBuilder, ConfigValidationError, accounts_users_configs
+from builder.env_vars import LOG_LEVEL, APPLIED_FINGERPRINT_FILE, UNCHANGED_EXIT_CODE, CONFIG_PATH, \
+    CONFIG_PARSE_WORKERS, ACCOUNTS_CONCURRENCY, METRICS_FILE, METRICS_PROMETHEUS_FILE, STATE_SNAPSHOT_FILE, \
+    STATE_SNAPSHOT_MAX_AGE, PLAN_MAX_AGE, DEDUPE_SCOPES, DAEMON_POLL_INTERVAL, DAEMON_DEBOUNCE, \
+    DAEMON_RESYNC_INTERVAL, DAEMON_RETRY_BACKOFF, DAEMON_RETRY_MAX_BACKOFF, DAEMON_STATUS_HOST, DAEMON_STATUS_PORT, \
+    CLUSTER_INVENTORY_FILE, CLUSTER_INVENTORY_CACHE_FILE
+from builder.metrics import METRICS, write_metrics, log_metrics
 
 logging.basicConfig(format='%(asctime)s.%(msecs)03d %(levelname)-8s %(message)s', level=logging.INFO,
                     datefmt='%Y-%m-%d %H:%M:%S')
 logging.getLogger().setLevel(LOG_LEVEL)
 logging.info(f'logger initialized using {LOG_LEVEL} log level')
 
+# Only the modules every command needs are imported here, so validate loads just the configuration modules.
+# The other commands import the platform, runner and state modules they use
+
 # Pseudo code:
 #
-# Read the account_id, scopes and groups configuration file
-# generate uuids for scopes
-# generate uuids for groups
+# Read the configuration files, and merge them by account_id (or load a precompiled artifact, or a saved plan)
+# for every account:
+# generate stable uuids for scopes (derived from the account id and scope name)
+# generate stable uuids for groups (derived from the account id and group name)
 # update groups to scope mapping to be by uuid (not by name as in the config)
-# delete all existing groups and scopes
-# persist new scopes and groups
+# if the configuration fingerprint matches the last applied one, skip applying it
+# read the existing scopes and groups of the account
+# diff them by name against the configuration
+# persist only the created, updated and deleted scopes and groups
+# if users are configured, assign users to groups, and persist only the users whose groups changed
 
-if __name__ == '__main__':
-    logging.info("Running rbac builder...")
-    robusta_store: Optional[RobustaStore] = None
+
+def load_cluster_inventory() -> Optional[ClusterInventory]:
+    if not CLUSTER_INVENTORY_FILE:
+        return None
+    return load_inventory(CLUSTER_INVENTORY_FILE, CLUSTER_INVENTORY_CACHE_FILE)
+
+
+def load_configs(args) -> Dict[str, ConfigBuilder]:
+    if getattr(args, "artifact", None):
+        from builder.artifact import read_artifact
+        logging.info(f"Loading compiled artifact {args.artifact}")
+        with METRICS.phase("read_artifact"):
+            return read_artifact(args.artifact)
+    # read scopes and groups from the configuration, for every account
+    return load_account_configs(
+        args.config, max_workers=CONFIG_PARSE_WORKERS, merge_scopes=DEDUPE_SCOPES, inventory=load_cluster_inventory()
+    )
+
+
+def run_validate(args) -> int:
+    # validates only. The platform client and the network stack are never imported
+    try:
+        configs = load_configs(args)
+        accounts_users_configs(configs)
+    except ConfigValidationError as e:
+        logging.error(str(e))
+        return 1
+    for account_id, config_reader in configs.items():
+        logging.info(f"Account {account_id} is valid: {len(config_reader.get_scopes())} scopes, "
+                     f"{len(config_reader.get_groups())} groups")
+    return 0
+
+
+def run_compile(args) -> int:
+    from builder.artifact import write_artifact
+    configs = load_configs(args)
+    with METRICS.phase("write_artifact"):
+        write_artifact(configs, args.output)
+    logging.info(f"Compiled {len(configs)} accounts to {args.output}")
+    return 0
+
+
+def run_plan(args) -> int:
+    from builder.plan import compute_account_plan, format_plan, write_plans
+    from builder.robusta_store import RobustaStore
+    from builder.state_snapshot import load_account_states
+    configs = load_configs(args)
+    with METRICS.phase("read_state"):
+        states = load_account_states(
+            list(configs.keys()),
+            store_factory=RobustaStore,
+            snapshot_file=args.snapshot,
+            max_age=STATE_SNAPSHOT_MAX_AGE,
+            refresh=args.refresh,
+        )
+
+    with METRICS.phase("diff"):
+        users_configs = accounts_users_configs(configs)
+        plans = [
+            compute_account_plan(config_reader, states[account_id], users_configs[account_id])
+            for account_id, config_reader in configs.items()
+        ]
+
+    for plan in plans:
+        print("\n".join(format_plan(plan, states[plan.account_id])))
+    print(f"Plan: {sum(not plan.is_empty() for plan in plans)} of {len(plans)} accounts changed")
+
+    if args.output:
+        write_plans(plans, args.output)
+        logging.info(f"Saved the plan to {args.output}. Apply it with: apply --plan {args.output}")
+    return 0
+
+
+def run_query(args) -> int:
+    from builder.permission_index import PermissionIndex, find_widening, read_users_groups
+    from builder.robusta_store import RobustaStore
+    configs = load_configs(args)
+    if args.account:
+        if args.account not in configs:
+            raise Exception(f"Account {args.account} not found in the configuration")
+        configs = {args.account: configs[args.account]}
+
+    users_groups: Dict[str, Dict] = {}
+    if args.users:
+        robusta_store = RobustaStore()
+        try:
+            users_groups = {account_id: read_users_groups(robusta_store, account_id) for account_id in configs.keys()}
+        finally:
+            robusta_store.close()
+
+    if args.baseline:
+        baseline_configs = load_account_configs(
+            args.baseline, max_workers=CONFIG_PARSE_WORKERS, inventory=load_cluster_inventory()
+        )
+        widened = False
+        for account_id, config_reader in configs.items():
+            baseline = baseline_configs.get(account_id)
+            baseline_index = PermissionIndex(
+                baseline.get_scopes() if baseline else [],
+                baseline.get_groups() if baseline else [],
+                users_groups.get(account_id),
+            )
+            current_index = PermissionIndex.from_config(config_reader, users_groups.get(account_id))
+            widening = find_widening(baseline_index, current_index)
+            print(f"Account {account_id}: {len(widening)} access widenings compared to {args.baseline}")
+            for entry in widening:
+                print(f"  {entry}")
+            widened = widened or bool(widening)
+        return 1 if widened else 0
+
+    if not args.cluster:
+        raise Exception("--cluster is required, unless --baseline is set")
+
+    location = args.cluster if args.namespace is None else f"{args.cluster}/{args.namespace}"
+    for account_id, config_reader in configs.items():
+        index = PermissionIndex.from_config(config_reader, users_groups.get(account_id))
+        if args.permission:
+            print(f"Account {account_id}: {args.permission} on {location}")
+            print(f"  groups: {index.groups_with(args.permission, args.cluster, args.namespace)}")
+            if args.users:
+                print(f"  users: {index.users_with(args.permission, args.cluster, args.namespace)}")
+        else:
+            print(f"Account {account_id}: permissions on {location}")
+            for group_name, permissions in index.permissions(args.cluster, args.namespace).items():
+                print(f"  group {group_name}: {permissions}")
+    return 0
+
+
+def run_apply(args) -> int:
+    from builder.fingerprint import FingerprintStore
+    from builder.plan import read_plans
+    from builder.robusta_store import RobustaStore
+    from builder.runner import RbacRunner, log_results, FAILED, UNCHANGED
+    from builder.state_snapshot import invalidate_snapshot
+    runner: Optional[RbacRunner] = None
+    try:
+        runner = RbacRunner(
+            store_factory=RobustaStore,  # Data layer for the Robusta platform DB
+            fingerprint_store=FingerprintStore(APPLIED_FINGERPRINT_FILE) if APPLIED_FINGERPRINT_FILE else None,
+            max_concurrency=ACCOUNTS_CONCURRENCY,
+        )
+        if getattr(args, "plan", None):
+            plans = read_plans(args.plan)
+            for plan in plans:
+                age = time.time() - plan.state_created_at
+                if age > PLAN_MAX_AGE:
+                    raise Exception(f"The plan of account {plan.account_id} is based on a state read {age:.0f}s ago, "
+                                    f"more than PLAN_MAX_AGE ({PLAN_MAX_AGE:.0f}s). Run the plan command again")
+            results = runner.run_plans(plans)
+        else:
+            results = runner.run(load_configs(args))
+        log_results(results)
+        if STATE_SNAPSHOT_FILE:
+            # the saved state of the applied accounts may be outdated
+            invalidate_snapshot(STATE_SNAPSHOT_FILE, [result.account_id for result in results])
+
+        if any(result.status == FAILED for result in results):
+            return 1
+        if all(result.status == UNCHANGED for result in results):
+            return UNCHANGED_EXIT_CODE
+        return 0
+    finally:
+        if runner:
+            runner.close()
+
+
+def run_snapshot(args) -> int:
+    from builder.backup import take_backup, write_backup
+    from builder.robusta_store import RobustaStore
+    account_ids = args.account or list(load_configs(args).keys())
+    robusta_store = RobustaStore()
+    try:
+        with METRICS.phase("read_state"):
+            states = take_backup(robusta_store, account_ids)
+    finally:
+        robusta_store.close()
+    write_backup(states, args.output)
+    for account_id, state in states.items():
+        logging.info(f"Account {account_id}: saved {len(state.scopes)} scopes, {len(state.groups)} groups and "
+                     f"{len(state.users_groups)} users groups to {args.output}")
+    return 0
+
+
+def run_restore(args) -> int:
+    from builder.backup import read_backup, compute_restore_plans
+    from builder.fingerprint import FingerprintStore
+    from builder.robusta_store import RobustaStore
+    from builder.runner import RbacRunner, log_results, FAILED
+    from builder.state_snapshot import invalidate_snapshot
+    backups = read_backup(args.input)
+    if args.account:
+        missing = [account_id for account_id in args.account if account_id not in backups]
+        if missing:
+            raise Exception(f"Accounts {missing} not found in {args.input}")
+        backups = {account_id: backups[account_id] for account_id in args.account}
+
+    # the plans are computed and applied over the same platform session
+    robusta_store = RobustaStore()
+    runner = RbacRunner(
+        store_factory=lambda: robusta_store,
+        fingerprint_store=FingerprintStore(APPLIED_FINGERPRINT_FILE) if APPLIED_FINGERPRINT_FILE else None,
+        max_concurrency=ACCOUNTS_CONCURRENCY,
+    )
+    try:
+        with METRICS.phase("read_state"):
+            plans = compute_restore_plans(robusta_store, backups)
+        if args.dry_run:
+            print(f"Restore: {sum(not plan.is_empty() for plan in plans)} of {len(plans)} accounts changed")
+            return 0
+
+        results = runner.run_plans(plans)
+        log_results(results)
+        if STATE_SNAPSHOT_FILE:
+            invalidate_snapshot(STATE_SNAPSHOT_FILE, [result.account_id for result in results])
+        return 1 if any(result.status == FAILED for result in results) else 0
+    finally:
+        robusta_store.close()
+
+
+def run_daemon(args) -> int:
+    from builder.daemon import ConfigWatcher, RbacDaemon, StatusServer
+    from builder.fingerprint import FingerprintStore, MemoryFingerprintStore
+    from builder.robusta_store import RobustaStore
+    from builder.runner import RbacRunner, AccountResult
+    from builder.state_snapshot import invalidate_snapshot
+    # without a fingerprint file, unchanged accounts are tracked in memory, and applied once when the daemon starts
+    runner = RbacRunner(
+        store_factory=RobustaStore,
+        fingerprint_store=FingerprintStore(APPLIED_FINGERPRINT_FILE) if APPLIED_FINGERPRINT_FILE
+        else MemoryFingerprintStore(),
+        max_concurrency=ACCOUNTS_CONCURRENCY,
+    )
+
+    def on_applied(results: List[AccountResult]):
+        if STATE_SNAPSHOT_FILE:
+            invalidate_snapshot(STATE_SNAPSHOT_FILE, [result.account_id for result in results])
+        write_metrics(METRICS_FILE, METRICS_PROMETHEUS_FILE)
+
+    daemon = RbacDaemon(
+        runner=runner,
+        load_configs=lambda: load_configs(args),
+        # inventory changes change the scopes using selectors
+        watcher=ConfigWatcher(args.config, args.debounce, [CLUSTER_INVENTORY_FILE] if CLUSTER_INVENTORY_FILE else []),
+        poll_interval=args.poll_interval,
+        resync_interval=args.resync_interval,
+        retry_backoff=DAEMON_RETRY_BACKOFF,
+        retry_max_backoff=DAEMON_RETRY_MAX_BACKOFF,
+        on_applied=on_applied,
+    )
+    status_server = StatusServer(daemon, DAEMON_STATUS_HOST, args.status_port).start() if args.status_port else None
+    for signal_number in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signal_number, lambda signum, frame: daemon.stop())
     try:
-        # read scopes and groups from the configuration
-        config_reader = ConfigBuilder("../config/definitions.yaml")
+        daemon.run()
+    finally:
+        if status_server:
+            status_server.stop()
+        # signs out of the platform
+        runner.close()
+    return 0
+
+
+def parse_args() -> argparse.Namespace:
+    parser = argparse.ArgumentParser(description="Build Robusta rbac definitions from a configuration")
+    parser.set_defaults(command="apply", func=run_apply, config=CONFIG_PATH, artifact=None, plan=None)
+    subparsers = parser.add_subparsers()
+
+    apply_parser = subparsers.add_parser("apply", help="Apply the configuration to the Robusta platform (default)")
+    apply_parser.set_defaults(command="apply", func=run_apply)
+    apply_source = apply_parser.add_mutually_exclusive_group()
+    apply_source.add_argument("--config", default=CONFIG_PATH, help="Configuration file, directory or glob")
+    apply_source.add_argument("--artifact", help="Compiled artifact, created by the compile command")
+    apply_source.add_argument("--plan", help="Plan file, created by the plan command. Applied without a new diff")
+
+    plan_parser = subparsers.add_parser("plan", help="Show the changes apply would make, computed offline")
+    plan_parser.set_defaults(command="plan", func=run_plan)
+    plan_source = plan_parser.add_mutually_exclusive_group()
+    plan_source.add_argument("--config", default=CONFIG_PATH, help="Configuration file, directory or glob")
+    plan_source.add_argument("--artifact", help="Compiled artifact, created by the compile command")
+    plan_parser.add_argument("--snapshot", default=STATE_SNAPSHOT_FILE,
+                             help="State snapshot file. Recent account states in it are reused. "
+                                  "Without it, the state is always read from the platform")
+    plan_parser.add_argument("--refresh", action="store_true", help="Read the state again, even if it's recent")
+    plan_parser.add_argument("--output", help="Save the plan to this file, to apply it later with apply --plan")
 
-        # Data layer for the Robusta platform DB
-        robusta_store: RobustaStore = RobustaStore()
+    snapshot_parser = subparsers.add_parser("snapshot", help="Save the stored scopes, groups and users groups of "
+                                                             "accounts, to restore them later")
+    snapshot_parser.set_defaults(command="snapshot", func=run_snapshot)
+    snapshot_parser.add_argument("--config", default=CONFIG_PATH,
+                                 help="Configuration file, directory or glob. Its accounts are saved")
+    snapshot_parser.add_argument("--account", action="append", help="Save this account id instead. May be repeated")
+    snapshot_parser.add_argument("--output", required=True, help="Snapshot file. Compressed if it ends with .gz")
 
-        account_id = config_reader.get_account_id()
-        if not account_id:
-            raise Exception("Account id not found in configuration file.")
+    restore_parser = subparsers.add_parser("restore", help="Restore accounts to a snapshot, with the original ids")
+    restore_parser.set_defaults(command="restore", func=run_restore)
+    restore_parser.add_argument("--input", required=True, help="Snapshot file, created by the snapshot command")
+    restore_parser.add_argument("--account", action="append", help="Restore only this account id. May be repeated")
+    restore_parser.add_argument("--dry-run", action="store_true", help="Log the changes, without applying them")
 
-        # need to first delete the groups, and only then the scopes because of foreign keys
-        robusta_store.delete_account_groups(account_id=account_id)
-        robusta_store.delete_account_scopes(account_id=account_id)
+    daemon_parser = subparsers.add_parser("daemon", help="Keep running, and apply the configuration when it changes")
+    daemon_parser.set_defaults(command="daemon", func=run_daemon)
+    daemon_parser.add_argument("--config", default=CONFIG_PATH, help="Configuration file, directory or glob")
+    daemon_parser.add_argument("--poll-interval", type=float, default=DAEMON_POLL_INTERVAL,
+                               help="Seconds between checks of the configuration files")
+    daemon_parser.add_argument("--debounce", type=float, default=DAEMON_DEBOUNCE,
+                               help="Seconds the configuration must stay unchanged before it's applied")
+    daemon_parser.add_argument("--resync-interval", type=float, default=DAEMON_RESYNC_INTERVAL,
+                               help="Seconds between full applies of an unchanged configuration. 0 disables them")
+    daemon_parser.add_argument("--status-port", type=int, default=DAEMON_STATUS_PORT,
+                               help="Port of the local /healthz, /status and /metrics endpoint. 0 disables it")
 
-        # first create scopes, because of foreign keys
-        for scope in config_reader.get_scopes():
-            robusta_store.upsert_scope(scope=scope)
+    validate_parser = subparsers.add_parser("validate", help="Validate the configuration, without connecting to the "
+                                                             "platform. Exits with 1 if it's invalid")
+    validate_parser.set_defaults(command="validate", func=run_validate)
+    validate_parser.add_argument("--config", default=CONFIG_PATH, help="Configuration file, directory or glob")
 
-        for group in config_reader.get_groups():
-            robusta_store.upsert_group(group=group)
+    compile_parser = subparsers.add_parser("compile", help="Validate the configuration, and compile it to an artifact")
+    compile_parser.set_defaults(command="compile", func=run_compile)
+    compile_parser.add_argument("--config", default=CONFIG_PATH, help="Configuration file, directory or glob")
+    compile_parser.add_argument("--output", required=True, help="Artifact file. Compressed if it ends with .gz")
 
+    query_parser = subparsers.add_parser("query", help="Show who can do what, or check that access isn't widened")
+    query_parser.set_defaults(command="query", func=run_query)
+    query_source = query_parser.add_mutually_exclusive_group()
+    query_source.add_argument("--config", default=CONFIG_PATH, help="Configuration file, directory or glob")
+    query_source.add_argument("--artifact", help="Compiled artifact, created by the compile command")
+    query_parser.add_argument("--account", help="Query only this account id")
+    query_parser.add_argument("--cluster", help="Cluster name")
+    query_parser.add_argument("--namespace", help="Namespace. Without it, the cluster level is queried. "
+                                                  "'*' is any namespace that's not listed explicitly")
+    query_parser.add_argument("--permission", help="List only the groups (and users) with this permission")
+    query_parser.add_argument("--users", action="store_true", help="Join the users groups stored on the platform")
+    query_parser.add_argument("--baseline", help="Baseline configuration. List the permissions the configuration "
+                                                 "grants that the baseline doesn't, and exit with 1 if there are any")
+
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+    args = parse_args()
+    logging.info(f"Running rbac builder {args.command}...")
+    try:
+        exit_code = args.func(args)
     except Exception as e:
-        logging.exception("Error building rbac definitions")
+        logging.exception(f"Error running rbac builder {args.command}")
         raise e
     finally:
-        logging.info("Done building rbac definitions")
-        if robusta_store:
-            robusta_store.close()
+        log_metrics()
+        write_metrics(METRICS_FILE, METRICS_PROMETHEUS_FILE)
+        logging.info(f"Done running rbac builder {args.command}")
         logging.info("Exiting")
-    sys.exit(0)
+    sys.exit(exit_code)
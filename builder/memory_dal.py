@@ -0,0 +1,237 @@
+import copy
+import logging
+import threading
+from typing import Dict, List, Optional, Callable
+
+from builder.batch_utils import chunks
+from builder.model import User, RobustaPermissionScope, RobustaPermissionGroup, UserGroup
+from builder.storage_backend import StorageBackend, APPLY_ACCOUNT_RBAC_RPC, SET_USERS_GROUPS_RPC, \
+    apply_account_rbac_params, set_users_groups_params
+
+
+class MemoryStorageDal(StorageBackend):
+    """
+    In-memory storage backend, for running the builder without a network.
+
+    Holds the PermissionScopes, PermissionGroups and UserGroups tables, enforces the same foreign keys as the
+    platform DB, and implements the rbac builder rpc functions with the same transactional semantics as the SQL
+    shipped under sql/.
+    """
+
+    def __init__(self, batch_size: int = 500, users: Optional[List[User]] = None):
+        self.batch_size = batch_size
+        self.users: List[User] = users or []
+        self.scopes: Dict[str, dict] = {}  # by scope_id
+        self.groups: Dict[str, dict] = {}  # by group_id
+        self.user_groups: Dict[str, List[str]] = {}  # by user_id
+        self.lock = threading.RLock()
+        self.rpc_functions: Dict[str, Callable[[dict], Dict]] = {
+            APPLY_ACCOUNT_RBAC_RPC: self.__rpc_apply_account,
+            SET_USERS_GROUPS_RPC: self.__rpc_set_users_groups,
+        }
+
+    def __check_group_scopes(self, group: dict):
+        for scope_id in group["scopes"]:
+            if scope_id not in self.scopes:
+                raise Exception(f"Foreign key violation: group {group['group_id']} references unknown scope {scope_id}")
+
+    def __check_scope_not_referenced(self, scope_id: str):
+        for group in self.groups.values():
+            if scope_id in group["scopes"]:
+                raise Exception(f"Foreign key violation: scope {scope_id} is referenced by group {group['group_id']}")
+
+    def __delete_group_ids(self, group_ids: List[str]):
+        for group_id in group_ids:
+            self.groups.pop(group_id, None)
+            for user_id, user_groups in self.user_groups.items():
+                self.user_groups[user_id] = [user_group for user_group in user_groups if user_group != group_id]
+
+    def __delete_scope_ids(self, scope_ids: List[str]):
+        for scope_id in scope_ids:
+            self.__check_scope_not_referenced(scope_id)
+            self.scopes.pop(scope_id, None)
+
+    def get_account_id(self, account_name: str) -> Optional[str]:
+        return None
+
+    def get_robusta_users(self) -> List[User]:
+        return list(self.users)
+
+    def get_permission_scopes(self, account_id: str) -> List[RobustaPermissionScope]:
+        with self.lock:
+            return [
+                RobustaPermissionScope(**scope) for scope in self.scopes.values() if scope["account_id"] == account_id
+            ]
+
+    def get_permission_groups(self, account_id: str) -> List[RobustaPermissionGroup]:
+        with self.lock:
+            return [
+                RobustaPermissionGroup(**group) for group in self.groups.values() if group["account_id"] == account_id
+            ]
+
+    def upsert_scope(self, scope: RobustaPermissionScope):
+        self.upsert_scopes([scope])
+
+    def upsert_scopes(self, scopes: List[RobustaPermissionScope]):
+        with self.lock:
+            for batch in chunks(scopes, self.batch_size):
+                for scope in batch:
+                    self.scopes[scope.scope_id] = scope.dict()
+
+    def delete_scope(self, scope: RobustaPermissionScope):
+        self.delete_scopes(scope.account_id, [scope.scope_id])
+
+    def delete_scopes(self, account_id: str, scope_ids: List[str]):
+        with self.lock:
+            self.__delete_scope_ids([
+                scope_id for scope_id in scope_ids
+                if self.scopes.get(scope_id, {}).get("account_id") == account_id
+            ])
+
+    def upsert_group(self, group: RobustaPermissionGroup):
+        self.upsert_groups([group])
+
+    def upsert_groups(self, groups: List[RobustaPermissionGroup]):
+        with self.lock:
+            for batch in chunks(groups, self.batch_size):
+                for group in batch:
+                    row = group.dict()
+                    self.__check_group_scopes(row)
+                    self.groups[group.group_id] = row
+
+    def delete_group(self, group: RobustaPermissionGroup):
+        self.delete_groups(group.account_id, [group.group_id])
+
+    def delete_groups(self, account_id: str, group_ids: List[str]):
+        with self.lock:
+            self.__delete_group_ids([
+                group_id for group_id in group_ids
+                if self.groups.get(group_id, {}).get("account_id") == account_id
+            ])
+
+    def delete_account_groups(self, account_id: str):
+        with self.lock:
+            self.__delete_group_ids([
+                group_id for group_id, group in self.groups.items() if group["account_id"] == account_id
+            ])
+
+    def delete_account_scopes(self, account_id: str):
+        with self.lock:
+            self.__delete_scope_ids([
+                scope_id for scope_id, scope in self.scopes.items() if scope["account_id"] == account_id
+            ])
+
+    def set_user_groups(self, user_id: str, group_ids: List[str]):
+        with self.lock:
+            for group_id in group_ids:
+                if group_id not in self.groups:
+                    raise Exception(f"Foreign key violation: user {user_id} references unknown group {group_id}")
+            self.user_groups[user_id] = list(group_ids)
+
+    def set_users_groups(self, account_id: str, users_groups: Dict[str, List[str]]):
+        for batch in chunks(users_groups.items(), self.batch_size):
+            self.sync_rpc(func_name=SET_USERS_GROUPS_RPC, params=set_users_groups_params(account_id, dict(batch)))
+
+    def get_users_groups(self, group_ids: Optional[List[str]] = None) -> List[UserGroup]:
+        group_ids = set(group_ids) if group_ids is not None else None
+        with self.lock:
+            return [
+                UserGroup(user_id=user_id, group_id=group_id)
+                for user_id, user_group_ids in self.user_groups.items() for group_id in user_group_ids
+                if group_ids is None or group_id in group_ids
+            ]
+
+    def apply_account_rbac(
+            self,
+            account_id: str,
+            scopes: List[RobustaPermissionScope],
+            groups: List[RobustaPermissionGroup]
+    ) -> Dict:
+        res = self.sync_rpc(func_name=APPLY_ACCOUNT_RBAC_RPC,
+                            params=apply_account_rbac_params(account_id, scopes, groups))
+        return res.get("data")
+
+    def sync_rpc(self, func_name: str, params: Optional[dict] = None) -> Dict:
+        rpc_function = self.rpc_functions.get(func_name)
+        if not rpc_function:
+            raise Exception(f"Unknown rpc function {func_name}")
+
+        # every rpc runs in a transaction. On failure, the tables are restored
+        with self.lock:
+            tables = copy.deepcopy((self.scopes, self.groups, self.user_groups))
+            try:
+                data = rpc_function(params or {})
+            except Exception:
+                logging.exception(f"Local rpc {func_name} failed, rolling back")
+                self.scopes, self.groups, self.user_groups = tables
+                raise
+
+        return {
+            "data": data,
+            "status_code": 200,
+        }
+
+    def __rpc_apply_account(self, params: dict) -> Dict:
+        account_id = params["_account_id"]
+        scopes: List[dict] = params["_scopes"]
+        groups: List[dict] = params["_groups"]
+        if any(row["account_id"] != account_id for row in scopes + groups):
+            raise Exception(f"All scopes and groups must belong to account {account_id}")
+        if any(self.scopes.get(scope["scope_id"], scope)["account_id"] != account_id for scope in scopes) or \
+                any(self.groups.get(group["group_id"], group)["account_id"] != account_id for group in groups):
+            raise Exception(f"Scope or group ids of account {account_id} belong to another account")
+
+        group_ids = {group["group_id"] for group in groups}
+        deleted_groups = [
+            group_id for group_id, group in self.groups.items()
+            if group["account_id"] == account_id and group_id not in group_ids
+        ]
+        self.__delete_group_ids(deleted_groups)
+
+        upserted_scopes = [scope for scope in scopes if self.scopes.get(scope["scope_id"]) != scope]
+        for scope in upserted_scopes:
+            self.scopes[scope["scope_id"]] = dict(scope)
+
+        upserted_groups = [group for group in groups if self.groups.get(group["group_id"]) != group]
+        for group in upserted_groups:
+            self.__check_group_scopes(group)
+            self.groups[group["group_id"]] = dict(group)
+
+        # scopes are deleted last, once the kept groups don't reference them anymore
+        scope_ids = {scope["scope_id"] for scope in scopes}
+        deleted_scopes = [
+            scope_id for scope_id, scope in self.scopes.items()
+            if scope["account_id"] == account_id and scope_id not in scope_ids
+        ]
+        self.__delete_scope_ids(deleted_scopes)
+
+        return {
+            "deleted_groups": len(deleted_groups),
+            "deleted_scopes": len(deleted_scopes),
+            "upserted_scopes": len(upserted_scopes),
+            "upserted_groups": len(upserted_groups),
+        }
+
+    def __rpc_set_users_groups(self, params: dict) -> Dict:
+        account_id = params["_account_id"]
+        account_group_ids = {
+            group_id for group_id, group in self.groups.items() if group["account_id"] == account_id
+        }
+        deleted = 0
+        inserted = 0
+        for user_groups in params["_users_groups"]:
+            requested = user_groups["group_ids"]
+            if any(group_id not in account_group_ids for group_id in requested):
+                raise Exception(f"All groups must belong to account {account_id}")
+
+            current = self.user_groups.get(user_groups["user_id"], [])
+            kept = [group_id for group_id in current if group_id not in account_group_ids or group_id in requested]
+            added = [group_id for group_id in requested if group_id not in kept]
+            deleted += len(current) - len(kept)
+            inserted += len(added)
+            self.user_groups[user_groups["user_id"]] = kept + added
+
+        return {"deleted": deleted, "inserted": inserted}
+
+    def close(self):
+        pass
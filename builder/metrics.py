@@ -0,0 +1,271 @@
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple, Iterator
+
+from builder.file_utils import atomic_text_file
+
+# request latency histogram buckets, in seconds
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+METRICS_PREFIX = "rbac_builder"
+
+
+class RequestStats:
+    """
+    Counters of the requests sent by a single StorageDal method to a single table (or rpc function)
+    """
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.bytes_sent = 0
+        self.rows = 0
+        self.latency_sum = 0.0
+        # non cumulative counts per bucket. The last one is for latencies above all the buckets
+        self.latency_buckets = [0] * (len(LATENCY_BUCKETS) + 1)
+
+    def observe(self, latency: float, bytes_sent: int, rows: int, error: bool):
+        self.count += 1
+        self.errors += int(error)
+        self.bytes_sent += bytes_sent
+        self.rows += rows
+        self.latency_sum += latency
+        for index, bucket in enumerate(LATENCY_BUCKETS):
+            if latency <= bucket:
+                self.latency_buckets[index] += 1
+                return
+        self.latency_buckets[-1] += 1
+
+    def summary(self) -> Dict:
+        return {
+            "count": self.count,
+            "errors": self.errors,
+            "bytes_sent": self.bytes_sent,
+            "rows": self.rows,
+            "latency_seconds": round(self.latency_sum, 6),
+            "latency_buckets": {
+                **{str(bucket): count for bucket, count in zip(LATENCY_BUCKETS, self.latency_buckets)},
+                "+Inf": self.latency_buckets[-1],
+            },
+        }
+
+
+class RequestRecorder:
+    """
+    Details of a single request, set by the code sending it while the request is measured
+    """
+
+    def __init__(self, bytes_sent: int = 0):
+        self.bytes_sent = bytes_sent
+        self.rows = 0
+
+
+class Metrics:
+    """
+    Run metrics: wall time per phase, requests per StorageDal method and table, and rows changed per entity.
+    Thread safe, since accounts and batches are applied concurrently.
+    Phases that run concurrently, for different accounts, are summed.
+    Long running processes apply many times: the run time and phases are of the last run (see run), and the
+    request and rows counters count across runs
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self.lock:
+            self.start_time = time.time()
+            self.end_time: Optional[float] = None
+            self.phases: Dict[str, float] = defaultdict(float)
+            self.requests: Dict[Tuple[str, str], RequestStats] = defaultdict(RequestStats)
+            self.rows_changed: Dict[Tuple[str, str], int] = defaultdict(int)
+            # retries by operation and failure reason, and reads served by an identical in-flight read
+            self.retries: Dict[Tuple[str, str], int] = defaultdict(int)
+            self.coalesced: Dict[str, int] = defaultdict(int)
+
+    @contextmanager
+    def run(self) -> Iterator[None]:
+        """
+        Measure a single run of a long running process. Its time and phases replace the ones of the previous run
+        """
+        with self.lock:
+            self.start_time = time.time()
+            self.end_time = None
+            self.phases = defaultdict(float)
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.end_time = time.time()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            with self.lock:
+                self.phases[name] += duration
+
+    @contextmanager
+    def request(self, method: str, table: str, payload=None) -> Iterator[RequestRecorder]:
+        """
+        Measure a single request. The payload, if set, is the json body of the request, and its size is counted
+        as the bytes sent. The request rows are the payload rows, unless set on the recorder
+        """
+        recorder = RequestRecorder(bytes_sent=json_size(payload) if payload is not None else 0)
+        if isinstance(payload, list):
+            recorder.rows = len(payload)
+        start = time.perf_counter()
+        error = False
+        try:
+            yield recorder
+        except BaseException:
+            error = True
+            raise
+        finally:
+            latency = time.perf_counter() - start
+            with self.lock:
+                self.requests[(method, table)].observe(latency, recorder.bytes_sent, recorder.rows, error)
+
+    def add_rows_changed(self, entity: str, action: str, count: int):
+        if count:
+            with self.lock:
+                self.rows_changed[(entity, action)] += count
+
+    def add_retry(self, operation: str, reason: str):
+        with self.lock:
+            self.retries[(operation, reason)] += 1
+
+    def add_coalesced(self, operation: str):
+        with self.lock:
+            self.coalesced[operation] += 1
+
+    def summary(self) -> Dict:
+        with self.lock:
+            return {
+                "start_time": self.start_time,
+                "duration_seconds": round((self.end_time or time.time()) - self.start_time, 6),
+                "phases": {name: round(duration, 6) for name, duration in self.phases.items()},
+                "requests": [
+                    {"method": method, "table": table, **stats.summary()}
+                    for (method, table), stats in sorted(self.requests.items())
+                ],
+                "rows_changed": [
+                    {"entity": entity, "action": action, "count": count}
+                    for (entity, action), count in sorted(self.rows_changed.items())
+                ],
+                "retries": [
+                    {"operation": operation, "reason": reason, "count": count}
+                    for (operation, reason), count in sorted(self.retries.items())
+                ],
+                "coalesced": [
+                    {"operation": operation, "count": count} for operation, count in sorted(self.coalesced.items())
+                ],
+            }
+
+    def prometheus(self, extra_labels: Optional[Dict[str, str]] = None) -> str:
+        """
+        Metrics in the prometheus text exposition format, used by both the node exporter textfile collector and the
+        Pushgateway
+        """
+        summary = self.summary()
+        lines: List[str] = []
+
+        def metric(name: str, metric_type: str, help_text: str):
+            lines.append(f"# HELP {METRICS_PREFIX}_{name} {help_text}")
+            lines.append(f"# TYPE {METRICS_PREFIX}_{name} {metric_type}")
+
+        def sample(name: str, value, **labels):
+            all_labels = {**(extra_labels or {}), **labels}
+            labels_text = ",".join(f'{key}="{escape_label(str(val))}"' for key, val in all_labels.items())
+            lines.append(f"{METRICS_PREFIX}_{name}{{{labels_text}}} {value}" if labels_text
+                         else f"{METRICS_PREFIX}_{name} {value}")
+
+        metric("last_run_timestamp_seconds", "gauge", "Start time of the last run")
+        sample("last_run_timestamp_seconds", summary["start_time"])
+        metric("run_duration_seconds", "gauge", "Wall time of the last run")
+        sample("run_duration_seconds", summary["duration_seconds"])
+
+        metric("phase_duration_seconds", "gauge", "Wall time per phase of the last run")
+        for name, duration in summary["phases"].items():
+            sample("phase_duration_seconds", duration, phase=name)
+
+        metric("requests_total", "counter", "Requests sent to the platform")
+        for entry in summary["requests"]:
+            sample("requests_total", entry["count"], method=entry["method"], table=entry["table"])
+        metric("request_errors_total", "counter", "Failed requests sent to the platform")
+        for entry in summary["requests"]:
+            sample("request_errors_total", entry["errors"], method=entry["method"], table=entry["table"])
+        metric("request_bytes_total", "counter", "Request body bytes sent to the platform")
+        for entry in summary["requests"]:
+            sample("request_bytes_total", entry["bytes_sent"], method=entry["method"], table=entry["table"])
+        metric("request_rows_total", "counter", "Rows sent to, or read from, the platform")
+        for entry in summary["requests"]:
+            sample("request_rows_total", entry["rows"], method=entry["method"], table=entry["table"])
+
+        metric("request_duration_seconds", "histogram", "Latency of requests sent to the platform")
+        for entry in summary["requests"]:
+            labels = {"method": entry["method"], "table": entry["table"]}
+            cumulative = 0
+            for bucket, count in entry["latency_buckets"].items():
+                cumulative += count
+                sample("request_duration_seconds_bucket", cumulative, **labels, le=bucket)
+            sample("request_duration_seconds_sum", entry["latency_seconds"], **labels)
+            sample("request_duration_seconds_count", entry["count"], **labels)
+
+        metric("rows_changed_total", "counter", "Rows created, updated or deleted on the platform")
+        for entry in summary["rows_changed"]:
+            sample("rows_changed_total", entry["count"], entity=entry["entity"], action=entry["action"])
+
+        metric("request_retries_total", "counter", "Requests retried after a transient failure")
+        for entry in summary["retries"]:
+            sample("request_retries_total", entry["count"], operation=entry["operation"], reason=entry["reason"])
+        metric("requests_coalesced_total", "counter", "Reads served by an identical in-flight read")
+        for entry in summary["coalesced"]:
+            sample("requests_coalesced_total", entry["count"], operation=entry["operation"])
+
+        return "\n".join(lines) + "\n"
+
+
+def json_size(payload) -> int:
+    return len(json.dumps(payload, separators=(",", ":")).encode())
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def write_metrics(summary_file: str = "", prometheus_file: str = ""):
+    """
+    Write the run metrics to the configured files. Failing to write metrics never fails the run
+    """
+    try:
+        # collectors may read the files at any time, so they're never read half written
+        if summary_file:
+            with atomic_text_file(summary_file) as metrics_file:
+                json.dump(METRICS.summary(), metrics_file, indent=2)
+        if prometheus_file:
+            with atomic_text_file(prometheus_file) as metrics_file:
+                metrics_file.write(METRICS.prometheus())
+    except Exception:
+        logging.exception("Failed to write run metrics")
+
+
+def log_metrics():
+    summary = METRICS.summary()
+    phases = ", ".join(f"{name}: {duration:.3f}s" for name, duration in summary["phases"].items())
+    requests = sum(entry["count"] for entry in summary["requests"])
+    bytes_sent = sum(entry["bytes_sent"] for entry in summary["requests"])
+    retries = sum(entry["count"] for entry in summary["retries"])
+    logging.info(f"Run took {summary['duration_seconds']:.3f}s. phases: {phases or 'none'}. "
+                 f"requests: {requests} ({bytes_sent} bytes sent, {retries} retries)")
+
+
+METRICS = Metrics()
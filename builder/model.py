@@ -1,7 +1,63 @@
-from pydantic import BaseModel, field_validator
-from typing import List, Dict, Optional
+from functools import cached_property
 
+from pydantic import BaseModel, ConfigDict
+from typing import List, Dict, Optional, Tuple
 
+from builder.permissions import PERMISSIONS
+
+# scope namespace matching every namespace of the cluster
+ALL_NAMESPACES = "*"
+
+
+class CanonicalForm:
+    """
+    Frozen, normalized form of a model: sorted tuples instead of lists and dicts, with a precomputed hash.
+    Canonical forms can be compared and put in sets without re-sorting anything
+    """
+    __slots__ = ("values", "_hash")
+
+    def __init__(self, values: Tuple):
+        object.__setattr__(self, "values", values)
+        object.__setattr__(self, "_hash", hash(values))
+
+    def __setattr__(self, key, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    def __hash__(self) -> int:
+        return self._hash
+
+    def __eq__(self, other) -> bool:
+        if not isinstance(other, CanonicalForm):
+            return False
+        return self._hash == other._hash and self.values == other.values
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}{self.values}"
+
+
+class CanonicalScope(CanonicalForm):
+    __slots__ = ()
+
+
+class CanonicalGroup(CanonicalForm):
+    __slots__ = ()
+
+
+class CachedModel(BaseModel):
+    """
+    Model with values derived from its fields, cached with functools.cached_property.
+    The model is frozen, so the cached values can't go stale: changes are made with model_copy, and copies with
+    updated fields don't keep the cached values
+    """
+    model_config = ConfigDict(frozen=True)
+
+    def model_copy(self, *, update: Optional[Dict] = None, deep: bool = False):
+        copied = super().model_copy(update=update, deep=deep)
+        for cls in type(self).__mro__:
+            for name, attribute in vars(cls).items():
+                if isinstance(attribute, cached_property):
+                    copied.__dict__.pop(name, None)
+        return copied
 
 
 class User(BaseModel):
@@ -9,32 +65,34 @@ class User(BaseModel):
     email: Optional[str] = None
 
 
-class RobustaPermissionScope(BaseModel):
+class RobustaPermissionScope(CachedModel):
     account_id: str
     scope_type: str
     scope_id: str
     name: str
     scope_data: Dict[str, List[str]]
 
+    @cached_property
+    def canonical(self) -> CanonicalScope:
+        return CanonicalScope((
+            self.account_id,
+            self.scope_type,
+            self.scope_id,
+            self.name,
+            tuple(sorted((cluster, tuple(sorted(namespaces))) for cluster, namespaces in self.scope_data.items())),
+        ))
+
     def __eq__(self, other) -> bool:
         if not isinstance(other, RobustaPermissionScope):
             return False
 
-        return \
-                self.account_id == other.account_id and \
-                self.scope_type == other.scope_type and \
-                self.scope_id == other.scope_id and \
-                self.name == other.name and \
-                self.__scope_data_eq(other.scope_data)
-
-    def __scope_data_eq(self, other_scope_data: Dict[str, List[str]]) -> bool:
-        return sorted(self.scope_data.keys()) == sorted(other_scope_data.keys()) and \
-            all([
-                sorted(self.scope_data.get(key)) == sorted(other_scope_data.get(key))
-                for key in self.scope_data.keys()
-            ])
-
-class RobustaPermissionGroup(BaseModel):
+        return self.canonical == other.canonical
+
+    def __hash__(self) -> int:
+        return hash(self.canonical)
+
+
+class RobustaPermissionGroup(CachedModel):
     account_id: str
     group_id: str
     provider_group_id: str
@@ -43,19 +101,32 @@ class RobustaPermissionGroup(BaseModel):
     scopes: List[str]
     permissions: List[str]
 
+    @cached_property
+    def permissions_mask(self) -> int:
+        return PERMISSIONS.mask(self.permissions)
+
+    @cached_property
+    def canonical(self) -> CanonicalGroup:
+        return CanonicalGroup((
+            self.account_id,
+            self.group_id,
+            self.provider_group_id,
+            self.name,
+            self.scope_type,
+            tuple(sorted(self.scopes)),
+            self.permissions_mask,
+        ))
+
     def __eq__(self, other) -> bool:
         if not isinstance(other, RobustaPermissionGroup):
             return False
 
-        return \
-                self.account_id == other.account_id and \
-                self.group_id == other.group_id and \
-                self.provider_group_id == other.provider_group_id and \
-                self.name == other.name and \
-                self.scope_type == other.scope_type and \
-                sorted(self.scopes) == sorted(other.scopes) and \
-                sorted(self.permissions) == sorted(other.permissions)
+        return self.canonical == other.canonical
+
+    def __hash__(self) -> int:
+        return hash(self.canonical)
+
 
 class UserGroup(BaseModel):
     user_id: str
-    group_id: str
\ No newline at end of file
+    group_id: str
@@ -0,0 +1,176 @@
+from collections import defaultdict
+from typing import Dict, List, Optional, Iterable, Set, Tuple
+
+from pydantic import BaseModel
+
+from builder.config_builder import ConfigBuilder
+from builder.model import RobustaPermissionScope, RobustaPermissionGroup, ALL_NAMESPACES
+from builder.permissions import PERMISSIONS
+from builder.robusta_store import RobustaStore
+
+
+class Widening(BaseModel):
+    """
+    Permissions a principal (group or user) gains at a location. namespace '*' stands for any namespace that's not
+    listed explicitly, and None for the cluster level (nodes, the cluster itself)
+    """
+    cluster: str
+    namespace: Optional[str]
+    principal: str
+    permissions: List[str]
+
+    def __str__(self) -> str:
+        location = self.cluster if self.namespace is None else f"{self.cluster}/{self.namespace}"
+        return f"{self.principal} gains {self.permissions} on {location}"
+
+
+def merge_masks(target: Dict[str, int], source: Dict[str, int]):
+    for principal, mask in source.items():
+        target[principal] = target.get(principal, 0) | mask
+
+
+class PermissionIndex:
+    """
+    Effective permissions of every group, by location, built from the compiled scopes and groups:
+    - 'namespace' scopes give their groups permissions in the listed namespaces of every cluster, or in all of them
+      with '*'
+    - 'cluster' scopes give their groups permissions on the whole cluster: every namespace, and the cluster level
+
+    Permission sets are bit masks, and a query is a few dict lookups.
+    If users groups are joined, the effective permissions of users are indexed too
+    """
+
+    def __init__(
+            self,
+            scopes: Iterable[RobustaPermissionScope],
+            groups: Iterable[RobustaPermissionGroup],
+            users_groups: Optional[Dict[str, Iterable[str]]] = None,
+    ):
+        """
+        users_groups holds the group names of every user
+        """
+        # group name -> mask, by location
+        self.namespaces: Dict[Tuple[str, str], Dict[str, int]] = defaultdict(dict)
+        self.all_namespaces: Dict[str, Dict[str, int]] = defaultdict(dict)
+        self.cluster_wide: Dict[str, Dict[str, int]] = defaultdict(dict)
+        # namespaces listed explicitly in every cluster
+        self.cluster_namespaces: Dict[str, Set[str]] = defaultdict(set)
+        # user -> group names, and group name -> users
+        self.users: Dict[str, Set[str]] = {}
+        self.group_users: Dict[str, Set[str]] = defaultdict(set)
+
+        scopes_by_id = {scope.scope_id: scope for scope in scopes}
+        for group in groups:
+            for scope_id in group.scopes:
+                scope = scopes_by_id.get(scope_id)
+                if scope:
+                    self.__add(group.name, group.permissions_mask, scope)
+
+        for user, group_names in (users_groups or {}).items():
+            self.users[user] = set(group_names)
+            for group_name in group_names:
+                self.group_users[group_name].add(user)
+
+    @classmethod
+    def from_config(cls, config_reader: ConfigBuilder, users_groups: Optional[Dict[str, Iterable[str]]] = None):
+        return cls(config_reader.get_scopes(), config_reader.get_groups(), users_groups)
+
+    def __add(self, group_name: str, mask: int, scope: RobustaPermissionScope):
+        for cluster, namespaces in scope.scope_data.items():
+            if scope.scope_type == "cluster":
+                locations = [self.cluster_wide[cluster]]
+            elif ALL_NAMESPACES in namespaces:
+                locations = [self.all_namespaces[cluster]]
+            else:
+                locations = [self.namespaces[(cluster, namespace)] for namespace in namespaces]
+                self.cluster_namespaces[cluster].update(namespaces)
+            for location in locations:
+                location[group_name] = location.get(group_name, 0) | mask
+
+    def group_masks(self, cluster: str, namespace: Optional[str] = None) -> Dict[str, int]:
+        """
+        Permissions mask of every group with access to the location. Without a namespace, the cluster level
+        """
+        masks = dict(self.cluster_wide.get(cluster, {}))
+        if namespace is not None:
+            merge_masks(masks, self.all_namespaces.get(cluster, {}))
+            if namespace != ALL_NAMESPACES:
+                merge_masks(masks, self.namespaces.get((cluster, namespace), {}))
+        return masks
+
+    def user_masks(self, cluster: str, namespace: Optional[str] = None) -> Dict[str, int]:
+        masks: Dict[str, int] = {}
+        for group_name, group_mask in self.group_masks(cluster, namespace).items():
+            for user in self.group_users.get(group_name, ()):
+                masks[user] = masks.get(user, 0) | group_mask
+        return masks
+
+    def permissions(self, cluster: str, namespace: Optional[str] = None) -> Dict[str, List[str]]:
+        return {
+            group_name: PERMISSIONS.names(mask)
+            for group_name, mask in sorted(self.group_masks(cluster, namespace).items())
+        }
+
+    def groups_with(self, permission: str, cluster: str, namespace: Optional[str] = None) -> List[str]:
+        bit = PERMISSIONS.bit(permission)
+        if bit is None:
+            return []
+        return sorted(name for name, mask in self.group_masks(cluster, namespace).items() if mask & bit)
+
+    def users_with(self, permission: str, cluster: str, namespace: Optional[str] = None) -> List[str]:
+        bit = PERMISSIONS.bit(permission)
+        if bit is None:
+            return []
+        users = set()
+        for group_name in self.groups_with(permission, cluster, namespace):
+            users.update(self.group_users.get(group_name, ()))
+        return sorted(users)
+
+    def clusters(self) -> Set[str]:
+        return set(self.cluster_namespaces) | set(self.all_namespaces) | set(self.cluster_wide)
+
+    def locations(self, cluster: str) -> List[Optional[str]]:
+        """
+        Locations with distinct permissions in the cluster: the listed namespaces, any other namespace ('*'),
+        and the cluster level (None)
+        """
+        return [*sorted(self.cluster_namespaces.get(cluster, [])), ALL_NAMESPACES, None]
+
+
+def find_widening(baseline: PermissionIndex, current: PermissionIndex) -> List[Widening]:
+    """
+    Every permission the current index grants, at any location, to a group or user, that the baseline doesn't grant
+    """
+    widening: List[Widening] = []
+    for cluster in sorted(current.clusters()):
+        locations = dict.fromkeys(current.locations(cluster) + baseline.locations(cluster))
+        for namespace in locations:
+            masks = [(current.group_masks(cluster, namespace), baseline.group_masks(cluster, namespace), "group")]
+            if current.users:
+                masks.append((current.user_masks(cluster, namespace), baseline.user_masks(cluster, namespace), "user"))
+            for current_masks, baseline_masks, principal_type in masks:
+                for principal, mask in sorted(current_masks.items()):
+                    added = mask & ~baseline_masks.get(principal, 0)
+                    if added:
+                        widening.append(Widening(
+                            cluster=cluster,
+                            namespace=namespace,
+                            principal=f"{principal_type} {principal}",
+                            permissions=PERMISSIONS.names(added),
+                        ))
+    return widening
+
+
+def read_users_groups(robusta_store: RobustaStore, account_id: str) -> Dict[str, List[str]]:
+    """
+    Group names of every user of the account, as stored on the platform. Users are keyed by email
+    """
+    group_names = {group.group_id: name for name, group in robusta_store.get_permission_groups(account_id).items()}
+    if not group_names:
+        return {}
+    emails = {user.id: user.email for user in robusta_store.get_robusta_users()}
+    users_groups = robusta_store.get_users_groups(group_ids=sorted(group_names.keys()))
+    return {
+        emails.get(user_id) or user_id: sorted(group_names[group_id] for group_id in group_ids)
+        for user_id, group_ids in users_groups.items()
+    }
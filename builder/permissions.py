@@ -0,0 +1,70 @@
+import threading
+from typing import Dict, List, Iterable, Optional
+
+MINIMAL_NAMESPACE_PERMISSIONS: List[str] = ["APP_VIEW","JOB_VIEW","TIMELINE_VIEW"]
+MINIMAL_CLUSTER_PERMISSIONS: List[str] = ["APP_VIEW","JOB_VIEW","TIMELINE_VIEW","NODE_VIEW","CLUSTER_VIEW"]
+
+NAMESPACE_PERMISSIONS: List[str] = ["APP_VIEW","JOB_VIEW","TIMELINE_VIEW","APP_RESTART","JOB_DELETE","POD_LOGS",
+                                    "POD_DELETE","KRR_VIEW","POPEYE_VIEW","METRICS_VIEW"]
+CLUSTER_PERMISSIONS: List[str] = ["APP_VIEW","JOB_VIEW","TIMELINE_VIEW","NODE_VIEW","CLUSTER_VIEW","APP_RESTART",
+                                  "JOB_DELETE","POD_LOGS","POD_DELETE","METRICS_VIEW","NODE_DRAIN","NODE_CORDON",
+                                  "NODE_UNCORDON","CLUSTER_DELETE","KRR_SCAN","KRR_VIEW","POPEYE_VIEW","POPEYE_SCAN",
+                                  "ALERT_CONFIG_EDIT","ALERT_CONFIG_VIEW","SILENCES_VIEW","SILENCES_EDIT"]
+
+
+class PermissionRegistry:
+    """
+    Assigns every permission a bit, so a set of permissions is a single int mask.
+    Validating, merging and comparing permission sets are then bit operations.
+    """
+
+    def __init__(self, permissions: Iterable[str]):
+        self.bits: Dict[str, int] = {}
+        self.permissions: List[str] = []
+        self.lock = threading.Lock()
+        for permission in permissions:
+            self.register(permission)
+
+    def register(self, permission: str) -> int:
+        with self.lock:
+            bit = self.bits.get(permission)
+            if bit is None:
+                bit = 1 << len(self.permissions)
+                self.bits[permission] = bit
+                self.permissions.append(permission)
+            return bit
+
+    def bit(self, permission: str) -> Optional[int]:
+        return self.bits.get(permission)
+
+    def mask(self, permissions: Iterable[str]) -> int:
+        """
+        Mask of the permissions. Permissions that are not known yet, such as permissions read from the DB that this
+        version doesn't know, are registered
+        """
+        mask = 0
+        for permission in permissions:
+            bit = self.bits.get(permission)
+            mask |= bit if bit is not None else self.register(permission)
+        return mask
+
+    def names(self, mask: int) -> List[str]:
+        """
+        Permissions of the mask, in registration order
+        """
+        names = []
+        index = 0
+        while mask:
+            if mask & 1:
+                names.append(self.permissions[index])
+            mask >>= 1
+            index += 1
+        return names
+
+
+PERMISSIONS = PermissionRegistry(CLUSTER_PERMISSIONS + NAMESPACE_PERMISSIONS)
+
+MINIMAL_NAMESPACE_MASK = PERMISSIONS.mask(MINIMAL_NAMESPACE_PERMISSIONS)
+MINIMAL_CLUSTER_MASK = PERMISSIONS.mask(MINIMAL_CLUSTER_PERMISSIONS)
+NAMESPACE_MASK = PERMISSIONS.mask(NAMESPACE_PERMISSIONS)
+CLUSTER_MASK = PERMISSIONS.mask(CLUSTER_PERMISSIONS)
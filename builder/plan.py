@@ -0,0 +1,186 @@
+import json
+import time
+from typing import Dict, List, Optional, Tuple
+
+from pydantic import BaseModel
+
+from builder.config_builder import ConfigBuilder
+from builder.file_utils import open_text, atomic_text_file
+from builder.fingerprint import config_fingerprint
+from builder.model import RobustaPermissionScope, RobustaPermissionGroup
+from builder.reconciler import SyncPlan, compute_plan
+from builder.state_snapshot import AccountState
+from builder.user_sync import UsersGroupsPlan, desired_users_groups, compute_users_groups_plan
+
+PLAN_VERSION = 1
+
+
+class AccountPlan(BaseModel):
+    account_id: str
+    # fingerprint of the configuration the plan was computed for
+    fingerprint: str
+    # when the stored state the plan is based on was read
+    state_created_at: float
+    rbac: SyncPlan
+    # not set if users groups are not managed
+    users: Optional[UsersGroupsPlan] = None
+
+    def is_empty(self) -> bool:
+        return self.rbac.is_empty() and (self.users is None or self.users.is_empty())
+
+    def summary(self) -> str:
+        summary = self.rbac.summary()
+        if self.users is not None:
+            summary += f", {self.users.summary()}"
+        return summary
+
+
+def planned_state(
+        state: AccountState,
+        plan: SyncPlan
+) -> Tuple[Dict[str, RobustaPermissionScope], Dict[str, RobustaPermissionGroup]]:
+    """
+    The scopes and groups of the account, by name, after the plan is applied
+    """
+    scopes = state.scopes_by_name()
+    for scope in plan.scopes_to_delete:
+        scopes.pop(scope.name, None)
+    for scope in plan.scopes_to_create + plan.scopes_to_update:
+        scopes[scope.name] = scope
+
+    groups = state.groups_by_name()
+    for group in plan.groups_to_delete:
+        groups.pop(group.name, None)
+    for group in plan.groups_to_create + plan.groups_to_update:
+        groups[group.name] = group
+    return scopes, groups
+
+
+def compute_account_plan(
+        config_reader: ConfigBuilder,
+        state: AccountState,
+        users_config: Optional[Dict] = None,
+) -> AccountPlan:
+    """
+    Compute the changes needed to apply the configuration, offline, against a snapshot of the stored state.
+    users_config holds the UsersGroupsSync settings (allowed_users, cluster_admin_groups, account_sso_group,
+    email_domain).
+    If it's not set, users groups are not planned
+    """
+    account_id = config_reader.get_account_id()
+    rbac_plan = compute_plan(
+        account_id,
+        config_reader.get_scopes(),
+        config_reader.get_groups(),
+        state.scopes_by_name(),
+        state.groups_by_name(),
+    )
+
+    users_plan = None
+    if users_config is not None:
+        # users are assigned to the groups as they'll be once the rbac changes are applied
+        scopes, groups = planned_state(state, rbac_plan)
+        desired = desired_users_groups(users=state.users, scopes=scopes, groups=groups, **users_config)
+        account_group_ids = {group.group_id for group in groups.values()}
+        users_plan = compute_users_groups_plan(account_id, desired, state.users_groups, account_group_ids)
+
+    return AccountPlan(
+        account_id=account_id,
+        fingerprint=config_fingerprint(account_id, config_reader.get_scopes(), config_reader.get_groups()),
+        state_created_at=state.created_at,
+        rbac=rbac_plan,
+        users=users_plan,
+    )
+
+
+def _scope_lines(sign: str, scope: RobustaPermissionScope, current: Optional[RobustaPermissionScope]) -> List[str]:
+    lines = [f"  {sign} scope {scope.name} ({scope.scope_type})"]
+    if current and current.scope_type != scope.scope_type:
+        lines.append(f"      type: {current.scope_type} -> {scope.scope_type}")
+    current_data = current.scope_data if current else {}
+    for cluster in sorted(set(current_data) | set(scope.scope_data)):
+        before = sorted(current_data.get(cluster, []))
+        after = sorted(scope.scope_data.get(cluster, []))
+        if before != after:
+            lines.append(f"      {cluster}: {before or '-'} -> {after or '-'}" if current
+                         else f"      {cluster}: {after}")
+    return lines
+
+
+def _group_lines(
+        sign: str,
+        group: RobustaPermissionGroup,
+        current: Optional[RobustaPermissionGroup],
+        scope_names: Dict[str, str],
+) -> List[str]:
+    lines = [f"  {sign} group {group.name} ({group.scope_type})"]
+    scopes = sorted(scope_names.get(scope_id, scope_id) for scope_id in group.scopes)
+    if not current:
+        lines.append(f"      scopes: {scopes}")
+        lines.append(f"      permissions: {sorted(group.permissions)}")
+        return lines
+
+    if current.provider_group_id != group.provider_group_id:
+        lines.append(f"      provider_group_id: {current.provider_group_id} -> {group.provider_group_id}")
+    if current.scope_type != group.scope_type:
+        lines.append(f"      type: {current.scope_type} -> {group.scope_type}")
+    current_scopes = sorted(scope_names.get(scope_id, scope_id) for scope_id in current.scopes)
+    if current_scopes != scopes:
+        lines.append(f"      scopes: +{sorted(set(scopes) - set(current_scopes))} "
+                     f"-{sorted(set(current_scopes) - set(scopes))}")
+    if current.permissions_mask != group.permissions_mask:
+        lines.append(f"      permissions: +{sorted(set(group.permissions) - set(current.permissions))} "
+                     f"-{sorted(set(current.permissions) - set(group.permissions))}")
+    return lines
+
+
+def format_plan(plan: AccountPlan, state: AccountState) -> List[str]:
+    """
+    Human readable diff of the plan against the stored state
+    """
+    current_scopes = state.scopes_by_name()
+    current_groups = state.groups_by_name()
+    scope_names = {scope.scope_id: scope.name for scope in state.scopes}
+    scope_names.update({scope.scope_id: scope.name for scope in plan.rbac.scopes_to_create})
+
+    lines = [f"Account {plan.account_id}: {plan.summary()}"]
+    for scope in plan.rbac.scopes_to_create:
+        lines.extend(_scope_lines("+", scope, None))
+    for scope in plan.rbac.scopes_to_update:
+        lines.extend(_scope_lines("~", scope, current_scopes.get(scope.name)))
+    for scope in plan.rbac.scopes_to_delete:
+        lines.append(f"  - scope {scope.name} ({scope.scope_type})")
+    for group in plan.rbac.groups_to_create:
+        lines.extend(_group_lines("+", group, None, scope_names))
+    for group in plan.rbac.groups_to_update:
+        lines.extend(_group_lines("~", group, current_groups.get(group.name), scope_names))
+    for group in plan.rbac.groups_to_delete:
+        lines.append(f"  - group {group.name} ({group.scope_type})")
+
+    if plan.users:
+        _, groups = planned_state(state, plan.rbac)
+        group_names = {group.group_id: group.name for group in state.groups}
+        group_names.update({group.group_id: group.name for group in groups.values()})
+        emails = {user.id: user.email for user in state.users}
+        account_group_ids = set(group_names.keys())
+        for user_id, user_groups in plan.users.users_groups.items():
+            current = {group_id for group_id in state.users_groups.get(user_id, []) if group_id in account_group_ids}
+            added = sorted(group_names.get(group_id, group_id) for group_id in set(user_groups) - current)
+            removed = sorted(group_names.get(group_id, group_id) for group_id in current - set(user_groups))
+            lines.append(f"  ~ user {emails.get(user_id) or user_id}: groups +{added} -{removed}")
+
+    return lines
+
+
+def write_plans(plans: List[AccountPlan], file_name: str):
+    content = {"version": PLAN_VERSION, "created_at": time.time(), "plans": [plan.model_dump() for plan in plans]}
+    with atomic_text_file(file_name) as plan_file:
+        json.dump(content, plan_file)
+
+
+def read_plans(file_name: str) -> List[AccountPlan]:
+    with open_text(file_name, "r") as plan_file:
+        content = json.load(plan_file)
+    if content.get("version") != PLAN_VERSION:
+        raise Exception(f"Unsupported plan version {content.get('version')} in {file_name}")
+    return [AccountPlan(**plan) for plan in content["plans"]]
@@ -0,0 +1,157 @@
+import logging
+from typing import List, Dict, Tuple
+
+from pydantic import BaseModel
+
+from builder.metrics import METRICS
+from builder.model import RobustaPermissionScope, RobustaPermissionGroup
+from builder.robusta_store import RobustaStore
+
+
+class SyncPlan(BaseModel):
+    account_id: str
+    scopes_to_create: List[RobustaPermissionScope] = []
+    scopes_to_update: List[RobustaPermissionScope] = []
+    scopes_to_delete: List[RobustaPermissionScope] = []
+    groups_to_create: List[RobustaPermissionGroup] = []
+    groups_to_update: List[RobustaPermissionGroup] = []
+    groups_to_delete: List[RobustaPermissionGroup] = []
+
+    def is_empty(self) -> bool:
+        return not (self.scopes_to_create or self.scopes_to_update or self.scopes_to_delete or
+                    self.groups_to_create or self.groups_to_update or self.groups_to_delete)
+
+    def summary(self) -> str:
+        return f"scopes: +{len(self.scopes_to_create)} ~{len(self.scopes_to_update)} -{len(self.scopes_to_delete)}, " \
+               f"groups: +{len(self.groups_to_create)} ~{len(self.groups_to_update)} -{len(self.groups_to_delete)}"
+
+
+def adopt_stored_ids(
+        desired_scopes: List[RobustaPermissionScope],
+        desired_groups: List[RobustaPermissionGroup],
+        current_scopes: Dict[str, RobustaPermissionScope],
+        current_groups: Dict[str, RobustaPermissionGroup],
+) -> Tuple[List[RobustaPermissionScope], List[RobustaPermissionGroup]]:
+    """
+    The desired scopes and groups, with the ids of the stored entities of the same name, and the group scopes
+    translated to these ids. Entities stored before ids were derived from names keep their id, and their users groups
+    """
+    # scope ids referenced by the desired groups must be translated to the stored ids
+    scope_ids: Dict[str, str] = {}
+    scopes: List[RobustaPermissionScope] = []
+    for scope in desired_scopes:
+        current = current_scopes.get(scope.name)
+        if current and current.scope_id != scope.scope_id:
+            scope_ids[scope.scope_id] = current.scope_id
+            scope = scope.model_copy(update={"scope_id": current.scope_id})
+        scopes.append(scope)
+
+    groups: List[RobustaPermissionGroup] = []
+    for group in desired_groups:
+        current = current_groups.get(group.name)
+        update = {}
+        if scope_ids and any(scope_id in scope_ids for scope_id in group.scopes):
+            update["scopes"] = [scope_ids.get(scope_id, scope_id) for scope_id in group.scopes]
+        if current and current.group_id != group.group_id:
+            update["group_id"] = current.group_id
+        groups.append(group.model_copy(update=update) if update else group)
+
+    return scopes, groups
+
+
+def compute_plan(
+        account_id: str,
+        desired_scopes: List[RobustaPermissionScope],
+        desired_groups: List[RobustaPermissionGroup],
+        current_scopes: Dict[str, RobustaPermissionScope],
+        current_groups: Dict[str, RobustaPermissionGroup],
+) -> SyncPlan:
+    """
+    Diff the desired scopes and groups against the stored ones, by name.
+    Entities that already exist keep their stored id, so unchanged entities have the same canonical form as the
+    stored ones, and the diff is a set difference of canonical forms.
+    """
+    plan = SyncPlan(account_id=account_id)
+    scopes, groups = adopt_stored_ids(desired_scopes, desired_groups, current_scopes, current_groups)
+
+    stored_scopes = {scope.canonical for scope in current_scopes.values()}
+    for scope in scopes:
+        if scope.canonical not in stored_scopes:
+            (plan.scopes_to_update if scope.name in current_scopes else plan.scopes_to_create).append(scope)
+
+    desired_scope_names = {scope.name for scope in desired_scopes}
+    plan.scopes_to_delete = [scope for name, scope in current_scopes.items() if name not in desired_scope_names]
+
+    stored_groups = {group.canonical for group in current_groups.values()}
+    for group in groups:
+        if group.canonical not in stored_groups:
+            (plan.groups_to_update if group.name in current_groups else plan.groups_to_create).append(group)
+
+    desired_group_names = {group.name for group in desired_groups}
+    plan.groups_to_delete = [group for name, group in current_groups.items() if name not in desired_group_names]
+
+    return plan
+
+
+class RbacReconciler:
+
+    def __init__(self, robusta_store: RobustaStore):
+        self.robusta_store = robusta_store
+
+    def plan(
+            self,
+            account_id: str,
+            scopes: List[RobustaPermissionScope],
+            groups: List[RobustaPermissionGroup]
+    ) -> SyncPlan:
+        with METRICS.phase("read_state"):
+            current_scopes = self.robusta_store.get_permission_scopes(account_id=account_id)
+            current_groups = self.robusta_store.get_permission_groups(account_id=account_id)
+        with METRICS.phase("diff"):
+            return compute_plan(account_id, scopes, groups, current_scopes, current_groups)
+
+    def apply(self, plan: SyncPlan):
+        if plan.is_empty():
+            logging.info(f"Account {plan.account_id} rbac is up to date, nothing to apply")
+            return
+
+        logging.info(f"Applying rbac changes for account {plan.account_id}: {plan.summary()}")
+
+        # create and update scopes first, then groups, because of foreign keys
+        if plan.scopes_to_create or plan.scopes_to_update:
+            with METRICS.phase("upsert_scopes"):
+                self.robusta_store.upsert_scopes(scopes=plan.scopes_to_create + plan.scopes_to_update)
+
+        if plan.groups_to_create or plan.groups_to_update:
+            with METRICS.phase("upsert_groups"):
+                self.robusta_store.upsert_groups(groups=plan.groups_to_create + plan.groups_to_update)
+
+        # groups that are no longer needed are deleted before the scopes they may reference
+        if plan.groups_to_delete:
+            with METRICS.phase("delete_groups"):
+                self.robusta_store.delete_groups(
+                    account_id=plan.account_id, group_ids=[group.group_id for group in plan.groups_to_delete]
+                )
+
+        if plan.scopes_to_delete:
+            with METRICS.phase("delete_scopes"):
+                self.robusta_store.delete_scopes(
+                    account_id=plan.account_id, scope_ids=[scope.scope_id for scope in plan.scopes_to_delete]
+                )
+
+        METRICS.add_rows_changed("scopes", "created", len(plan.scopes_to_create))
+        METRICS.add_rows_changed("scopes", "updated", len(plan.scopes_to_update))
+        METRICS.add_rows_changed("scopes", "deleted", len(plan.scopes_to_delete))
+        METRICS.add_rows_changed("groups", "created", len(plan.groups_to_create))
+        METRICS.add_rows_changed("groups", "updated", len(plan.groups_to_update))
+        METRICS.add_rows_changed("groups", "deleted", len(plan.groups_to_delete))
+
+    def sync(
+            self,
+            account_id: str,
+            scopes: List[RobustaPermissionScope],
+            groups: List[RobustaPermissionGroup]
+    ) -> SyncPlan:
+        plan = self.plan(account_id, scopes, groups)
+        self.apply(plan)
+        return plan
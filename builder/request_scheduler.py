@@ -0,0 +1,211 @@
+import logging
+import random
+import threading
+import time
+from concurrent.futures import Future
+from typing import Callable, Dict, Hashable, Optional, TypeVar
+
+import httpx
+import requests
+from postgrest.exceptions import APIError
+from pydantic import BaseModel
+
+from builder.metrics import METRICS
+
+T = TypeVar("T")
+
+# http statuses of a throttled or temporarily failing platform
+RETRYABLE_STATUSES = {429, 500, 502, 503, 504}
+# postgres error codes of transient failures: serialization failure, deadlock, too many connections,
+# statement timeout and admin shutdown. Connection errors (08xxx) are transient too
+TRANSIENT_DB_ERROR_CODES = {"40001", "40P01", "53300", "57014", "57P01"}
+# postgres error codes that mean the platform is overloaded
+OVERLOAD_DB_ERROR_CODES = {"53300", "57014"}
+# PostgREST error codes of an expired or invalid jwt
+AUTH_ERROR_CODES = {"PGRST301", "PGRST302"}
+
+
+class RequestFailure(BaseModel):
+    reason: str
+    retryable: bool = False
+    # the platform asks to slow down
+    throttled: bool = False
+    # the session token expired
+    auth: bool = False
+    # False if the request never reached the platform, so even non idempotent requests can be retried
+    sent: bool = True
+    retry_after: Optional[float] = None
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    # only the seconds format is supported. Http dates are ignored
+    try:
+        return max(0.0, float(value)) if value else None
+    except ValueError:
+        return None
+
+
+def classify_failure(error: Exception) -> RequestFailure:
+    if isinstance(error, (requests.exceptions.ConnectTimeout, httpx.ConnectError, httpx.ConnectTimeout)):
+        return RequestFailure(reason="connect", retryable=True, sent=False)
+    if isinstance(error, (requests.ConnectionError, requests.Timeout, httpx.TransportError)):
+        return RequestFailure(reason="transport", retryable=True)
+
+    status = None
+    retry_after = None
+    if isinstance(error, (requests.HTTPError, httpx.HTTPStatusError)) and error.response is not None:
+        status = error.response.status_code
+        retry_after = parse_retry_after(error.response.headers.get("Retry-After"))
+    elif isinstance(error, APIError):
+        # errors without a json body carry the http status as their code. Postgres error codes have 5 characters
+        code = str(error.code or "")
+        if len(code) == 3 and code.isdigit():
+            status = int(code)
+        elif code in AUTH_ERROR_CODES:
+            return RequestFailure(reason="auth", retryable=True, auth=True)
+        elif code in TRANSIENT_DB_ERROR_CODES or code.startswith("08"):
+            return RequestFailure(reason=f"db_{code}", retryable=True, throttled=code in OVERLOAD_DB_ERROR_CODES)
+
+    if status == 401:
+        return RequestFailure(reason="auth", retryable=True, auth=True)
+    if status in RETRYABLE_STATUSES:
+        return RequestFailure(reason=str(status), retryable=True, throttled=True, retry_after=retry_after)
+    return RequestFailure(reason="error")
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket limiting the requests rate. The rate starts at max_rate. It's halved, at most once per second, when
+    the platform throttles or fails, and increases additively after successful requests (by about one request per
+    second, every second), back up to max_rate
+    """
+
+    def __init__(self, max_rate: float, min_rate: float = 1.0, burst: int = 10):
+        self.lock = threading.Lock()
+        self.max_rate = max_rate
+        self.min_rate = min(min_rate, max_rate)
+        self.rate = max_rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated_at = time.monotonic()
+        self.decreased_at = 0.0
+        # set by Retry-After responses. No request is sent before it
+        self.blocked_until = 0.0
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                wait = self.blocked_until - now
+                if wait <= 0:
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def on_success(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate + 1 / self.rate)
+
+    def on_throttled(self, retry_after: Optional[float] = None):
+        with self.lock:
+            now = time.monotonic()
+            if retry_after:
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+            # concurrent requests failing together are a single signal
+            if now - self.decreased_at >= 1:
+                self.decreased_at = now
+                self.rate = max(self.min_rate, self.rate / 2)
+                self.tokens = min(self.tokens, 0.0)
+                logging.warning(f"Platform throttled, requests rate limited to {self.rate:.1f}/s")
+
+
+class RequestScheduler:
+    """
+    Sends the StorageDal requests: rate limited, retried with jittered exponential backoff on transient failures,
+    and with concurrent identical reads coalesced into a single request
+    """
+
+    def __init__(
+            self,
+            rate_limiter: Optional[AdaptiveRateLimiter] = None,
+            max_retries: int = 3,
+            backoff: float = 0.5,
+            max_backoff: float = 30.0,
+            on_auth_error: Optional[Callable[[], None]] = None,
+    ):
+        self.rate_limiter = rate_limiter
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.on_auth_error = on_auth_error
+        self.lock = threading.Lock()
+        self.in_flight: Dict[Hashable, Future] = {}
+
+    def call(
+            self,
+            operation: str,
+            func: Callable[[], T],
+            idempotent: bool = True,
+            coalesce_key: Optional[Hashable] = None,
+    ) -> T:
+        """
+        Send a request. Requests with a coalesce_key, sent while a request with the same key is in flight, wait for
+        its result instead of being sent. Only reads may be coalesced, and callers must not change the result
+        """
+        if coalesce_key is None:
+            return self.__call_with_retries(operation, func, idempotent)
+
+        with self.lock:
+            future = self.in_flight.get(coalesce_key)
+            owner = future is None
+            if owner:
+                future = Future()
+                self.in_flight[coalesce_key] = future
+        if not owner:
+            METRICS.add_coalesced(operation)
+            return future.result()
+
+        try:
+            result = self.__call_with_retries(operation, func, idempotent)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise e
+        finally:
+            with self.lock:
+                del self.in_flight[coalesce_key]
+
+    def __call_with_retries(self, operation: str, func: Callable[[], T], idempotent: bool) -> T:
+        attempt = 0
+        while True:
+            if self.rate_limiter:
+                self.rate_limiter.acquire()
+            try:
+                result = func()
+            except Exception as e:
+                failure = classify_failure(e)
+                if failure.throttled and self.rate_limiter:
+                    self.rate_limiter.on_throttled(failure.retry_after)
+                if not failure.retryable or (failure.sent and not idempotent) or attempt >= self.max_retries:
+                    raise e
+                if failure.auth and self.on_auth_error:
+                    self.on_auth_error()
+
+                # full jitter, so concurrent requests failing together don't retry together
+                delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+                delay = max(delay, failure.retry_after or 0)
+                attempt += 1
+                METRICS.add_retry(operation, failure.reason)
+                logging.warning(f"{operation} failed ({failure.reason}), retry {attempt} of {self.max_retries} "
+                                f"in {delay:.2f}s")
+                time.sleep(delay)
+                continue
+
+            if self.rate_limiter:
+                self.rate_limiter.on_success()
+            return result
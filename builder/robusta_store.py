@@ -1,20 +1,49 @@
 from collections import defaultdict
-from typing import List, Dict
+from typing import List, Dict, Optional
 
-from builder.env_vars import STORE_URL, STORE_API_KEY, STORE_USER, STORE_PASSWORD, ACCOUNT_NAME
+from builder.env_vars import STORE_URL, STORE_API_KEY, STORE_USER, STORE_PASSWORD, ACCOUNT_NAME, \
+    STORE_BATCH_SIZE, STORE_MAX_CONCURRENCY, STORE_PAGE_SIZE, STORE_HTTP_POOL_SIZE, STORE_HTTP_TIMEOUT, \
+    STORE_HTTP_RETRIES, STORE_HTTP_BACKOFF, STORE_BACKEND, STORE_SQLITE_PATH, STORE_RATE_LIMIT, STORE_MIN_RATE_LIMIT
 from builder.model import RobustaPermissionScope, RobustaPermissionGroup, User
-from builder.storage_dal import StorageDal
+from builder.storage_backend import StorageBackend
 
 
-class RobustaStore:
-
-    def __init__(self):
-        self.dal = StorageDal(
+def create_storage_backend(backend: str) -> StorageBackend:
+    """
+    Create the storage backend configured in the env vars.
+    Backends are imported only when used, so local backends don't load the supabase client
+    """
+    if backend == "supabase":
+        from builder.storage_dal import StorageDal
+        return StorageDal(
             url=STORE_URL,
             key=STORE_API_KEY,
             email=STORE_USER,
             password=STORE_PASSWORD,
+            batch_size=STORE_BATCH_SIZE,
+            max_concurrency=STORE_MAX_CONCURRENCY,
+            page_size=STORE_PAGE_SIZE,
+            http_pool_size=STORE_HTTP_POOL_SIZE,
+            http_timeout=STORE_HTTP_TIMEOUT,
+            http_retries=STORE_HTTP_RETRIES,
+            http_backoff=STORE_HTTP_BACKOFF,
+            rate_limit=STORE_RATE_LIMIT,
+            min_rate_limit=STORE_MIN_RATE_LIMIT,
         )
+    if backend == "memory":
+        from builder.memory_dal import MemoryStorageDal
+        return MemoryStorageDal(batch_size=STORE_BATCH_SIZE)
+    if backend == "sqlite":
+        from builder.sqlite_dal import SqliteStorageDal
+        return SqliteStorageDal(path=STORE_SQLITE_PATH, batch_size=STORE_BATCH_SIZE)
+    raise Exception(f"Unknown store backend {backend}. Must be one of 'supabase', 'memory' or 'sqlite'")
+
+
+class RobustaStore:
+
+    def __init__(self, dal: Optional[StorageBackend] = None):
+        # a specific backend, such as MemoryStorageDal, can be passed instead of the configured one
+        self.dal = dal or create_storage_backend(STORE_BACKEND)
 
     def close(self):
         try:
@@ -48,18 +77,44 @@ class RobustaStore:
     def delete_group(self, group: RobustaPermissionGroup):
         self.dal.delete_group(group=group)
 
+    def upsert_scopes(self, scopes: List[RobustaPermissionScope]):
+        self.dal.upsert_scopes(scopes=scopes)
+
+    def delete_scopes(self, account_id: str, scope_ids: List[str]):
+        self.dal.delete_scopes(account_id=account_id, scope_ids=scope_ids)
+
+    def upsert_groups(self, groups: List[RobustaPermissionGroup]):
+        self.dal.upsert_groups(groups=groups)
+
+    def delete_groups(self, account_id: str, group_ids: List[str]):
+        self.dal.delete_groups(account_id=account_id, group_ids=group_ids)
+
     def delete_account_groups(self, account_id: str):
         self.dal.delete_account_groups(account_id=account_id)
 
     def delete_account_scopes(self, account_id: str):
         self.dal.delete_account_scopes(account_id=account_id)
 
+    def apply_account_rbac(
+            self,
+            account_id: str,
+            scopes: List[RobustaPermissionScope],
+            groups: List[RobustaPermissionGroup]
+    ) -> Dict:
+        return self.dal.apply_account_rbac(account_id=account_id, scopes=scopes, groups=groups)
+
     def set_user_groups(self, user_id: str, groups: List[str]):
         self.dal.set_user_groups(user_id, groups)
 
-    def get_users_groups(self) -> Dict[str, List[str]]:
+    def set_users_groups(self, account_id: str, users_groups: Dict[str, List[str]]):
+        self.dal.set_users_groups(account_id, users_groups)
+
+    def get_users_groups(self, group_ids: Optional[List[str]] = None) -> Dict[str, List[str]]:
+        """
+        Groups of every user. If group_ids is set, only these groups are read
+        """
         user_groups: Dict[str, List[str]] = defaultdict(list)
-        stored_groups = self.dal.get_users_groups()
+        stored_groups = self.dal.get_users_groups(group_ids=group_ids)
         for user_group in stored_groups:
             user_groups[user_group.user_id].append(user_group.group_id)
         return user_groups
\ No newline at end of file
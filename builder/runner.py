@@ -0,0 +1,205 @@
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Callable, Union
+
+from pydantic import BaseModel
+
+from builder.config_builder import ConfigBuilder, accounts_users_configs
+from builder.env_vars import APPLY_MODE, FORCE_APPLY
+from builder.fingerprint import config_fingerprint, FingerprintStore, MemoryFingerprintStore
+from builder.metrics import METRICS
+from builder.plan import AccountPlan
+from builder.reconciler import RbacReconciler, adopt_stored_ids
+from builder.robusta_store import RobustaStore
+from builder.user_sync import UsersGroupsSync
+
+APPLIED = "applied"
+UNCHANGED = "unchanged"
+FAILED = "failed"
+
+
+class AccountResult(BaseModel):
+    account_id: str
+    status: str
+    changes: str = ""
+    users_changes: str = ""
+    error: Optional[str] = None
+    duration: float = 0
+
+
+def apply_rbac(robusta_store: RobustaStore, config_reader: ConfigBuilder) -> str:
+    account_id = config_reader.get_account_id()
+    if APPLY_MODE == "atomic":
+        # the whole account is replaced in a single transaction, on the server side.
+        # Stored entities keep their ids, so they're not recreated, and their users groups are kept
+        with METRICS.phase("read_state"):
+            current_scopes = robusta_store.get_permission_scopes(account_id=account_id)
+            current_groups = robusta_store.get_permission_groups(account_id=account_id)
+        scopes, groups = adopt_stored_ids(
+            config_reader.get_scopes(), config_reader.get_groups(), current_scopes, current_groups
+        )
+        with METRICS.phase("apply_atomic"):
+            result = robusta_store.apply_account_rbac(account_id=account_id, scopes=scopes, groups=groups)
+        if isinstance(result, dict):
+            METRICS.add_rows_changed("scopes", "upserted", result.get("upserted_scopes", 0))
+            METRICS.add_rows_changed("scopes", "deleted", result.get("deleted_scopes", 0))
+            METRICS.add_rows_changed("groups", "upserted", result.get("upserted_groups", 0))
+            METRICS.add_rows_changed("groups", "deleted", result.get("deleted_groups", 0))
+        logging.info(f"Account {account_id} rbac applied atomically: {result}")
+        return str(result)
+    elif APPLY_MODE == "incremental":
+        reconciler = RbacReconciler(robusta_store)
+        plan = reconciler.sync(
+            account_id=account_id,
+            scopes=config_reader.get_scopes(),
+            groups=config_reader.get_groups()
+        )
+        logging.info(f"Account {account_id} rbac changes: {plan.summary()}")
+        return plan.summary()
+    else:
+        raise Exception(f"Unknown apply mode {APPLY_MODE}. Must be either 'incremental' or 'atomic'")
+
+
+def sync_users_groups(robusta_store: RobustaStore, account_id: str, users_config: Dict) -> str:
+    users_sync = UsersGroupsSync(robusta_store, **users_config)
+    users_plan = users_sync.sync(account_id=account_id)
+    logging.info(f"Account {account_id} users groups changes: {users_plan.summary()}")
+    return users_plan.summary()
+
+
+class RbacRunner:
+    """
+    Applies the configuration of many accounts, concurrently, over a single shared RobustaStore
+    """
+
+    def __init__(
+            self,
+            store_factory: Callable[[], RobustaStore],
+            fingerprint_store: Optional[Union[FingerprintStore, MemoryFingerprintStore]] = None,
+            max_concurrency: int = 1,
+    ):
+        self.store_factory = store_factory
+        self.fingerprint_store = fingerprint_store
+        self.max_concurrency = max_concurrency
+        self.robusta_store: Optional[RobustaStore] = None
+
+    def __get_store(self) -> RobustaStore:
+        # the store signs in to the platform, so it's created only when there's something to apply
+        if not self.robusta_store:
+            self.robusta_store = self.store_factory()
+        return self.robusta_store
+
+    def __unchanged(self, account_id: str, fingerprint: str, force: bool) -> bool:
+        return bool(self.fingerprint_store) and not FORCE_APPLY and not force and \
+            self.fingerprint_store.get(account_id) == fingerprint
+
+    def __apply_account(
+            self,
+            config_reader: ConfigBuilder,
+            fingerprint: str,
+            unchanged: bool,
+            users_config: Optional[Dict],
+    ) -> AccountResult:
+        account_id = config_reader.get_account_id()
+        start = time.time()
+        result = AccountResult(account_id=account_id, status=UNCHANGED if unchanged else APPLIED)
+        try:
+            if not unchanged:
+                result.changes = apply_rbac(self.robusta_store, config_reader)
+                if self.fingerprint_store:
+                    self.fingerprint_store.save(account_id, fingerprint)
+
+            # users may change on the platform, so users groups are synced even if the configuration didn't change
+            if users_config:
+                result.users_changes = sync_users_groups(self.robusta_store, account_id, users_config)
+        except Exception as e:
+            logging.exception(f"Error building rbac definitions for account {account_id}")
+            result.status = FAILED
+            result.error = str(e)
+
+        result.duration = round(time.time() - start, 3)
+        return result
+
+    def run(self, configs: Dict[str, ConfigBuilder], force: bool = False) -> List[AccountResult]:
+        """
+        Apply the accounts configurations. Unless force is set, accounts whose configuration fingerprint matches
+        the last applied one are skipped
+        """
+        users_configs = accounts_users_configs(configs)
+        fingerprints: Dict[str, str] = {}
+        unchanged: Dict[str, bool] = {}
+        for account_id, config_reader in configs.items():
+            with METRICS.phase("fingerprint"):
+                fingerprints[account_id] = config_fingerprint(
+                    account_id, config_reader.get_scopes(), config_reader.get_groups()
+                )
+            unchanged[account_id] = self.__unchanged(account_id, fingerprints[account_id], force)
+            if unchanged[account_id]:
+                logging.info(f"Account {account_id} configuration unchanged since the last apply "
+                             f"(fingerprint {fingerprints[account_id]}), skipping rbac apply")
+
+        if all(unchanged.values()) and not any(users_configs.values()):
+            return [AccountResult(account_id=account_id, status=UNCHANGED) for account_id in configs.keys()]
+
+        self.__get_store()
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_concurrency, len(configs)))) as executor:
+            return list(executor.map(
+                lambda config_reader: self.__apply_account(
+                    config_reader,
+                    fingerprints[config_reader.get_account_id()],
+                    unchanged[config_reader.get_account_id()],
+                    users_configs[config_reader.get_account_id()],
+                ),
+                configs.values()
+            ))
+
+    def __apply_plan(self, plan: AccountPlan) -> AccountResult:
+        start = time.time()
+        result = AccountResult(account_id=plan.account_id, status=UNCHANGED if plan.is_empty() else APPLIED)
+        try:
+            RbacReconciler(self.robusta_store).apply(plan.rbac)
+            result.changes = plan.rbac.summary()
+            if self.fingerprint_store:
+                self.fingerprint_store.save(plan.account_id, plan.fingerprint)
+
+            if plan.users is not None:
+                # the plan holds the users groups, so the users configuration isn't needed
+                UsersGroupsSync(self.robusta_store).apply(plan.users)
+                result.users_changes = plan.users.summary()
+        except Exception as e:
+            logging.exception(f"Error applying the rbac plan of account {plan.account_id}")
+            result.status = FAILED
+            result.error = str(e)
+
+        result.duration = round(time.time() - start, 3)
+        return result
+
+    def run_plans(self, plans: List[AccountPlan]) -> List[AccountResult]:
+        """
+        Apply precomputed plans as is, without reading the stored state again
+        """
+        if all(plan.is_empty() for plan in plans):
+            for plan in plans:
+                if self.fingerprint_store:
+                    self.fingerprint_store.save(plan.account_id, plan.fingerprint)
+            return [AccountResult(account_id=plan.account_id, status=UNCHANGED) for plan in plans]
+
+        self.__get_store()
+        with ThreadPoolExecutor(max_workers=max(1, min(self.max_concurrency, len(plans)))) as executor:
+            return list(executor.map(self.__apply_plan, plans))
+
+    def close(self):
+        if self.robusta_store:
+            self.robusta_store.close()
+
+
+def log_results(results: List[AccountResult]):
+    logging.info(f"Accounts summary ({len(results)} accounts):")
+    for result in results:
+        details = f"rbac: {result.changes}" if result.changes else ""
+        if result.users_changes:
+            details += f" users: {result.users_changes}"
+        if result.error:
+            details += f" error: {result.error}"
+        logging.info(f"  {result.account_id} {result.status} in {result.duration}s {details}")
@@ -0,0 +1,90 @@
+import json
+import logging
+from typing import Dict, List, Tuple
+
+from pydantic import BaseModel
+
+from builder.model import RobustaPermissionScope, RobustaPermissionGroup, ALL_NAMESPACES
+
+
+class ScopeOptimizationReport(BaseModel):
+    account_id: str
+    scopes_before: int = 0
+    scopes_after: int = 0
+    namespaces_before: int = 0
+    namespaces_after: int = 0
+    bytes_before: int = 0
+    bytes_after: int = 0
+    # merged scope name -> name of the scope it was merged into
+    merged_scopes: Dict[str, str] = {}
+
+    def summary(self) -> str:
+        return f"scopes: {self.scopes_before} -> {self.scopes_after} ({len(self.merged_scopes)} merged), " \
+               f"namespace entries: {self.namespaces_before} -> {self.namespaces_after}, " \
+               f"scope rows size: {self.bytes_before} -> {self.bytes_after} bytes"
+
+
+def normalize_scope_data(scope_data: Dict[str, List[str]]) -> Dict[str, List[str]]:
+    """
+    Sort the clusters and namespaces, and drop duplicate namespaces.
+    '*' covers every namespace, so a list with '*' is collapsed to just '*'
+    """
+    normalized = {}
+    for cluster in sorted(scope_data):
+        namespaces = scope_data[cluster]
+        normalized[cluster] = [ALL_NAMESPACES] if ALL_NAMESPACES in namespaces else sorted(set(namespaces))
+    return normalized
+
+
+def scopes_stats(scopes: List[RobustaPermissionScope]) -> Tuple[int, int]:
+    namespaces = sum(len(cluster_namespaces) for scope in scopes for cluster_namespaces in scope.scope_data.values())
+    size = sum(len(json.dumps(scope.dict(), separators=(",", ":"))) for scope in scopes)
+    return namespaces, size
+
+
+def optimize_scopes(
+        account_id: str,
+        scopes: List[RobustaPermissionScope],
+        groups: List[RobustaPermissionGroup],
+        merge: bool,
+) -> Tuple[List[RobustaPermissionScope], List[RobustaPermissionGroup], ScopeOptimizationReport]:
+    """
+    Normalize the data of every scope. If merge is set, scopes of the same type with the same data are merged into
+    the first one defined, and the groups referencing the merged scopes reference it instead
+    """
+    report = ScopeOptimizationReport(account_id=account_id, scopes_before=len(scopes))
+    report.namespaces_before, report.bytes_before = scopes_stats(scopes)
+
+    optimized_scopes: List[RobustaPermissionScope] = []
+    survivors: Dict[Tuple, RobustaPermissionScope] = {}
+    # merged scope id -> surviving scope id
+    replaced_ids: Dict[str, str] = {}
+    for scope in scopes:
+        scope_data = normalize_scope_data(scope.scope_data)
+        if scope_data != scope.scope_data:
+            scope = scope.model_copy(update={"scope_data": scope_data})
+
+        if merge:
+            key = (scope.scope_type, tuple((cluster, tuple(namespaces)) for cluster, namespaces in scope_data.items()))
+            survivor = survivors.setdefault(key, scope)
+            if survivor is not scope:
+                replaced_ids[scope.scope_id] = survivor.scope_id
+                report.merged_scopes[scope.name] = survivor.name
+                continue
+        optimized_scopes.append(scope)
+
+    optimized_groups = groups
+    if replaced_ids:
+        optimized_groups = []
+        for group in groups:
+            if any(scope_id in replaced_ids for scope_id in group.scopes):
+                scope_ids = dict.fromkeys(replaced_ids.get(scope_id, scope_id) for scope_id in group.scopes)
+                group = group.model_copy(update={"scopes": list(scope_ids)})
+            optimized_groups.append(group)
+
+    report.scopes_after = len(optimized_scopes)
+    report.namespaces_after, report.bytes_after = scopes_stats(optimized_scopes)
+    if report.merged_scopes:
+        logging.info(f"Account {account_id} merged identical scopes: " +
+                     ", ".join(f"{name} -> {survivor}" for name, survivor in report.merged_scopes.items()))
+    return optimized_scopes, optimized_groups, report
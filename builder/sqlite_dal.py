@@ -0,0 +1,363 @@
+import json
+import logging
+import sqlite3
+import threading
+from typing import Dict, List, Optional, Iterable
+
+from builder.batch_utils import chunks
+from builder.model import User, RobustaPermissionScope, RobustaPermissionGroup, UserGroup
+from builder.storage_backend import StorageBackend, PERMISSION_SCOPES_TABLE, PERMISSION_GROUPS_TABLE, \
+    USER_GROUPS_TABLE
+
+# group scopes are a json array in PermissionGroups, like the platform DB array column.
+# GroupScopes mirrors it, so sqlite can enforce the groups to scopes foreign key
+GROUP_SCOPES_TABLE = "GroupScopes"
+USERS_TABLE = "Users"
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS "{PERMISSION_SCOPES_TABLE}" (
+    scope_id TEXT PRIMARY KEY,
+    account_id TEXT NOT NULL,
+    scope_type TEXT NOT NULL,
+    name TEXT NOT NULL,
+    scope_data TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS scopes_account_idx ON "{PERMISSION_SCOPES_TABLE}" (account_id);
+
+CREATE TABLE IF NOT EXISTS "{PERMISSION_GROUPS_TABLE}" (
+    group_id TEXT PRIMARY KEY,
+    account_id TEXT NOT NULL,
+    provider_group_id TEXT NOT NULL,
+    name TEXT NOT NULL,
+    scope_type TEXT NOT NULL,
+    scopes TEXT NOT NULL,
+    permissions TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS groups_account_idx ON "{PERMISSION_GROUPS_TABLE}" (account_id);
+
+CREATE TABLE IF NOT EXISTS "{GROUP_SCOPES_TABLE}" (
+    group_id TEXT NOT NULL REFERENCES "{PERMISSION_GROUPS_TABLE}" (group_id) ON DELETE CASCADE,
+    scope_id TEXT NOT NULL REFERENCES "{PERMISSION_SCOPES_TABLE}" (scope_id),
+    PRIMARY KEY (group_id, scope_id)
+);
+CREATE INDEX IF NOT EXISTS group_scopes_scope_idx ON "{GROUP_SCOPES_TABLE}" (scope_id);
+
+CREATE TABLE IF NOT EXISTS "{USER_GROUPS_TABLE}" (
+    user_id TEXT NOT NULL,
+    group_id TEXT NOT NULL REFERENCES "{PERMISSION_GROUPS_TABLE}" (group_id) ON DELETE CASCADE,
+    PRIMARY KEY (user_id, group_id)
+);
+CREATE INDEX IF NOT EXISTS user_groups_group_idx ON "{USER_GROUPS_TABLE}" (group_id);
+
+CREATE TABLE IF NOT EXISTS "{USERS_TABLE}" (
+    id TEXT PRIMARY KEY,
+    email TEXT
+);
+"""
+
+# unchanged rows are not rewritten, like in sql/rbac_builder_apply_account.sql
+UPSERT_SCOPE = f"""
+INSERT INTO "{PERMISSION_SCOPES_TABLE}" (scope_id, account_id, scope_type, name, scope_data)
+VALUES (:scope_id, :account_id, :scope_type, :name, :scope_data)
+ON CONFLICT (scope_id) DO UPDATE
+    SET account_id = excluded.account_id, scope_type = excluded.scope_type, name = excluded.name,
+        scope_data = excluded.scope_data
+    WHERE (account_id, scope_type, name, scope_data)
+          IS NOT (excluded.account_id, excluded.scope_type, excluded.name, excluded.scope_data)
+"""
+
+UPSERT_GROUP = f"""
+INSERT INTO "{PERMISSION_GROUPS_TABLE}" (group_id, account_id, provider_group_id, name, scope_type, scopes, permissions)
+VALUES (:group_id, :account_id, :provider_group_id, :name, :scope_type, :scopes, :permissions)
+ON CONFLICT (group_id) DO UPDATE
+    SET account_id = excluded.account_id, provider_group_id = excluded.provider_group_id, name = excluded.name,
+        scope_type = excluded.scope_type, scopes = excluded.scopes, permissions = excluded.permissions
+    WHERE (account_id, provider_group_id, name, scope_type, scopes, permissions)
+          IS NOT (excluded.account_id, excluded.provider_group_id, excluded.name, excluded.scope_type,
+                  excluded.scopes, excluded.permissions)
+"""
+
+
+def scope_row(scope: RobustaPermissionScope) -> Dict:
+    row = scope.dict()
+    row["scope_data"] = json.dumps(row["scope_data"], sort_keys=True)
+    return row
+
+
+def group_row(group: RobustaPermissionGroup) -> Dict:
+    row = group.dict()
+    row["scopes"] = json.dumps(row["scopes"])
+    row["permissions"] = json.dumps(row["permissions"])
+    return row
+
+
+class SqliteStorageDal(StorageBackend):
+    """
+    SQLite storage backend, for local runs, profiling and large scale tests, without the platform.
+
+    Enforces the platform DB foreign keys: groups must reference existing scopes, referenced scopes can't be
+    deleted, and deleting a group deletes its users groups. Every write runs in a transaction.
+    The database is kept in memory if path is ':memory:'
+    """
+
+    def __init__(self, path: str = ":memory:", batch_size: int = 500, users: Optional[List[User]] = None):
+        self.path = path
+        self.batch_size = batch_size
+        # writes may come from several threads, and sqlite connections must not be used concurrently
+        self.lock = threading.RLock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA foreign_keys = ON")
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.executescript(SCHEMA)
+        if users:
+            self.add_users(users)
+
+    def add_users(self, users: List[User]):
+        with self.lock, self.connection:
+            self.connection.executemany(
+                f'INSERT OR REPLACE INTO "{USERS_TABLE}" (id, email) VALUES (?, ?)',
+                [(user.id, user.email) for user in users]
+            )
+
+    def __select(self, query: str, params=()) -> List[Dict]:
+        with self.lock:
+            cursor = self.connection.execute(query, params)
+            columns = [column[0] for column in cursor.description]
+            return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+    def get_account_id(self, account_name: str) -> Optional[str]:
+        return None
+
+    def get_robusta_users(self) -> List[User]:
+        return [User(**row) for row in self.__select(f'SELECT id, email FROM "{USERS_TABLE}" ORDER BY id')]
+
+    def get_permission_scopes(self, account_id: str) -> Iterable[RobustaPermissionScope]:
+        rows = self.__select(
+            f'SELECT * FROM "{PERMISSION_SCOPES_TABLE}" WHERE account_id = ? ORDER BY scope_id', (account_id,)
+        )
+        for row in rows:
+            row["scope_data"] = json.loads(row["scope_data"])
+            yield RobustaPermissionScope(**row)
+
+    def get_permission_groups(self, account_id: str) -> Iterable[RobustaPermissionGroup]:
+        rows = self.__select(
+            f'SELECT * FROM "{PERMISSION_GROUPS_TABLE}" WHERE account_id = ? ORDER BY group_id', (account_id,)
+        )
+        for row in rows:
+            row["scopes"] = json.loads(row["scopes"])
+            row["permissions"] = json.loads(row["permissions"])
+            yield RobustaPermissionGroup(**row)
+
+    def get_users_groups(self, group_ids: Optional[List[str]] = None) -> Iterable[UserGroup]:
+        if group_ids is None:
+            rows = self.__select(f'SELECT user_id, group_id FROM "{USER_GROUPS_TABLE}" ORDER BY user_id, group_id')
+        else:
+            rows = []
+            for ids in chunks(group_ids, self.batch_size):
+                rows.extend(self.__select(
+                    f'SELECT user_id, group_id FROM "{USER_GROUPS_TABLE}" '
+                    f'WHERE group_id IN ({",".join("?" * len(ids))}) ORDER BY user_id, group_id',
+                    ids
+                ))
+        return [UserGroup(**row) for row in rows]
+
+    def __upsert_scopes(self, scopes: List[RobustaPermissionScope]) -> int:
+        upserted = 0
+        for batch in chunks(scopes, self.batch_size):
+            upserted += self.connection.executemany(UPSERT_SCOPE, [scope_row(scope) for scope in batch]).rowcount
+        return upserted
+
+    def __upsert_groups(self, groups: List[RobustaPermissionGroup]) -> int:
+        upserted = 0
+        for batch in chunks(groups, self.batch_size):
+            upserted += self.connection.executemany(UPSERT_GROUP, [group_row(group) for group in batch]).rowcount
+            group_ids = [group.group_id for group in batch]
+            self.connection.execute(
+                f'DELETE FROM "{GROUP_SCOPES_TABLE}" WHERE group_id IN ({",".join("?" * len(group_ids))})', group_ids
+            )
+            self.connection.executemany(
+                f'INSERT INTO "{GROUP_SCOPES_TABLE}" (group_id, scope_id) VALUES (?, ?)',
+                [(group.group_id, scope_id) for group in batch for scope_id in set(group.scopes)]
+            )
+        return upserted
+
+    def __delete(self, table: str, id_column: str, account_id: str, ids: List[str]) -> int:
+        deleted = 0
+        for batch in chunks(ids, self.batch_size):
+            deleted += self.connection.execute(
+                f'DELETE FROM "{table}" WHERE account_id = ? AND {id_column} IN ({",".join("?" * len(batch))})',
+                [account_id, *batch]
+            ).rowcount
+        return deleted
+
+    def __foreign_ids(self, table: str, id_column: str, account_id: str, ids: List[str]) -> List[str]:
+        foreign_ids = []
+        for batch in chunks(ids, self.batch_size):
+            foreign_ids.extend(row[0] for row in self.connection.execute(
+                f'SELECT {id_column} FROM "{table}" '
+                f'WHERE account_id != ? AND {id_column} IN ({",".join("?" * len(batch))})',
+                [account_id, *batch]
+            ))
+        return foreign_ids
+
+    def __write(self, description: str, write):
+        try:
+            with self.lock, self.connection:
+                return write()
+        except Exception as e:
+            logging.exception(f"Failed to {description}")
+            raise e
+
+    def upsert_scope(self, scope: RobustaPermissionScope):
+        self.upsert_scopes([scope])
+
+    def upsert_scopes(self, scopes: List[RobustaPermissionScope]):
+        self.__write(f"upsert {len(scopes)} scopes", lambda: self.__upsert_scopes(scopes))
+
+    def delete_scope(self, scope: RobustaPermissionScope):
+        self.delete_scopes(scope.account_id, [scope.scope_id])
+
+    def delete_scopes(self, account_id: str, scope_ids: List[str]):
+        self.__write(
+            f"delete scopes {scope_ids} for {account_id}",
+            lambda: self.__delete(PERMISSION_SCOPES_TABLE, "scope_id", account_id, scope_ids)
+        )
+
+    def upsert_group(self, group: RobustaPermissionGroup):
+        self.upsert_groups([group])
+
+    def upsert_groups(self, groups: List[RobustaPermissionGroup]):
+        self.__write(f"upsert {len(groups)} groups", lambda: self.__upsert_groups(groups))
+
+    def delete_group(self, group: RobustaPermissionGroup):
+        self.delete_groups(group.account_id, [group.group_id])
+
+    def delete_groups(self, account_id: str, group_ids: List[str]):
+        self.__write(
+            f"delete groups {group_ids} for {account_id}",
+            lambda: self.__delete(PERMISSION_GROUPS_TABLE, "group_id", account_id, group_ids)
+        )
+
+    def delete_account_groups(self, account_id: str):
+        self.__write(
+            f"delete account groups for {account_id}",
+            lambda: self.connection.execute(
+                f'DELETE FROM "{PERMISSION_GROUPS_TABLE}" WHERE account_id = ?', (account_id,)
+            )
+        )
+
+    def delete_account_scopes(self, account_id: str):
+        self.__write(
+            f"delete account scopes for {account_id}",
+            lambda: self.connection.execute(
+                f'DELETE FROM "{PERMISSION_SCOPES_TABLE}" WHERE account_id = ?', (account_id,)
+            )
+        )
+
+    def set_user_groups(self, user_id: str, group_ids: List[str]):
+        def write():
+            self.connection.execute(f'DELETE FROM "{USER_GROUPS_TABLE}" WHERE user_id = ?', (user_id,))
+            self.connection.executemany(
+                f'INSERT INTO "{USER_GROUPS_TABLE}" (user_id, group_id) VALUES (?, ?)',
+                [(user_id, group_id) for group_id in group_ids]
+            )
+
+        self.__write(f"set groups {group_ids} of user {user_id}", write)
+
+    def __account_group_ids(self, account_id: str) -> set:
+        return {
+            row[0] for row in self.connection.execute(
+                f'SELECT group_id FROM "{PERMISSION_GROUPS_TABLE}" WHERE account_id = ?', (account_id,)
+            )
+        }
+
+    def __set_users_groups_batch(self, account_id: str, users_groups: Dict[str, List[str]]) -> Dict:
+        """
+        Same semantics as sql/rbac_builder_set_users_groups.sql
+        """
+        account_group_ids = self.__account_group_ids(account_id)
+        if any(group_id not in account_group_ids for group_ids in users_groups.values() for group_id in group_ids):
+            raise Exception(f"All groups must belong to account {account_id}")
+
+        deleted = 0
+        inserted = 0
+        for user_id, group_ids in users_groups.items():
+            current = {
+                row[0] for row in self.connection.execute(
+                    f'SELECT group_id FROM "{USER_GROUPS_TABLE}" WHERE user_id = ?', (user_id,)
+                )
+            }
+            removed = [group_id for group_id in current if group_id in account_group_ids and group_id not in group_ids]
+            added = [group_id for group_id in dict.fromkeys(group_ids) if group_id not in current]
+            self.connection.executemany(
+                f'DELETE FROM "{USER_GROUPS_TABLE}" WHERE user_id = ? AND group_id = ?',
+                [(user_id, group_id) for group_id in removed]
+            )
+            self.connection.executemany(
+                f'INSERT INTO "{USER_GROUPS_TABLE}" (user_id, group_id) VALUES (?, ?)',
+                [(user_id, group_id) for group_id in added]
+            )
+            deleted += len(removed)
+            inserted += len(added)
+        return {"deleted": deleted, "inserted": inserted}
+
+    def set_users_groups(self, account_id: str, users_groups: Dict[str, List[str]]):
+        for batch in chunks(users_groups.items(), self.batch_size):
+            self.__write(
+                f"set groups of {len(batch)} users for account {account_id}",
+                lambda: self.__set_users_groups_batch(account_id, dict(batch))
+            )
+
+    def __apply_account_rbac(
+            self,
+            account_id: str,
+            scopes: List[RobustaPermissionScope],
+            groups: List[RobustaPermissionGroup]
+    ) -> Dict:
+        """
+        Same semantics as sql/rbac_builder_apply_account.sql
+        """
+        if any(entity.account_id != account_id for entity in [*scopes, *groups]):
+            raise Exception(f"All scopes and groups must belong to account {account_id}")
+        if self.__foreign_ids(PERMISSION_SCOPES_TABLE, "scope_id", account_id, [scope.scope_id for scope in scopes]) \
+                or self.__foreign_ids(PERMISSION_GROUPS_TABLE, "group_id", account_id, [g.group_id for g in groups]):
+            raise Exception(f"Scope or group ids of account {account_id} belong to another account")
+
+        # groups reference scopes: removed groups are deleted first, then scopes are upserted before the groups
+        # that reference them, and removed scopes are deleted last, once no kept group references them
+        group_ids = {group.group_id for group in groups}
+        deleted_groups = [group_id for group_id in self.__account_group_ids(account_id) if group_id not in group_ids]
+        self.__delete(PERMISSION_GROUPS_TABLE, "group_id", account_id, deleted_groups)
+
+        upserted_scopes = self.__upsert_scopes(scopes)
+        upserted_groups = self.__upsert_groups(groups)
+
+        scope_ids = {scope.scope_id for scope in scopes}
+        deleted_scopes = [
+            row[0] for row in self.connection.execute(
+                f'SELECT scope_id FROM "{PERMISSION_SCOPES_TABLE}" WHERE account_id = ?', (account_id,)
+            ) if row[0] not in scope_ids
+        ]
+        self.__delete(PERMISSION_SCOPES_TABLE, "scope_id", account_id, deleted_scopes)
+
+        return {
+            "deleted_groups": len(deleted_groups),
+            "deleted_scopes": len(deleted_scopes),
+            "upserted_scopes": upserted_scopes,
+            "upserted_groups": upserted_groups,
+        }
+
+    def apply_account_rbac(
+            self,
+            account_id: str,
+            scopes: List[RobustaPermissionScope],
+            groups: List[RobustaPermissionGroup]
+    ) -> Dict:
+        return self.__write(
+            f"apply rbac for account {account_id}",
+            lambda: self.__apply_account_rbac(account_id, scopes, groups)
+        )
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
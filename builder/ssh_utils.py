@@ -1,40 +1,68 @@
 import base64
+import hashlib
 import os
+import stat
+import tempfile
 
-import certifi
 
-CUSTOM_CERTIFICATE_PATH = "/tmp/custom_ca.pem"
+def certificate_dir() -> str:
+    """
+    Directory of the merged bundles. It's private to the current user, so other local users can't plant a bundle
+    with their own certificate in it
+    """
+    path = os.path.join(tempfile.gettempdir(), f"rbac-builder-certs-{os.getuid()}")
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    path_stat = os.lstat(path)
+    if not stat.S_ISDIR(path_stat.st_mode) or path_stat.st_uid != os.getuid() or path_stat.st_mode & 0o077:
+        raise Exception(f"Certificates directory {path} must be a directory owned and accessible only by the "
+                        f"current user")
+    return path
 
 
-def append_custom_certificate(custom_ca: str) -> None:
-    with open(certifi.where(), "ab") as outfile:
-        outfile.write(base64.b64decode(custom_ca))
-
-    os.environ["WEBSOCKET_CLIENT_CA_BUNDLE"] = certifi.where()
+def merged_certificate(base_bundle: str, custom_ca: bytes) -> bytes:
+    with open(base_bundle, "rb") as base_cert:
+        base_cert_content = base_cert.read()
+    separator = b"" if base_cert_content.endswith(b"\n") else b"\n"
+    return base_cert_content + separator + custom_ca
 
 
-def create_temporary_certificate(custom_ca: str) -> None:
-    with open(certifi.where(), "rb") as base_cert:
-        base_cert_content = base_cert.read()
+def is_written(path: str, content: bytes) -> bool:
+    """
+    True if the bundle at path was written by the current user with this content, so it can be reused
+    """
+    try:
+        path_stat = os.lstat(path)
+        if not stat.S_ISREG(path_stat.st_mode) or path_stat.st_uid != os.getuid():
+            return False
+        with open(path, "rb") as bundle:
+            return bundle.read() == content
+    except FileNotFoundError:
+        return False
 
-    with open(CUSTOM_CERTIFICATE_PATH, "wb") as outfile:
-        outfile.write(base_cert_content)
-        outfile.write(base64.b64decode(custom_ca))
 
-    os.environ["REQUESTS_CA_BUNDLE"] = CUSTOM_CERTIFICATE_PATH
-    os.environ["WEBSOCKET_CLIENT_CA_BUNDLE"] = CUSTOM_CERTIFICATE_PATH
-    certifi.where = lambda: CUSTOM_CERTIFICATE_PATH
+def write_merged_certificate(path: str, content: bytes) -> None:
+    # written to a temporary file first, so a concurrent run never reads a partial bundle
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, "wb") as outfile:
+        outfile.write(content)
+    os.replace(temp_path, path)
 
 
 def add_custom_certificate(custom_ca: str) -> bool:
     if not custom_ca:
         return False
 
-    # NOTE: Sometimes (Openshift) the certifi.where() is not writable, so we need to
-    #       use a temporary file in case of PermissionError.
-    try:
-        append_custom_certificate(custom_ca)
-    except PermissionError:
-        create_temporary_certificate(custom_ca)
+    # certifi is imported only when there's a certificate to add
+    import certifi
+
+    content = merged_certificate(certifi.where(), base64.b64decode(custom_ca))
+    # keyed by the merged content, so the bundle is written once, and reused by the next runs
+    path = os.path.join(certificate_dir(), f"custom_ca_{hashlib.sha256(content).hexdigest()[:16]}.pem")
+    if not is_written(path, content):
+        write_merged_certificate(path, content)
 
+    # the certifi bundle is not changed, since it's not always writable (Openshift)
+    os.environ["REQUESTS_CA_BUNDLE"] = path
+    os.environ["WEBSOCKET_CLIENT_CA_BUNDLE"] = path
+    certifi.where = lambda: path
     return True
@@ -0,0 +1,124 @@
+import json
+import logging
+import time
+from typing import Dict, List, Callable
+
+from pydantic import BaseModel
+
+from builder.file_utils import open_text, atomic_text_file
+from builder.model import RobustaPermissionScope, RobustaPermissionGroup, User
+from builder.robusta_store import RobustaStore
+
+SNAPSHOT_VERSION = 1
+
+
+class AccountState(BaseModel):
+    """
+    The stored rbac state of a single account, as read from the platform at created_at
+    """
+    account_id: str
+    created_at: float
+    scopes: List[RobustaPermissionScope] = []
+    groups: List[RobustaPermissionGroup] = []
+    users: List[User] = []
+    # account groups of every user. Groups of other accounts are not included
+    users_groups: Dict[str, List[str]] = {}
+
+    def scopes_by_name(self) -> Dict[str, RobustaPermissionScope]:
+        return {scope.name: scope for scope in self.scopes}
+
+    def groups_by_name(self) -> Dict[str, RobustaPermissionGroup]:
+        return {group.name: group for group in self.groups}
+
+    def age(self) -> float:
+        return time.time() - self.created_at
+
+
+def fetch_account_state(robusta_store: RobustaStore, account_id: str, include_users: bool = True) -> AccountState:
+    logging.info(f"Reading the stored rbac state of account {account_id}")
+    created_at = time.time()
+    scopes = robusta_store.get_permission_scopes(account_id=account_id)
+    groups = robusta_store.get_permission_groups(account_id=account_id)
+    account_group_ids = sorted(group.group_id for group in groups.values())
+    return AccountState(
+        account_id=account_id,
+        created_at=created_at,
+        scopes=list(scopes.values()),
+        groups=list(groups.values()),
+        users=robusta_store.get_robusta_users() if include_users else [],
+        users_groups=dict(robusta_store.get_users_groups(group_ids=account_group_ids)) if account_group_ids else {},
+    )
+
+
+def read_snapshot(file_name: str) -> Dict[str, AccountState]:
+    """
+    Read the accounts states from a snapshot file. A missing or unreadable snapshot is treated as empty
+    """
+    try:
+        with open_text(file_name, "r") as snapshot_file:
+            content = json.load(snapshot_file)
+    except FileNotFoundError:
+        return {}
+    except Exception:
+        logging.warning(f"Failed to read state snapshot {file_name}, ignoring it", exc_info=True)
+        return {}
+
+    if content.get("version") != SNAPSHOT_VERSION:
+        logging.warning(f"Unsupported state snapshot version {content.get('version')} in {file_name}, ignoring it")
+        return {}
+    return {account_id: AccountState(**state) for account_id, state in content.get("accounts", {}).items()}
+
+
+def write_snapshot(states: Dict[str, AccountState], file_name: str):
+    content = {
+        "version": SNAPSHOT_VERSION,
+        "accounts": {account_id: state.model_dump() for account_id, state in states.items()},
+    }
+    with atomic_text_file(file_name, private=True) as snapshot_file:
+        json.dump(content, snapshot_file)
+
+
+def invalidate_snapshot(file_name: str, account_ids: List[str]):
+    """
+    Drop the accounts states from the snapshot, after changing them on the platform
+    """
+    states = read_snapshot(file_name)
+    if any(account_id in states for account_id in account_ids):
+        write_snapshot(
+            {account_id: state for account_id, state in states.items() if account_id not in account_ids}, file_name
+        )
+
+
+def load_account_states(
+        account_ids: List[str],
+        store_factory: Callable[[], RobustaStore],
+        snapshot_file: str,
+        max_age: float,
+        refresh: bool = False,
+) -> Dict[str, AccountState]:
+    """
+    The stored state of every account. States in the snapshot file younger than max_age seconds are reused,
+    the others are read from the platform, and saved to the snapshot file
+    """
+    states = {} if refresh or not snapshot_file else read_snapshot(snapshot_file)
+    stale = [
+        account_id for account_id in account_ids
+        if account_id not in states or states[account_id].age() > max_age
+    ]
+    for account_id in account_ids:
+        if account_id not in stale:
+            logging.info(f"Reusing the state of account {account_id} from {snapshot_file} "
+                         f"({states[account_id].age():.0f}s old)")
+
+    if stale:
+        robusta_store = store_factory()
+        try:
+            for account_id in stale:
+                states[account_id] = fetch_account_state(robusta_store, account_id)
+        finally:
+            robusta_store.close()
+        if snapshot_file:
+            write_snapshot(states, snapshot_file)
+            logging.info(f"Saved the state of {len(stale)} accounts to {snapshot_file}")
+
+    return {account_id: states[account_id] for account_id in account_ids}
@@ -0,0 +1,126 @@
+from abc import ABC, abstractmethod
+from typing import Dict, List, Optional, Iterable
+
+from builder.model import User, RobustaPermissionScope, RobustaPermissionGroup, UserGroup
+
+ACCOUNTS_TABLE = "Accounts"
+PERMISSION_SCOPES_TABLE = "PermissionScopes"
+PERMISSION_GROUPS_TABLE = "PermissionGroups"
+USER_GROUPS_TABLE = "UserGroups"
+
+# defined in sql/rbac_builder_apply_account.sql
+APPLY_ACCOUNT_RBAC_RPC = "rbac_builder_apply_account"
+# defined in sql/rbac_builder_set_users_groups.sql
+SET_USERS_GROUPS_RPC = "rbac_builder_set_users_groups"
+
+
+def apply_account_rbac_params(
+        account_id: str,
+        scopes: List[RobustaPermissionScope],
+        groups: List[RobustaPermissionGroup]
+) -> Dict:
+    return {
+        "_account_id": account_id,
+        "_scopes": [scope.dict() for scope in scopes],
+        "_groups": [group.dict() for group in groups],
+    }
+
+
+def set_users_groups_params(account_id: str, users_groups: Dict[str, List[str]]) -> Dict:
+    return {
+        "_account_id": account_id,
+        "_users_groups": [
+            {"user_id": user_id, "group_ids": group_ids} for user_id, group_ids in users_groups.items()
+        ],
+    }
+
+
+class StorageBackend(ABC):
+    """
+    Storage of the rbac tables, as used by RobustaStore.
+
+    Every backend enforces the platform DB constraints: groups can reference only existing scopes, referenced scopes
+    can't be deleted, and deleting a group deletes its users groups.
+    apply_account_rbac and set_users_groups have the semantics of the SQL functions under sql/
+    """
+
+    @abstractmethod
+    def get_account_id(self, account_name: str) -> Optional[str]:
+        pass
+
+    @abstractmethod
+    def get_robusta_users(self) -> List[User]:
+        pass
+
+    @abstractmethod
+    def get_permission_scopes(self, account_id: str) -> Iterable[RobustaPermissionScope]:
+        pass
+
+    @abstractmethod
+    def get_permission_groups(self, account_id: str) -> Iterable[RobustaPermissionGroup]:
+        pass
+
+    @abstractmethod
+    def get_users_groups(self, group_ids: Optional[List[str]] = None) -> Iterable[UserGroup]:
+        pass
+
+    @abstractmethod
+    def upsert_scope(self, scope: RobustaPermissionScope):
+        pass
+
+    @abstractmethod
+    def upsert_scopes(self, scopes: List[RobustaPermissionScope]):
+        pass
+
+    @abstractmethod
+    def delete_scope(self, scope: RobustaPermissionScope):
+        pass
+
+    @abstractmethod
+    def delete_scopes(self, account_id: str, scope_ids: List[str]):
+        pass
+
+    @abstractmethod
+    def upsert_group(self, group: RobustaPermissionGroup):
+        pass
+
+    @abstractmethod
+    def upsert_groups(self, groups: List[RobustaPermissionGroup]):
+        pass
+
+    @abstractmethod
+    def delete_group(self, group: RobustaPermissionGroup):
+        pass
+
+    @abstractmethod
+    def delete_groups(self, account_id: str, group_ids: List[str]):
+        pass
+
+    @abstractmethod
+    def delete_account_groups(self, account_id: str):
+        pass
+
+    @abstractmethod
+    def delete_account_scopes(self, account_id: str):
+        pass
+
+    @abstractmethod
+    def set_user_groups(self, user_id: str, group_ids: List[str]):
+        pass
+
+    @abstractmethod
+    def set_users_groups(self, account_id: str, users_groups: Dict[str, List[str]]):
+        pass
+
+    @abstractmethod
+    def apply_account_rbac(
+            self,
+            account_id: str,
+            scopes: List[RobustaPermissionScope],
+            groups: List[RobustaPermissionGroup]
+    ) -> Dict:
+        pass
+
+    @abstractmethod
+    def close(self):
+        pass
@@ -1,27 +1,50 @@
+import json
 import logging
+import threading
 import time
 import traceback
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Iterator, Callable, Hashable
 
 import requests
 from postgrest.types import ReturnMethod
+from requests.adapters import HTTPAdapter
 from supabase import create_client
 from supabase.lib.client_options import ClientOptions
 
+from builder.batch_utils import chunks, run_concurrently
+from builder.metrics import METRICS
 from builder.model import User, RobustaPermissionScope, RobustaPermissionGroup, UserGroup
-
-ACCOUNTS_TABLE = "Accounts"
-PERMISSION_SCOPES_TABLE = "PermissionScopes"
-PERMISSION_GROUPS_TABLE = "PermissionGroups"
-USER_GROUPS_TABLE = "UserGroups"
-
-class StorageDal:
+from builder.request_scheduler import RequestScheduler, AdaptiveRateLimiter
+from builder.storage_backend import StorageBackend, ACCOUNTS_TABLE, PERMISSION_SCOPES_TABLE, PERMISSION_GROUPS_TABLE, \
+    USER_GROUPS_TABLE, APPLY_ACCOUNT_RBAC_RPC, SET_USERS_GROUPS_RPC, apply_account_rbac_params, set_users_groups_params
+
+# read only the columns the builder uses
+PERMISSION_SCOPES_COLUMNS = "account_id,scope_type,scope_id,name,scope_data"
+PERMISSION_GROUPS_COLUMNS = "account_id,group_id,provider_group_id,name,scope_type,scopes,permissions"
+USER_GROUPS_COLUMNS = "user_id,group_id"
+# max ids in a single 'in' filter, to keep the request url short
+MAX_FILTER_IDS = 100
+# seconds between sign ins. After the platform rejected the token, between forced sign ins
+SIGN_IN_INTERVAL = 900
+FORCED_SIGN_IN_INTERVAL = 10
+
+
+class StorageDal(StorageBackend):
     def __init__(
         self,
         url: str,
         key: str,
         email: str,
         password: str,
+        batch_size: int = 500,
+        max_concurrency: int = 1,
+        page_size: int = 1000,
+        http_pool_size: int = 10,
+        http_timeout: float = 60,
+        http_retries: int = 3,
+        http_backoff: float = 0.5,
+        rate_limit: float = 0,
+        min_rate_limit: float = 1,
     ):
         httpx_logger = logging.getLogger("httpx")
         if httpx_logger:
@@ -33,10 +56,36 @@ class StorageDal:
         self.client = create_client(url, key, options)
         self.email = email
         self.password = password
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+        self.page_size = page_size
+        self.http_timeout = http_timeout
+        self.rpc_session = self.__create_rpc_session(http_pool_size)
+        # every request goes through the scheduler: rate limited (if rate_limit is set), and retried on transient
+        # failures, with http_backoff as the base delay
+        self.scheduler = RequestScheduler(
+            rate_limiter=AdaptiveRateLimiter(rate_limit, min_rate_limit) if rate_limit > 0 else None,
+            max_retries=http_retries,
+            backoff=http_backoff,
+            on_auth_error=self.handle_supabase_error,
+        )
+        self.sign_in_lock = threading.Lock()
         self.sign_in_time = 0
         self.sign_in()
         self.client.auth.on_auth_state_change(self.__update_token_patch)
 
+    @staticmethod
+    def __create_rpc_session(pool_size: int) -> requests.Session:
+        """
+        Keep-alive connection pool, shared by all the rpc calls.
+        Failed calls are retried by the request scheduler, not by urllib3, so they're never retried twice
+        """
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        session = requests.Session()
+        session.mount("https://", adapter)
+        session.mount("http://", adapter)
+        return session
+
     def __update_token_patch(self, event, session):
         logging.debug(f"Event {event}, Session {session}")
         if session and event == "TOKEN_REFRESHED":
@@ -45,12 +94,12 @@ class StorageDal:
 
     def get_account_id(self, account_name: str) -> Optional[str]:
         try:
-            res = (
-                self.client.table(ACCOUNTS_TABLE)
-                    .select("*")
-                    .eq("name", account_name)
-                    .execute()
-            )
+            with METRICS.request("get_account_id", ACCOUNTS_TABLE):
+                res = self.scheduler.call(
+                    "get_account_id",
+                    lambda: self.client.table(ACCOUNTS_TABLE).select("*").eq("name", account_name).execute(),
+                    coalesce_key=("get_account_id", account_name),
+                )
             if len(res.data) == 0:
                 logging.error(f"Account {account_name} not found. res: {res.data}")
                 return None
@@ -63,55 +112,108 @@ class StorageDal:
 
     def delete_account_groups(self, account_id: str):
         try:
-            self.client.table(PERMISSION_GROUPS_TABLE).delete(returning=ReturnMethod.minimal)\
-                .eq("account_id", account_id).execute()
+            with METRICS.request("delete_account_groups", PERMISSION_GROUPS_TABLE):
+                self.scheduler.call(
+                    "delete_account_groups",
+                    lambda: self.client.table(PERMISSION_GROUPS_TABLE).delete(returning=ReturnMethod.minimal)
+                    .eq("account_id", account_id).execute()
+                )
         except Exception as e:
             logging.exception(f"Failed to delete account groups for {account_id}")
             raise e
 
     def delete_account_scopes(self, account_id: str):
         try:
-            self.client.table(PERMISSION_SCOPES_TABLE).delete(returning=ReturnMethod.minimal)\
-                .eq("account_id", account_id).execute()
+            with METRICS.request("delete_account_scopes", PERMISSION_SCOPES_TABLE):
+                self.scheduler.call(
+                    "delete_account_scopes",
+                    lambda: self.client.table(PERMISSION_SCOPES_TABLE).delete(returning=ReturnMethod.minimal)
+                    .eq("account_id", account_id).execute()
+                )
         except Exception as e:
             logging.exception(f"Failed to delete account groups for {account_id}")
             raise e
 
     def set_user_groups(self, user_id: str, group_ids: List[str]):
         try:
-            res = self.sync_rpc(func_name="set_user_external_rbac_groups",
+            self.sync_rpc(func_name="set_user_external_rbac_groups",
                           params={
                               "_user_id": user_id,
                               "_group_ids": group_ids
                           })
-            status_code = res.get("status_code")
-            if status_code >= 300:
-                self.handle_supabase_error()
-                raise Exception(f"Failed to add user groups. user: {user_id} groups: {group_ids} code: {status_code}")
-
         except Exception as e:
             logging.exception(f"Error adding user groups for user:{user_id} groups:{group_ids}")
             raise e
 
-    def get_users_groups(self) -> List[UserGroup]:
+    def set_users_groups(self, account_id: str, users_groups: Dict[str, List[str]]):
+        """
+        Replace the account groups of many users, with one rpc call per batch of users
+        """
+        run_concurrently(
+            lambda batch: self.__set_users_groups_batch(account_id, dict(batch)),
+            chunks(users_groups.items(), self.batch_size),
+            self.max_concurrency
+        )
+
+    def __set_users_groups_batch(self, account_id: str, users_groups: Dict[str, List[str]]):
         try:
-            res = self.client.table(USER_GROUPS_TABLE).select("*").execute()
-            user_groups = [UserGroup(**entry) for entry in res.data]
+            self.sync_rpc(func_name=SET_USERS_GROUPS_RPC, params=set_users_groups_params(account_id, users_groups))
         except Exception as e:
-            logging.exception(f"Failed to list users robusta groups")
+            logging.exception(f"Error setting groups of {len(users_groups)} users for account {account_id}")
             raise e
 
-        return user_groups
+    def __read_pages(self, method: str, table: str, query: Callable, query_key: Hashable) -> Iterator[dict]:
+        """
+        Read the query results page by page. query creates a new ordered select request.
+        query_key identifies the query, so concurrent reads of the same page are sent once.
+        The platform may return fewer rows than requested (its max rows setting), so a short page isn't the last one.
+        Pages are read until an empty one
+        """
+        offset = 0
+        while True:
+            with METRICS.request(method, table) as request:
+                res = self.scheduler.call(
+                    method,
+                    lambda: query().range(offset, offset + self.page_size - 1).execute(),
+                    coalesce_key=(method, table, query_key, offset, self.page_size),
+                )
+                request.rows = len(res.data)
+            if not res.data:
+                return
+            yield from res.data
+            offset += len(res.data)
+
+    def get_users_groups(self, group_ids: Optional[List[str]] = None) -> Iterator[UserGroup]:
+        """
+        Stream the users groups. If group_ids is set, read only the users groups of these groups
+        """
+        try:
+            if group_ids is None:
+                for entry in self.__read_pages(
+                        "get_users_groups", USER_GROUPS_TABLE,
+                        lambda: self.client.table(USER_GROUPS_TABLE).select(USER_GROUPS_COLUMNS)
+                        .order("user_id").order("group_id"),
+                        None,
+                ):
+                    yield UserGroup(**entry)
+                return
+
+            for ids in chunks(group_ids, MAX_FILTER_IDS):
+                for entry in self.__read_pages(
+                        "get_users_groups", USER_GROUPS_TABLE,
+                        lambda: self.client.table(USER_GROUPS_TABLE).select(USER_GROUPS_COLUMNS)
+                        .in_("group_id", ids).order("user_id").order("group_id"),
+                        tuple(ids),
+                ):
+                    yield UserGroup(**entry)
+        except Exception as e:
+            logging.exception(f"Failed to list users robusta groups")
+            raise e
 
     def get_robusta_users(self) -> List[User]:
         robusta_users = []
         try:
-            res = self.sync_rpc(func_name="relay_get_all_users")
-            status_code = res.get("status_code")
-            if status_code >= 300:
-                self.handle_supabase_error()
-                raise Exception(f"Failed to get robusta groups. code: {status_code}")
-
+            res = self.sync_rpc(func_name="relay_get_all_users", coalesce=True)
             response_data = res.get("data")
             if not response_data:
                 logging.warning(f"No robusta users found. response data: {response_data}")
@@ -126,88 +228,232 @@ class StorageDal:
 
         return robusta_users
 
-    def get_permission_scopes(self, account_id: str) -> List[RobustaPermissionScope]:
+    def get_permission_scopes(self, account_id: str) -> Iterator[RobustaPermissionScope]:
         try:
-            res = self.client.table(PERMISSION_SCOPES_TABLE).select("*").eq("account_id", account_id).execute()
-            robusta_scopes = [RobustaPermissionScope(**entry) for entry in res.data]
+            for entry in self.__read_pages(
+                    "get_permission_scopes", PERMISSION_SCOPES_TABLE,
+                    lambda: self.client.table(PERMISSION_SCOPES_TABLE).select(PERMISSION_SCOPES_COLUMNS)
+                    .eq("account_id", account_id).order("scope_id"),
+                    account_id,
+            ):
+                yield RobustaPermissionScope(**entry)
         except Exception as e:
             logging.exception(f"Failed to list robusta scopes for {account_id}")
             raise e
 
-        return robusta_scopes
-
-    def get_permission_groups(self, account_id: str) -> List[RobustaPermissionGroup]:
+    def get_permission_groups(self, account_id: str) -> Iterator[RobustaPermissionGroup]:
         try:
-            res = self.client.table(PERMISSION_GROUPS_TABLE).select("*").eq("account_id", account_id).execute()
-            robusta_groups = [RobustaPermissionGroup(**entry) for entry in res.data]
+            for entry in self.__read_pages(
+                    "get_permission_groups", PERMISSION_GROUPS_TABLE,
+                    lambda: self.client.table(PERMISSION_GROUPS_TABLE).select(PERMISSION_GROUPS_COLUMNS)
+                    .eq("account_id", account_id).order("group_id"),
+                    account_id,
+            ):
+                yield RobustaPermissionGroup(**entry)
         except Exception as e:
             logging.exception(f"Failed to list robusta groups for {account_id}")
             raise e
 
-        return robusta_groups
-
     def upsert_scope(self, scope: RobustaPermissionScope):
         try:
-            self.client.table(PERMISSION_SCOPES_TABLE).upsert(scope.dict()).execute()
+            row = scope.dict()
+            with METRICS.request("upsert_scope", PERMISSION_SCOPES_TABLE, row) as request:
+                request.rows = 1
+                self.scheduler.call(
+                    "upsert_scope",
+                    lambda: self.client.table(PERMISSION_SCOPES_TABLE).upsert(row).execute()
+                )
         except Exception as e:
             logging.exception(f"Failed to upsert scope {scope}")
             raise e
 
     def delete_scope(self, scope: RobustaPermissionScope):
         try:
-            self.client.table(PERMISSION_SCOPES_TABLE).delete(returning=ReturnMethod.minimal)\
-                .eq("account_id",scope.account_id).eq("scope_id", scope.scope_id).execute()
+            with METRICS.request("delete_scope", PERMISSION_SCOPES_TABLE) as request:
+                request.rows = 1
+                self.scheduler.call(
+                    "delete_scope",
+                    lambda: self.client.table(PERMISSION_SCOPES_TABLE).delete(returning=ReturnMethod.minimal)
+                    .eq("account_id", scope.account_id).eq("scope_id", scope.scope_id).execute()
+                )
         except Exception as e:
             logging.exception(f"Failed to delete scope {scope}")
             raise e
 
     def upsert_group(self, group: RobustaPermissionGroup):
         try:
-            self.client.table(PERMISSION_GROUPS_TABLE).upsert(group.dict()).execute()
+            row = group.dict()
+            with METRICS.request("upsert_group", PERMISSION_GROUPS_TABLE, row) as request:
+                request.rows = 1
+                self.scheduler.call(
+                    "upsert_group",
+                    lambda: self.client.table(PERMISSION_GROUPS_TABLE).upsert(row).execute()
+                )
         except Exception as e:
             logging.exception(f"Failed to upsert group {group}")
             raise e
 
     def delete_group(self, group: RobustaPermissionGroup):
         try:
-            self.client.table(PERMISSION_GROUPS_TABLE).delete(returning=ReturnMethod.minimal)\
-                .eq("account_id", group.account_id).eq("group_id", group.group_id).execute()
+            with METRICS.request("delete_group", PERMISSION_GROUPS_TABLE) as request:
+                request.rows = 1
+                self.scheduler.call(
+                    "delete_group",
+                    lambda: self.client.table(PERMISSION_GROUPS_TABLE).delete(returning=ReturnMethod.minimal)
+                    .eq("account_id", group.account_id).eq("group_id", group.group_id).execute()
+                )
         except Exception as e:
             logging.exception(f"Failed to delete scope {group}")
             raise e
 
+    def upsert_scopes(self, scopes: List[RobustaPermissionScope]):
+        run_concurrently(self.__upsert_scopes_batch, chunks(scopes, self.batch_size), self.max_concurrency)
+
+    def __upsert_scopes_batch(self, scopes: List[RobustaPermissionScope]):
+        try:
+            rows = [scope.dict() for scope in scopes]
+            with METRICS.request("upsert_scopes", PERMISSION_SCOPES_TABLE, rows):
+                self.scheduler.call(
+                    "upsert_scopes",
+                    lambda: self.client.table(PERMISSION_SCOPES_TABLE).upsert(rows, returning=ReturnMethod.minimal)
+                    .execute()
+                )
+        except Exception as e:
+            logging.exception(f"Failed to upsert {len(scopes)} scopes")
+            raise e
+
+    def delete_scopes(self, account_id: str, scope_ids: List[str]):
+        run_concurrently(
+            lambda batch: self.__delete_scopes_batch(account_id, batch),
+            chunks(scope_ids, self.batch_size),
+            self.max_concurrency
+        )
+
+    def __delete_scopes_batch(self, account_id: str, scope_ids: List[str]):
+        try:
+            with METRICS.request("delete_scopes", PERMISSION_SCOPES_TABLE) as request:
+                request.rows = len(scope_ids)
+                self.scheduler.call(
+                    "delete_scopes",
+                    lambda: self.client.table(PERMISSION_SCOPES_TABLE).delete(returning=ReturnMethod.minimal)
+                    .eq("account_id", account_id).in_("scope_id", scope_ids).execute()
+                )
+        except Exception as e:
+            logging.exception(f"Failed to delete scopes {scope_ids} for {account_id}")
+            raise e
+
+    def upsert_groups(self, groups: List[RobustaPermissionGroup]):
+        run_concurrently(self.__upsert_groups_batch, chunks(groups, self.batch_size), self.max_concurrency)
+
+    def __upsert_groups_batch(self, groups: List[RobustaPermissionGroup]):
+        try:
+            rows = [group.dict() for group in groups]
+            with METRICS.request("upsert_groups", PERMISSION_GROUPS_TABLE, rows):
+                self.scheduler.call(
+                    "upsert_groups",
+                    lambda: self.client.table(PERMISSION_GROUPS_TABLE).upsert(rows, returning=ReturnMethod.minimal)
+                    .execute()
+                )
+        except Exception as e:
+            logging.exception(f"Failed to upsert {len(groups)} groups")
+            raise e
+
+    def delete_groups(self, account_id: str, group_ids: List[str]):
+        run_concurrently(
+            lambda batch: self.__delete_groups_batch(account_id, batch),
+            chunks(group_ids, self.batch_size),
+            self.max_concurrency
+        )
+
+    def __delete_groups_batch(self, account_id: str, group_ids: List[str]):
+        try:
+            with METRICS.request("delete_groups", PERMISSION_GROUPS_TABLE) as request:
+                request.rows = len(group_ids)
+                self.scheduler.call(
+                    "delete_groups",
+                    lambda: self.client.table(PERMISSION_GROUPS_TABLE).delete(returning=ReturnMethod.minimal)
+                    .eq("account_id", account_id).in_("group_id", group_ids).execute()
+                )
+        except Exception as e:
+            logging.exception(f"Failed to delete groups {group_ids} for {account_id}")
+            raise e
+
+    def apply_account_rbac(
+            self,
+            account_id: str,
+            scopes: List[RobustaPermissionScope],
+            groups: List[RobustaPermissionGroup]
+    ) -> Dict:
+        try:
+            # a sent call may have committed, so it's retried only if it never reached the platform
+            res = self.sync_rpc(func_name=APPLY_ACCOUNT_RBAC_RPC,
+                                params=apply_account_rbac_params(account_id, scopes, groups), idempotent=False)
+            return res.get("data")
+        except Exception as e:
+            logging.exception(f"Error applying rbac for account {account_id}")
+            raise e
+
     def close(self):
+        self.rpc_session.close()
         self.client.auth.sign_out()
 
-    def sign_in(self):
-        if time.time() > self.sign_in_time + 900:
+    def sign_in(self, force: bool = False):
+        """
+        Sign in, unless signed in the last SIGN_IN_INTERVAL seconds. With force, unless signed in the last
+        FORCED_SIGN_IN_INTERVAL seconds, so concurrent requests rejected together sign in once
+        """
+        with self.sign_in_lock:
+            if time.time() <= self.sign_in_time + (FORCED_SIGN_IN_INTERVAL if force else SIGN_IN_INTERVAL):
+                return
             logging.info("Supabase dal login")
             self.sign_in_time = time.time()
-            res = self.client.auth.sign_in_with_password({"email": self.email, "password": self.password})
+            with METRICS.phase("sign_in"), METRICS.request("sign_in", "auth"):
+                res = self.client.auth.sign_in_with_password({"email": self.email, "password": self.password})
             self.client.auth.set_session(res.session.access_token, res.session.refresh_token)
             self.client.postgrest.auth(res.session.access_token)
 
     def handle_supabase_error(self):
         """Workaround for Gotrue bug in refresh token."""
         # If there's an error during refresh token, no new refresh timer task is created, and the client remains not authenticated for good
-        # When there's an error connecting to supabase server, we will re-login, to re-authenticate the session.
-        # Adding rate-limiting mechanism, not to login too much because of other errors
+        # The request scheduler calls it when the platform rejects the token, so we re-login before retrying the
+        # request. Adding rate-limiting mechanism, not to login too much when many requests fail together
         # https://github.com/supabase/gotrue-py/issues/9
         try:
-            self.sign_in()
+            self.sign_in(force=True)
         except Exception:
             logging.error("Failed to signin on error", traceback.print_exc())
 
-    def sync_rpc(self, func_name: str, params: Optional[dict] = None) -> Dict:
+    def sync_rpc(
+            self,
+            func_name: str,
+            params: Optional[dict] = None,
+            coalesce: bool = False,
+            idempotent: bool = True,
+    ) -> Dict:
         """
-        Supabase client is async. Sync impl of rpc call
+        Supabase client is async. Sync impl of rpc call.
+        Set coalesce for read only functions, so concurrent identical calls are sent once.
+        Unset idempotent for functions that must not be sent again once they may have reached the platform
         """
         client = self.client
-        headers = client.table("").session.headers
         url: str = f"{client.rest_url}/rpc/{func_name}"
 
-        response = requests.post(url, headers=headers, json=params)
-        response.raise_for_status()
+        def post() -> requests.Response:
+            # read the headers on every attempt, since the auth token is refreshed periodically
+            headers = client.postgrest.session.headers
+            post_response = self.rpc_session.post(url, headers=headers, json=params, timeout=self.http_timeout)
+            post_response.raise_for_status()
+            return post_response
+
+        with METRICS.request("rpc", func_name) as request:
+            response = self.scheduler.call(
+                f"rpc {func_name}",
+                post,
+                idempotent=idempotent,
+                coalesce_key=("rpc", func_name, json.dumps(params, sort_keys=True)) if coalesce else None,
+            )
+            # the actual body size, as sent by requests
+            request.bytes_sent = len(response.request.body or b"")
         response_data = {}
         try:
             if response.content:
@@ -0,0 +1,149 @@
+import logging
+from typing import Dict, List, Optional, Set
+
+from pydantic import BaseModel
+
+from builder.metrics import METRICS
+from builder.model import User, RobustaPermissionScope, RobustaPermissionGroup
+from builder.robusta_store import RobustaStore
+
+
+class UsersGroupsPlan(BaseModel):
+    account_id: str
+    # only the users whose account groups should change, with their complete set of account groups
+    users_groups: Dict[str, List[str]] = {}
+
+    def is_empty(self) -> bool:
+        return not self.users_groups
+
+    def summary(self) -> str:
+        return f"users: ~{len(self.users_groups)}"
+
+
+def user_matches(user: User, user_names: List[str], email_domain: str = "") -> bool:
+    """
+    Users are listed either by email, or by the email user name (the part before the '@'). User names match only
+    emails of email_domain
+    """
+    if not user.email:
+        return False
+    email = user.email.lower()
+    emails = {name.lower() for name in user_names if "@" in name}
+    if email_domain:
+        emails.update(f"{name.lower()}@{email_domain.lower()}" for name in user_names if "@" not in name)
+    return email in emails
+
+
+def desired_users_groups(
+        users: List[User],
+        scopes: Dict[str, RobustaPermissionScope],
+        groups: Dict[str, RobustaPermissionGroup],
+        allowed_users: List[str],
+        cluster_admin_groups: Dict[str, List[str]],
+        account_sso_group: str,
+        email_domain: str = "",
+) -> Dict[str, Set[str]]:
+    """
+    Compute the account groups each managed user should have:
+    - Only the allowed_users are managed. Platform users are not filtered by account, so no user is managed without it
+    - Every managed user is a member of the account_sso_group group, if set
+    - Users listed for a cluster in cluster_admin_groups are members of all the 'cluster' groups covering that cluster
+    """
+    managed_users = [user for user in users if user_matches(user, allowed_users, email_domain)]
+
+    sso_group = groups.get(account_sso_group) if account_sso_group else None
+    if account_sso_group and not sso_group:
+        logging.warning(f"Account sso group {account_sso_group} not found in the account groups")
+
+    scopes_by_id = {scope.scope_id: scope for scope in scopes.values()}
+    cluster_groups: Dict[str, Set[str]] = {}
+    for cluster_name in cluster_admin_groups.keys():
+        cluster_groups[cluster_name] = {
+            group.group_id for group in groups.values()
+            if group.scope_type == "cluster" and any(
+                cluster_name in scopes_by_id[scope_id].scope_data
+                for scope_id in group.scopes if scope_id in scopes_by_id
+            )
+        }
+        if not cluster_groups[cluster_name]:
+            logging.warning(f"No cluster groups found for cluster {cluster_name}")
+
+    users_groups: Dict[str, Set[str]] = {}
+    for user in managed_users:
+        user_groups: Set[str] = set()
+        if sso_group:
+            user_groups.add(sso_group.group_id)
+        for cluster_name, cluster_users in cluster_admin_groups.items():
+            if user_matches(user, cluster_users, email_domain):
+                user_groups.update(cluster_groups[cluster_name])
+        users_groups[user.id] = user_groups
+
+    return users_groups
+
+
+def compute_users_groups_plan(
+        account_id: str,
+        desired: Dict[str, Set[str]],
+        current: Dict[str, List[str]],
+        account_group_ids: Set[str],
+) -> UsersGroupsPlan:
+    """
+    Keep only the users whose account groups differ from the stored ones
+    """
+    plan = UsersGroupsPlan(account_id=account_id)
+    for user_id, user_groups in desired.items():
+        current_groups = {group_id for group_id in current.get(user_id, []) if group_id in account_group_ids}
+        if current_groups != user_groups:
+            plan.users_groups[user_id] = sorted(user_groups)
+    return plan
+
+
+class UsersGroupsSync:
+
+    def __init__(
+            self,
+            robusta_store: RobustaStore,
+            allowed_users: Optional[List[str]] = None,
+            cluster_admin_groups: Optional[Dict[str, List[str]]] = None,
+            account_sso_group: str = "",
+            email_domain: str = "",
+    ):
+        self.robusta_store = robusta_store
+        self.allowed_users = allowed_users or []
+        self.cluster_admin_groups = cluster_admin_groups or {}
+        self.account_sso_group = account_sso_group
+        self.email_domain = email_domain
+
+    def plan(self, account_id: str) -> UsersGroupsPlan:
+        with METRICS.phase("users_read_state"):
+            scopes = self.robusta_store.get_permission_scopes(account_id=account_id)
+            groups = self.robusta_store.get_permission_groups(account_id=account_id)
+            users = self.robusta_store.get_robusta_users()
+        desired = desired_users_groups(
+            users=users,
+            scopes=scopes,
+            groups=groups,
+            allowed_users=self.allowed_users,
+            cluster_admin_groups=self.cluster_admin_groups,
+            account_sso_group=self.account_sso_group,
+            email_domain=self.email_domain,
+        )
+        account_group_ids = {group.group_id for group in groups.values()}
+        with METRICS.phase("users_read_state"):
+            current = self.robusta_store.get_users_groups(group_ids=sorted(account_group_ids))
+        return compute_users_groups_plan(account_id, desired, current, account_group_ids)
+
+    def apply(self, plan: UsersGroupsPlan):
+        if plan.is_empty():
+            logging.info(f"Account {plan.account_id} users groups are up to date, nothing to apply")
+            return
+
+        logging.info(f"Applying users groups changes for account {plan.account_id}: {plan.summary()}")
+        with METRICS.phase("users_apply"):
+            self.robusta_store.set_users_groups(plan.account_id, plan.users_groups)
+        METRICS.add_rows_changed("users_groups", "updated", len(plan.users_groups))
+
+    def sync(self, account_id: str) -> UsersGroupsPlan:
+        plan = self.plan(account_id)
+        self.apply(plan)
+        return plan
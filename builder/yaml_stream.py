@@ -0,0 +1,83 @@
+from typing import Any, Dict, Iterator, IO, Tuple, Collection
+
+import yaml
+from yaml.events import AliasEvent, ScalarEvent, SequenceStartEvent, SequenceEndEvent, MappingStartEvent, \
+    MappingEndEvent, DocumentStartEvent
+from yaml.nodes import Node, ScalarNode, SequenceNode, MappingNode
+
+try:
+    # libyaml based loader, much faster than the pure python one
+    from yaml import CSafeLoader as SafeLoader
+except ImportError:
+    from yaml import SafeLoader
+
+
+def _compose_node(loader: SafeLoader, anchors: Dict[str, Node]) -> Node:
+    """
+    Build the node of the next yaml value from the parser events, the same way yaml.Composer does.
+    The libyaml loader doesn't expose composing a single node, only whole documents
+    """
+    event = loader.get_event()
+    if isinstance(event, AliasEvent):
+        if event.anchor not in anchors:
+            raise yaml.composer.ComposerError(None, None, f"found undefined alias {event.anchor}", event.start_mark)
+        return anchors[event.anchor]
+
+    if isinstance(event, ScalarEvent):
+        tag = event.tag
+        if tag is None or tag == "!":
+            tag = loader.resolve(ScalarNode, event.value, event.implicit)
+        node = ScalarNode(tag, event.value, event.start_mark, event.end_mark, style=event.style)
+    elif isinstance(event, SequenceStartEvent):
+        tag = event.tag
+        if tag is None or tag == "!":
+            tag = loader.resolve(SequenceNode, None, event.implicit)
+        node = SequenceNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+        while not loader.check_event(SequenceEndEvent):
+            node.value.append(_compose_node(loader, anchors))
+        node.end_mark = loader.get_event().end_mark
+    elif isinstance(event, MappingStartEvent):
+        tag = event.tag
+        if tag is None or tag == "!":
+            tag = loader.resolve(MappingNode, None, event.implicit)
+        node = MappingNode(tag, [], event.start_mark, None, flow_style=event.flow_style)
+        while not loader.check_event(MappingEndEvent):
+            key = _compose_node(loader, anchors)
+            node.value.append((key, _compose_node(loader, anchors)))
+        node.end_mark = loader.get_event().end_mark
+    else:
+        raise yaml.composer.ComposerError(None, None, f"unexpected event {event}", event.start_mark)
+
+    if event.anchor is not None:
+        anchors[event.anchor] = node
+    return node
+
+
+def stream_mapping(stream: IO, list_keys: Collection[str]) -> Iterator[Tuple[str, Any]]:
+    """
+    Stream the top level mapping of a yaml document, without loading the whole document.
+    Yields (key, value) pairs. For list_keys whose value is a list, yields (key, item) for every item instead,
+    so only a single item is in memory at a time
+    """
+    loader = SafeLoader(stream)
+    anchors: Dict[str, Node] = {}
+    try:
+        loader.get_event()  # stream start
+        if not loader.check_event(DocumentStartEvent):
+            return  # empty document
+        loader.get_event()
+        if not loader.check_event(MappingStartEvent):
+            raise yaml.YAMLError("Configuration must be a yaml mapping")
+        loader.get_event()
+
+        while not loader.check_event(MappingEndEvent):
+            key = loader.construct_document(_compose_node(loader, anchors))
+            if key in list_keys and loader.check_event(SequenceStartEvent) and loader.peek_event().anchor is None:
+                loader.get_event()
+                while not loader.check_event(SequenceEndEvent):
+                    yield key, loader.construct_document(_compose_node(loader, anchors))
+                loader.get_event()
+            else:
+                yield key, loader.construct_document(_compose_node(loader, anchors))
+    finally:
+        loader.dispose()
@@ -0,0 +1,94 @@
+-- Replaces all the rbac scopes and groups of an account in a single transaction.
+--
+-- _scopes and _groups are json arrays of PermissionScopes / PermissionGroups rows, as sent by the rbac-builder.
+-- Rows of the account that are not in the payload are deleted, and the payload rows are upserted by id.
+-- Unchanged rows are not rewritten.
+-- Because the function runs in one transaction, a failure leaves the account rbac untouched.
+--
+-- Called by StorageDal.apply_account_rbac (APPLY_MODE=atomic)
+
+CREATE OR REPLACE FUNCTION public.rbac_builder_apply_account(_account_id uuid, _scopes jsonb, _groups jsonb)
+RETURNS jsonb
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    _deleted_groups integer;
+    _deleted_scopes integer;
+    _upserted_scopes integer;
+    _upserted_groups integer;
+BEGIN
+    IF EXISTS (
+        SELECT 1 FROM jsonb_populate_recordset(NULL::public."PermissionScopes", _scopes) s
+        WHERE s.account_id IS DISTINCT FROM _account_id
+    ) OR EXISTS (
+        SELECT 1 FROM jsonb_populate_recordset(NULL::public."PermissionGroups", _groups) g
+        WHERE g.account_id IS DISTINCT FROM _account_id
+    ) THEN
+        RAISE EXCEPTION 'All scopes and groups must belong to account %', _account_id;
+    END IF;
+
+    -- ids are unique across accounts, so a payload id stored for another account must not overwrite its row
+    IF EXISTS (
+        SELECT 1 FROM jsonb_populate_recordset(NULL::public."PermissionScopes", _scopes) p
+        JOIN public."PermissionScopes" s ON s.scope_id = p.scope_id
+        WHERE s.account_id <> _account_id
+    ) OR EXISTS (
+        SELECT 1 FROM jsonb_populate_recordset(NULL::public."PermissionGroups", _groups) p
+        JOIN public."PermissionGroups" g ON g.group_id = p.group_id
+        WHERE g.account_id <> _account_id
+    ) THEN
+        RAISE EXCEPTION 'Scope or group ids of account % belong to another account', _account_id;
+    END IF;
+
+    -- groups reference scopes: removed groups are deleted first, then scopes are upserted before the groups that
+    -- reference them, and removed scopes are deleted last, once no kept group references them
+    DELETE FROM public."PermissionGroups" g
+    WHERE g.account_id = _account_id
+      AND g.group_id NOT IN (
+          SELECT p.group_id FROM jsonb_populate_recordset(NULL::public."PermissionGroups", _groups) p
+      );
+    GET DIAGNOSTICS _deleted_groups = ROW_COUNT;
+
+    INSERT INTO public."PermissionScopes" AS s (account_id, scope_type, scope_id, name, scope_data)
+    SELECT p.account_id, p.scope_type, p.scope_id, p.name, p.scope_data
+    FROM jsonb_populate_recordset(NULL::public."PermissionScopes", _scopes) p
+    ON CONFLICT (scope_id) DO UPDATE
+        SET scope_type = EXCLUDED.scope_type,
+            name = EXCLUDED.name,
+            scope_data = EXCLUDED.scope_data
+        WHERE s.account_id = _account_id
+          AND (s.scope_type, s.name, s.scope_data)
+              IS DISTINCT FROM (EXCLUDED.scope_type, EXCLUDED.name, EXCLUDED.scope_data);
+    GET DIAGNOSTICS _upserted_scopes = ROW_COUNT;
+
+    INSERT INTO public."PermissionGroups" AS g
+        (account_id, group_id, provider_group_id, name, scope_type, scopes, permissions)
+    SELECT p.account_id, p.group_id, p.provider_group_id, p.name, p.scope_type, p.scopes, p.permissions
+    FROM jsonb_populate_recordset(NULL::public."PermissionGroups", _groups) p
+    ON CONFLICT (group_id) DO UPDATE
+        SET provider_group_id = EXCLUDED.provider_group_id,
+            name = EXCLUDED.name,
+            scope_type = EXCLUDED.scope_type,
+            scopes = EXCLUDED.scopes,
+            permissions = EXCLUDED.permissions
+        WHERE g.account_id = _account_id
+          AND (g.provider_group_id, g.name, g.scope_type, g.scopes, g.permissions)
+              IS DISTINCT FROM (EXCLUDED.provider_group_id, EXCLUDED.name, EXCLUDED.scope_type, EXCLUDED.scopes,
+                                EXCLUDED.permissions);
+    GET DIAGNOSTICS _upserted_groups = ROW_COUNT;
+
+    DELETE FROM public."PermissionScopes" s
+    WHERE s.account_id = _account_id
+      AND s.scope_id NOT IN (
+          SELECT p.scope_id FROM jsonb_populate_recordset(NULL::public."PermissionScopes", _scopes) p
+      );
+    GET DIAGNOSTICS _deleted_scopes = ROW_COUNT;
+
+    RETURN jsonb_build_object(
+        'deleted_groups', _deleted_groups,
+        'deleted_scopes', _deleted_scopes,
+        'upserted_scopes', _upserted_scopes,
+        'upserted_groups', _upserted_groups
+    );
+END;
+$$;
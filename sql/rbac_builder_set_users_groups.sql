@@ -0,0 +1,50 @@
+-- Sets the rbac groups of many users of an account in a single call.
+--
+-- _users_groups is a json array of {"user_id": uuid, "group_ids": [uuid, ...]}.
+-- For every listed user, the user's groups that belong to _account_id are replaced by group_ids.
+-- Groups of other accounts are left untouched.
+--
+-- Called by StorageDal.set_users_groups
+
+CREATE OR REPLACE FUNCTION public.rbac_builder_set_users_groups(_account_id uuid, _users_groups jsonb)
+RETURNS jsonb
+LANGUAGE plpgsql
+AS $$
+DECLARE
+    _deleted integer;
+    _inserted integer;
+BEGIN
+    IF EXISTS (
+        SELECT 1
+        FROM jsonb_to_recordset(_users_groups) AS u(user_id uuid, group_ids uuid[]),
+             unnest(u.group_ids) AS requested(group_id)
+        WHERE NOT EXISTS (
+            SELECT 1 FROM public."PermissionGroups" g
+            WHERE g.group_id = requested.group_id AND g.account_id = _account_id
+        )
+    ) THEN
+        RAISE EXCEPTION 'All groups must belong to account %', _account_id;
+    END IF;
+
+    DELETE FROM public."UserGroups" ug
+    USING jsonb_to_recordset(_users_groups) AS u(user_id uuid, group_ids uuid[]),
+          public."PermissionGroups" g
+    WHERE ug.user_id = u.user_id
+      AND ug.group_id = g.group_id
+      AND g.account_id = _account_id
+      AND NOT (ug.group_id = ANY (u.group_ids));
+    GET DIAGNOSTICS _deleted = ROW_COUNT;
+
+    INSERT INTO public."UserGroups" (user_id, group_id)
+    SELECT u.user_id, requested.group_id
+    FROM jsonb_to_recordset(_users_groups) AS u(user_id uuid, group_ids uuid[]),
+         unnest(u.group_ids) AS requested(group_id)
+    WHERE NOT EXISTS (
+        SELECT 1 FROM public."UserGroups" ug
+        WHERE ug.user_id = u.user_id AND ug.group_id = requested.group_id
+    );
+    GET DIAGNOSTICS _inserted = ROW_COUNT;
+
+    RETURN jsonb_build_object('deleted', _deleted, 'inserted', _inserted);
+END;
+$$;
@@ -0,0 +1,63 @@
+from typing import Callable, List
+
+import pytest
+
+from builder.memory_dal import MemoryStorageDal
+from builder.model import RobustaPermissionScope, RobustaPermissionGroup
+from builder.robusta_store import RobustaStore
+from builder.sqlite_dal import SqliteStorageDal
+
+ACCOUNT_ID = "6c2cbf41-c7b5-48ab-9777-76d320b985d4"
+
+
+@pytest.fixture
+def make_scope() -> Callable[..., RobustaPermissionScope]:
+    def make(name: str, scope_id: str = "", scope_type: str = "namespace", scope_data=None, account_id=ACCOUNT_ID):
+        return RobustaPermissionScope(
+            account_id=account_id,
+            scope_type=scope_type,
+            scope_id=scope_id or f"scope-{name}",
+            name=name,
+            scope_data=scope_data or {"cl1": ["default"]},
+        )
+
+    return make
+
+
+@pytest.fixture
+def make_group() -> Callable[..., RobustaPermissionGroup]:
+    def make(name: str, scopes: List[str], group_id: str = "", scope_type: str = "namespace",
+             permissions=None, account_id=ACCOUNT_ID):
+        return RobustaPermissionGroup(
+            account_id=account_id,
+            group_id=group_id or f"group-{name}",
+            provider_group_id=f"provider-{name}",
+            name=name,
+            scope_type=scope_type,
+            scopes=scopes,
+            permissions=permissions or ["APP_VIEW"],
+        )
+
+    return make
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def dal(request):
+    dal = MemoryStorageDal(batch_size=2) if request.param == "memory" else SqliteStorageDal(":memory:", batch_size=2)
+    yield dal
+    dal.close()
+
+
+@pytest.fixture
+def store(dal) -> RobustaStore:
+    return RobustaStore(dal=dal)
+
+
+@pytest.fixture
+def write_config(tmp_path) -> Callable[[str, str], str]:
+    def write(content: str, file_name: str = "definitions.yaml") -> str:
+        path = tmp_path / file_name
+        path.write_text(content)
+        return str(path)
+
+    return write
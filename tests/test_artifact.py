@@ -0,0 +1,54 @@
+import json
+
+import pytest
+
+from builder.artifact import write_artifact, read_artifact
+from builder.config_builder import load_account_configs
+
+CONFIG = """
+account_id: a1
+users:
+  allowed_users: [alice@example.com]
+scopes:
+  - name: s1
+    type: namespace
+    clusters: {cl1: [default, kube-system]}
+groups:
+  - name: g1
+    type: namespace
+    provider_group_id: p1
+    permissions: [POD_LOGS]
+    scopes: [s1]
+"""
+
+
+@pytest.fixture
+def artifact(write_config, tmp_path) -> str:
+    configs = load_account_configs(write_config(CONFIG), max_workers=1)
+    file_name = str(tmp_path / "artifact.jsonl.gz")
+    write_artifact(configs, file_name)
+    return file_name
+
+
+def test_artifact_round_trip(artifact):
+    config_reader = read_artifact(artifact)["a1"]
+
+    assert [scope.scope_data for scope in config_reader.get_scopes()] == [{"cl1": ["default", "kube-system"]}]
+    assert [group.name for group in config_reader.get_groups()] == ["g1"]
+    assert config_reader.get_users_config()["allowed_users"] == ["alice@example.com"]
+
+
+def test_edited_artifact_is_rejected(tmp_path, write_config):
+    configs = load_account_configs(write_config(CONFIG), max_workers=1)
+    file_name = str(tmp_path / "artifact.jsonl")
+    write_artifact(configs, file_name)
+    with open(file_name) as artifact_file:
+        records = [json.loads(line) for line in artifact_file]
+    for record in records:
+        if record["kind"] == "group":
+            record["row"]["permissions"].append("POD_DELETE")
+    with open(file_name, "w") as artifact_file:
+        artifact_file.writelines(json.dumps(record) + "\n" for record in records)
+
+    with pytest.raises(Exception, match="doesn't match its fingerprint"):
+        read_artifact(file_name)
@@ -0,0 +1,106 @@
+import pytest
+
+from builder import runner
+from tests.conftest import ACCOUNT_ID
+
+
+class StaticConfig:
+    def __init__(self, scopes, groups):
+        self.scopes = scopes
+        self.groups = groups
+
+    def get_account_id(self):
+        return ACCOUNT_ID
+
+    def get_scopes(self):
+        return self.scopes
+
+    def get_groups(self):
+        return self.groups
+
+
+@pytest.fixture(autouse=True)
+def atomic_mode(monkeypatch):
+    monkeypatch.setattr(runner, "APPLY_MODE", "atomic")
+
+
+def stored_rows(store):
+    return store.get_permission_scopes(ACCOUNT_ID), store.get_permission_groups(ACCOUNT_ID)
+
+
+def test_apply_replaces_account(store, make_scope, make_group):
+    s1 = make_scope("s1")
+    s2 = make_scope("s2", scope_type="cluster", scope_data={"cl2": ["*"]})
+    store.apply_account_rbac(ACCOUNT_ID, [s1, s2], [make_group("g1", [s1.scope_id, s2.scope_id])])
+
+    result = store.apply_account_rbac(ACCOUNT_ID, [s1], [make_group("g2", [s1.scope_id])])
+
+    scopes, groups = stored_rows(store)
+    assert list(scopes) == ["s1"]
+    assert list(groups) == ["g2"]
+    assert result == {"deleted_groups": 1, "deleted_scopes": 1, "upserted_scopes": 0, "upserted_groups": 1}
+
+
+def test_apply_moves_kept_group_to_new_scope(store, make_scope, make_group):
+    s1 = make_scope("s1")
+    s2 = make_scope("s2")
+    store.apply_account_rbac(ACCOUNT_ID, [s1], [make_group("g", [s1.scope_id])])
+
+    store.apply_account_rbac(ACCOUNT_ID, [s2], [make_group("g", [s2.scope_id])])
+
+    scopes, groups = stored_rows(store)
+    assert list(scopes) == ["s2"]
+    assert groups["g"].scopes == [s2.scope_id]
+
+
+def test_failed_apply_is_rolled_back(store, make_scope, make_group):
+    s1 = make_scope("s1")
+    group = make_group("g1", [s1.scope_id])
+    store.apply_account_rbac(ACCOUNT_ID, [s1], [group])
+
+    with pytest.raises(Exception):
+        store.apply_account_rbac(ACCOUNT_ID, [make_scope("s2")], [make_group("g2", ["unknown-scope"])])
+
+    assert stored_rows(store) == ({"s1": s1}, {"g1": group})
+
+
+def test_apply_rejects_other_accounts(store, make_scope):
+    with pytest.raises(Exception):
+        store.apply_account_rbac(ACCOUNT_ID, [make_scope("s1", account_id="other")], [])
+
+
+def test_apply_keeps_stored_ids_and_users_groups(store, make_scope, make_group):
+    legacy_scope = make_scope("s1", scope_id="legacy-scope")
+    legacy_group = make_group("g1", ["legacy-scope"], group_id="legacy-group")
+    store.apply_account_rbac(ACCOUNT_ID, [legacy_scope], [legacy_group])
+    store.set_users_groups(ACCOUNT_ID, {"user-1": ["legacy-group"]})
+
+    desired_scope = make_scope("s1", scope_id="stable-scope", scope_data={"cl1": ["default", "kube-system"]})
+    desired_group = make_group("g1", ["stable-scope"], group_id="stable-group")
+    runner.apply_rbac(store, StaticConfig([desired_scope], [desired_group]))
+
+    scopes, groups = stored_rows(store)
+    assert scopes["s1"].scope_id == "legacy-scope"
+    assert scopes["s1"].scope_data == {"cl1": ["default", "kube-system"]}
+    assert groups["g1"].group_id == "legacy-group"
+    assert store.get_users_groups() == {"user-1": ["legacy-group"]}
+
+
+def test_apply_does_not_overwrite_other_accounts(store, make_scope, make_group):
+    other_account = "b2fc4b1e-8a7e-4f3c-9d6a-1f2e3d4c5b6a"
+    foreign_scope = make_scope("foreign", account_id=other_account)
+    foreign_group = make_group("foreign", [foreign_scope.scope_id], account_id=other_account)
+    store.apply_account_rbac(other_account, [foreign_scope], [foreign_group])
+    s1 = make_scope("s1")
+    store.apply_account_rbac(ACCOUNT_ID, [s1], [])
+
+    # the payload reuses the other account ids
+    stolen_scope = make_scope("stolen", scope_id=foreign_scope.scope_id)
+    stolen_group = make_group("stolen", [s1.scope_id], group_id=foreign_group.group_id)
+    for scopes, groups in [([s1, stolen_scope], []), ([s1], [stolen_group])]:
+        with pytest.raises(Exception, match="belong to another account"):
+            store.apply_account_rbac(ACCOUNT_ID, scopes, groups)
+
+    assert store.get_permission_scopes(other_account) == {"foreign": foreign_scope}
+    assert store.get_permission_groups(other_account) == {"foreign": foreign_group}
+    assert list(store.get_permission_scopes(ACCOUNT_ID)) == ["s1"]
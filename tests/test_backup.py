@@ -0,0 +1,43 @@
+from builder.backup import take_backup, write_backup, read_backup, compute_restore_plans
+from builder.runner import RbacRunner, APPLIED, UNCHANGED
+from builder.state_snapshot import fetch_account_state
+from tests.conftest import ACCOUNT_ID
+
+
+def rbac_state(store):
+    state = fetch_account_state(store, ACCOUNT_ID, include_users=False)
+    return (
+        sorted((scope.scope_id, scope.canonical) for scope in state.scopes),
+        sorted((group.group_id, group.canonical) for group in state.groups),
+        {user_id: sorted(group_ids) for user_id, group_ids in state.users_groups.items() if group_ids},
+    )
+
+
+def test_restore_backup(store, make_scope, make_group, tmp_path):
+    s1, s2 = make_scope("s1"), make_scope("s2", scope_data={"cl2": ["*"]})
+    g1, g2 = make_group("g1", [s1.scope_id]), make_group("g2", [s1.scope_id, s2.scope_id])
+    store.upsert_scopes([s1, s2])
+    store.upsert_groups([g1, g2])
+    store.set_users_groups(ACCOUNT_ID, {"u1": [g1.group_id], "u2": [g2.group_id]})
+    backup_file = str(tmp_path / "backup.json.gz")
+    write_backup(take_backup(store, [ACCOUNT_ID]), backup_file)
+    backup_state = rbac_state(store)
+
+    # changes made after the backup: an edited group, a deleted group and scope, and a new group and scope
+    s3 = make_scope("s3")
+    g3 = make_group("g3", [s3.scope_id])
+    store.upsert_scopes([s3])
+    store.upsert_groups([g1.model_copy(update={"permissions": ["POD_DELETE"]}), g3])
+    store.set_users_groups(ACCOUNT_ID, {"u1": [g1.group_id, g3.group_id], "u2": [], "u3": [g3.group_id]})
+    store.delete_groups(ACCOUNT_ID, [g2.group_id])
+    store.delete_scopes(ACCOUNT_ID, [s2.scope_id])
+    assert rbac_state(store) != backup_state
+
+    runner = RbacRunner(store_factory=lambda: store)
+    results = runner.run_plans(compute_restore_plans(store, read_backup(backup_file)))
+
+    assert [result.status for result in results] == [APPLIED]
+    # scopes and groups are restored with their original ids, so the users groups are valid again
+    assert rbac_state(store) == backup_state
+    results = runner.run_plans(compute_restore_plans(store, read_backup(backup_file)))
+    assert [result.status for result in results] == [UNCHANGED]
@@ -0,0 +1,99 @@
+import json
+
+import pytest
+
+from builder.cluster_inventory import ClusterInventory, literal_prefix, NameIndex
+from builder.config_builder import load_account_configs, ConfigValidationError
+
+INVENTORY = b"""
+clusters:
+  prod-eu: [default, kube-system, team-a, team-b]
+  prod-us: [default, team-a]
+  staging: [default, team-c]
+"""
+
+CONFIG = """
+account_id: a1
+scopes:
+  - name: prod-teams
+    type: namespace
+    clusters:
+      "prod-*": ["team-*", default]
+  - name: regex
+    type: namespace
+    clusters:
+      "re:(staging|prod-us)": ["re:team-[ac]"]
+  - name: nothing
+    type: namespace
+    clusters:
+      "dev-*": [default]
+groups:
+  - name: g1
+    type: namespace
+    provider_group_id: p1
+    permissions: [POD_LOGS]
+    scopes: [prod-teams, regex]
+"""
+
+
+def scopes_data(configs):
+    return {scope.name: scope.scope_data for scope in configs["a1"].get_scopes()}
+
+
+@pytest.mark.parametrize("selector, prefix", [
+    ("prod-*", "prod-"),
+    ("prod", "prod"),
+    ("[pq]rod", ""),
+    ("re:^prod-.*", "prod-"),
+    ("re:prod-eus?", "prod-eu"),
+    ("re:prod|staging", ""),
+])
+def test_literal_prefix(selector, prefix):
+    assert literal_prefix(selector) == prefix
+
+
+def test_name_index_match():
+    index = NameIndex(["prod-eu", "prod-us", "staging", "prod"])
+
+    assert index.match("prod-*") == ["prod-eu", "prod-us"]
+    assert index.match("re:prod(-eu)?") == ["prod", "prod-eu"]
+    assert index.match("staging") == ["staging"]
+    assert index.match("missing") == []
+
+
+def test_selectors_are_expanded(write_config):
+    configs = load_account_configs(
+        write_config(CONFIG), max_workers=1, inventory=ClusterInventory("inventory.yaml", INVENTORY)
+    )
+
+    assert scopes_data(configs) == {
+        "prod-teams": {"prod-eu": ["default", "team-a", "team-b"], "prod-us": ["default", "team-a"]},
+        "regex": {"prod-us": ["team-a"], "staging": ["team-c"]},
+        "nothing": {},
+    }
+
+
+def test_selectors_require_an_inventory(write_config):
+    with pytest.raises(ConfigValidationError, match="no cluster inventory is set"):
+        load_account_configs(write_config(CONFIG), max_workers=1)
+
+
+def test_resolved_selectors_are_cached(write_config, tmp_path):
+    cache_file = str(tmp_path / "inventory-cache.json")
+    path = write_config(CONFIG)
+    expected = scopes_data(load_account_configs(
+        path, max_workers=1, inventory=ClusterInventory("inventory.yaml", INVENTORY, cache_file)
+    ))
+    with open(cache_file) as cache:
+        assert json.load(cache)["resolved"]["cluster/prod-*"] == ["prod-eu", "prod-us"]
+
+    # the cached selectors are used without parsing the inventory
+    inventory = ClusterInventory("inventory.yaml", INVENTORY, cache_file)
+    assert scopes_data(load_account_configs(path, max_workers=1, inventory=inventory)) == expected
+    assert inventory.clusters is None
+
+    # a changed inventory ignores the cache
+    inventory = ClusterInventory("inventory.yaml", INVENTORY + b"  prod-ap: [team-a]\n", cache_file)
+    configs = load_account_configs(path, max_workers=1, inventory=inventory)
+    # namespaces that aren't selectors are kept as is
+    assert scopes_data(configs)["prod-teams"]["prod-ap"] == ["default", "team-a"]
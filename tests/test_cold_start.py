@@ -0,0 +1,63 @@
+import json
+import os
+import subprocess
+import sys
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+NETWORK_MODULES = ["supabase", "postgrest", "gotrue", "httpx", "requests"]
+# validate loads only the configuration modules
+PLATFORM_MODULES = [
+    "builder.artifact", "builder.backup", "builder.daemon", "builder.permission_index", "builder.plan",
+    "builder.reconciler", "builder.robusta_store", "builder.runner", "builder.state_snapshot", "builder.storage_dal",
+]
+# generous, so slow machines don't fail it. The import takes a fraction of a second
+MAX_IMPORT_SECONDS = 5
+
+# imports builder.main, runs main.py as the validate command does, and prints the import time and the modules
+# it imported
+VALIDATE_SCRIPT = """
+import json, runpy, sys, time
+preloaded = set(sys.modules)
+config, modules = sys.argv[1], sys.argv[2].split(",")
+start = time.perf_counter()
+import builder.main
+import_seconds = time.perf_counter() - start
+sys.argv = ["main.py", "validate", "--config", config]
+try:
+    runpy.run_path("main.py", run_name="__main__")
+except SystemExit as e:
+    exit_code = e.code
+print(json.dumps({
+    "exit_code": exit_code,
+    "import_seconds": import_seconds,
+    "modules": sorted(set(modules) & set(sys.modules) - preloaded),
+}))
+"""
+
+CONFIG = """
+account_id: a1
+scopes:
+  - name: s1
+    type: namespace
+    clusters: {cl1: [default]}
+groups:
+  - name: g1
+    type: namespace
+    provider_group_id: p1
+    permissions: [POD_LOGS]
+    scopes: [s1]
+"""
+
+
+def test_validate_cold_start(write_config):
+    output = subprocess.run(
+        [sys.executable, "-c", VALIDATE_SCRIPT, write_config(CONFIG), ",".join(NETWORK_MODULES + PLATFORM_MODULES)],
+        cwd=os.path.join(REPO_DIR, "builder"), env={**os.environ, "PYTHONPATH": REPO_DIR},
+        stdout=subprocess.PIPE, check=True, text=True,
+    ).stdout
+    result = json.loads(output.strip().splitlines()[-1])
+
+    assert result["exit_code"] == 0
+    assert result["modules"] == []
+    assert result["import_seconds"] < MAX_IMPORT_SECONDS
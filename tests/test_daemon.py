@@ -0,0 +1,112 @@
+from builder.daemon import RbacDaemon, ConfigWatcher, INVALID_CONFIG
+from builder.metrics import METRICS
+from builder.runner import AccountResult, APPLIED, FAILED
+
+
+class FakeRunner:
+    def __init__(self):
+        self.runs = 0
+
+    def run(self, configs, force=False):
+        self.runs += 1
+        with METRICS.phase(f"apply-{self.runs}"):
+            pass
+        METRICS.add_rows_changed("scopes", "created", 1)
+        return [AccountResult(account_id=account_id, status=APPLIED) for account_id in configs]
+
+
+def make_daemon(tmp_path, runner, load_configs=lambda: {"a1": None}, **kwargs) -> RbacDaemon:
+    return RbacDaemon(
+        runner=runner,
+        load_configs=load_configs,
+        watcher=ConfigWatcher(str(tmp_path), debounce=0),
+        poll_interval=0,
+        **kwargs,
+    )
+
+
+def test_run_metrics_are_of_the_last_apply(tmp_path):
+    METRICS.reset()
+    daemon = make_daemon(tmp_path, FakeRunner())
+
+    daemon.apply("first")
+    first_start = METRICS.summary()["start_time"]
+    daemon.apply("second")
+    summary = METRICS.summary()
+
+    assert summary["start_time"] >= first_start
+    assert list(summary["phases"]) == ["apply-2"]
+    # counters keep counting across applies
+    assert summary["rows_changed"] == [{"entity": "scopes", "action": "created", "count": 2}]
+    # the run duration doesn't grow once the apply ended
+    assert summary["duration_seconds"] == METRICS.summary()["duration_seconds"]
+
+
+def test_invalid_configuration_is_not_applied(tmp_path):
+    def load_configs():
+        raise ValueError("bad configuration")
+
+    runner = FakeRunner()
+    daemon = make_daemon(tmp_path, runner, load_configs=load_configs)
+
+    assert daemon.apply("changed") == []
+    status = daemon.get_status()
+    assert (status.last_apply_status, status.last_error, status.failures) == (INVALID_CONFIG, "bad configuration", 1)
+    assert runner.runs == 0
+
+
+class FailingRunner(FakeRunner):
+    def __init__(self, failures: int):
+        super().__init__()
+        self.failures = failures
+        self.forced = []
+
+    def run(self, configs, force=False):
+        self.forced.append(force)
+        if self.runs < self.failures:
+            self.runs += 1
+            return [AccountResult(account_id=account_id, status=FAILED, error="platform error")
+                    for account_id in configs]
+        return super().run(configs, force)
+
+
+def test_failed_apply_is_retried_with_backoff(tmp_path):
+    runner = FailingRunner(failures=3)
+    daemon = make_daemon(tmp_path, runner, retry_backoff=10, retry_max_backoff=15)
+
+    daemon.apply("periodic resync", force=True)
+    first_retry_at = daemon.retry_at
+    assert first_retry_at is not None
+    daemon.apply("retrying the failed apply", force=daemon.retry_force)
+    daemon.apply("retrying the failed apply", force=daemon.retry_force)
+    # the delay is doubled up to the max backoff
+    assert daemon.retry_delay == 15
+    assert daemon.retry_at > first_retry_at
+
+    daemon.apply("retrying the failed apply", force=daemon.retry_force)
+    assert daemon.get_status().last_apply_status == APPLIED
+    assert (daemon.retry_at, daemon.retry_delay) == (None, 10)
+    # the retries of a failed forced apply are forced too
+    assert runner.forced == [True, True, True, True]
+
+
+def test_invalid_configuration_is_not_retried(tmp_path):
+    def load_configs():
+        raise ValueError("bad configuration")
+
+    daemon = make_daemon(tmp_path, FakeRunner(), load_configs=load_configs)
+    daemon.apply("changed")
+
+    assert daemon.retry_at is None
+
+
+def test_run_retries_the_failed_apply(tmp_path):
+    runner = FailingRunner(failures=1)
+    daemon = make_daemon(tmp_path, runner, retry_backoff=0)
+    daemon.apply("configuration changed")
+    daemon.on_applied = lambda results: daemon.stop()
+
+    daemon.run()
+
+    status = daemon.get_status()
+    assert (status.last_apply_reason, status.last_apply_status) == ("retrying the failed apply", APPLIED)
@@ -0,0 +1,38 @@
+import os
+
+import pytest
+
+from builder.file_utils import atomic_text_file, open_text
+from builder.fingerprint import FingerprintStore
+
+
+@pytest.mark.parametrize("file_name", ["state.json", "state.json.gz"])
+def test_failed_write_keeps_the_previous_file(tmp_path, file_name):
+    path = str(tmp_path / file_name)
+    with atomic_text_file(path) as output:
+        output.write("first")
+
+    with pytest.raises(ValueError):
+        with atomic_text_file(path) as output:
+            output.write("partial")
+            raise ValueError("crash")
+
+    with open_text(path, "r") as content:
+        assert content.read() == "first"
+    assert os.listdir(tmp_path) == [file_name]
+
+
+def test_fingerprint_store(tmp_path):
+    store = FingerprintStore(str(tmp_path / "fingerprints.json"))
+    store.save("a1", "f1")
+    store.save("a2", "f2")
+
+    assert (store.get("a1"), store.get("a2"), store.get("a3")) == ("f1", "f2", None)
+
+
+def test_private_file_is_readable_by_its_owner_only(tmp_path):
+    path = str(tmp_path / "snapshot.json.gz")
+    with atomic_text_file(path, private=True) as output:
+        output.write("emails")
+
+    assert os.stat(path).st_mode & 0o777 == 0o600
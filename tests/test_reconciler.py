@@ -0,0 +1,68 @@
+from builder.reconciler import compute_plan, adopt_stored_ids, RbacReconciler
+from tests.conftest import ACCOUNT_ID
+
+
+def test_plan_creates_everything_on_empty_account(make_scope, make_group):
+    scope = make_scope("s1")
+    group = make_group("g1", [scope.scope_id])
+
+    plan = compute_plan(ACCOUNT_ID, [scope], [group], {}, {})
+
+    assert plan.scopes_to_create == [scope]
+    assert plan.groups_to_create == [group]
+    assert not (plan.scopes_to_update or plan.scopes_to_delete or plan.groups_to_update or plan.groups_to_delete)
+
+
+def test_plan_is_empty_when_nothing_changed(make_scope, make_group):
+    scope = make_scope("s1")
+    group = make_group("g1", [scope.scope_id])
+
+    plan = compute_plan(ACCOUNT_ID, [scope], [group], {"s1": scope}, {"g1": group})
+
+    assert plan.is_empty()
+
+
+def test_plan_updates_and_deletes(make_scope, make_group):
+    kept = make_scope("kept")
+    removed = make_scope("removed")
+    group = make_group("g1", [kept.scope_id])
+    old_group = make_group("old", [removed.scope_id])
+    changed = kept.model_copy(update={"scope_data": {"cl1": ["default", "kube-system"]}})
+
+    plan = compute_plan(
+        ACCOUNT_ID, [changed], [group],
+        {"kept": kept, "removed": removed}, {"g1": group, "old": old_group}
+    )
+
+    assert plan.scopes_to_update == [changed]
+    assert plan.scopes_to_delete == [removed]
+    assert plan.groups_to_delete == [old_group]
+    assert plan.summary() == "scopes: +0 ~1 -1, groups: +0 ~0 -1"
+
+
+def test_stored_ids_are_kept(make_scope, make_group):
+    stored_scope = make_scope("s1", scope_id="legacy-scope")
+    stored_group = make_group("g1", ["legacy-scope"], group_id="legacy-group")
+    scope = make_scope("s1", scope_id="stable-scope")
+    group = make_group("g1", ["stable-scope"], group_id="stable-group")
+
+    scopes, groups = adopt_stored_ids([scope], [group], {"s1": stored_scope}, {"g1": stored_group})
+
+    assert [scope.scope_id for scope in scopes] == ["legacy-scope"]
+    assert [(group.group_id, group.scopes) for group in groups] == [("legacy-group", ["legacy-scope"])]
+    assert compute_plan(ACCOUNT_ID, [scope], [group], {"s1": stored_scope}, {"g1": stored_group}).is_empty()
+
+
+def test_sync_applies_plan(store, make_scope, make_group):
+    s1 = make_scope("s1")
+    s2 = make_scope("s2")
+    reconciler = RbacReconciler(store)
+    reconciler.sync(ACCOUNT_ID, [s1], [make_group("g1", [s1.scope_id])])
+
+    # the kept group moves to a new scope, and the old scope is deleted
+    plan = reconciler.sync(ACCOUNT_ID, [s2], [make_group("g1", [s2.scope_id])])
+
+    assert plan.summary() == "scopes: +1 ~0 -1, groups: +0 ~1 -0"
+    assert list(store.get_permission_scopes(ACCOUNT_ID)) == ["s2"]
+    assert store.get_permission_groups(ACCOUNT_ID)["g1"].scopes == [s2.scope_id]
+    assert reconciler.plan(ACCOUNT_ID, [s2], [make_group("g1", [s2.scope_id])]).is_empty()
@@ -0,0 +1,111 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+import requests
+from postgrest.exceptions import APIError
+
+from builder.metrics import METRICS
+from builder.request_scheduler import RequestScheduler, classify_failure
+
+
+def api_error(code: str) -> APIError:
+    return APIError({"message": "error", "code": code, "hint": None, "details": None})
+
+
+class FlakyRequest:
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return "result"
+
+
+def test_classify_failure():
+    assert classify_failure(api_error("503")).throttled
+    assert classify_failure(api_error("40001")).retryable
+    assert classify_failure(api_error("PGRST301")).auth
+    assert not classify_failure(requests.exceptions.ConnectTimeout()).sent
+    assert not classify_failure(api_error("23503")).retryable
+
+
+def test_transient_failures_are_retried():
+    scheduler = RequestScheduler(backoff=0)
+    request = FlakyRequest([api_error("503"), requests.ConnectionError()])
+
+    assert scheduler.call("get_scopes", request) == "result"
+    assert request.calls == 3
+
+
+def test_retries_are_limited():
+    scheduler = RequestScheduler(max_retries=2, backoff=0)
+    request = FlakyRequest([api_error("503")] * 3)
+
+    with pytest.raises(APIError):
+        scheduler.call("get_scopes", request)
+    assert request.calls == 3
+
+
+def test_permanent_failures_are_not_retried():
+    scheduler = RequestScheduler(backoff=0)
+    request = FlakyRequest([api_error("23503")])
+
+    with pytest.raises(APIError):
+        scheduler.call("upsert_groups", request)
+    assert request.calls == 1
+
+
+def test_sent_non_idempotent_requests_are_not_retried():
+    scheduler = RequestScheduler(backoff=0)
+    request = FlakyRequest([requests.ConnectionError()])
+
+    with pytest.raises(requests.ConnectionError):
+        scheduler.call("apply_account", request, idempotent=False)
+    assert request.calls == 1
+
+
+def test_unsent_non_idempotent_requests_are_retried():
+    scheduler = RequestScheduler(backoff=0)
+    request = FlakyRequest([requests.exceptions.ConnectTimeout()])
+
+    assert scheduler.call("apply_account", request, idempotent=False) == "result"
+    assert request.calls == 2
+
+
+def test_auth_errors_refresh_the_session():
+    refreshed = []
+    scheduler = RequestScheduler(backoff=0, on_auth_error=lambda: refreshed.append(True))
+
+    assert scheduler.call("get_scopes", FlakyRequest([api_error("PGRST301")])) == "result"
+    assert refreshed == [True]
+
+
+def test_concurrent_reads_are_coalesced():
+    scheduler = RequestScheduler()
+    release = threading.Event()
+    calls = []
+
+    def read():
+        calls.append(True)
+        release.wait(5)
+        return ["scope"]
+
+    coalesced = METRICS.coalesced["coalesced_read"]
+
+    with ThreadPoolExecutor(max_workers=3) as pool:
+        futures = [pool.submit(scheduler.call, "coalesced_read", read, coalesce_key=("scopes", "a1")) for _ in range(3)]
+        # the first request is in flight until released, the others wait for it
+        deadline = time.monotonic() + 5
+        while METRICS.coalesced["coalesced_read"] < coalesced + 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        release.set()
+        results = [future.result() for future in futures]
+
+    assert results == [["scope"]] * 3
+    assert len(calls) == 1
+    assert scheduler.in_flight == {}
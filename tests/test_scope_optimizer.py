@@ -0,0 +1,52 @@
+import pytest
+
+from builder import runner
+from builder.config_builder import load_account_configs
+from builder.scope_optimizer import normalize_scope_data
+
+CONFIG = """
+account_id: a1
+scopes:
+  - name: first
+    type: namespace
+    clusters: {cl1: [kube-system, default, default]}
+  - name: same
+    type: namespace
+    clusters: {cl1: [default, kube-system]}
+  - name: other
+    type: namespace
+    clusters: {cl2: ["*", default]}
+groups:
+  - name: g-first
+    type: namespace
+    provider_group_id: p1
+    permissions: []
+    scopes: [first]
+  - name: g-same
+    type: namespace
+    provider_group_id: p2
+    permissions: []
+    scopes: [same, other]
+"""
+
+
+def test_normalize_scope_data():
+    assert normalize_scope_data({"b": ["y", "x", "x"], "a": ["ns", "*"]}) == {"a": ["*"], "b": ["x", "y"]}
+
+
+@pytest.mark.parametrize("apply_mode", ["incremental", "atomic"])
+def test_merging_stored_scopes(store, write_config, monkeypatch, apply_mode):
+    monkeypatch.setattr(runner, "APPLY_MODE", apply_mode)
+    path = write_config(CONFIG)
+    runner.apply_rbac(store, load_account_configs(path, max_workers=1)["a1"])
+    users_group_id = store.get_permission_groups("a1")["g-same"].group_id
+    store.set_users_groups("a1", {"user-1": [users_group_id]})
+
+    # the stored 'same' scope is still referenced by the stored g-same group when merging deletes it
+    runner.apply_rbac(store, load_account_configs(path, max_workers=1, merge_scopes=True)["a1"])
+
+    scopes = store.get_permission_scopes("a1")
+    groups = store.get_permission_groups("a1")
+    assert sorted(scopes) == ["first", "other"]
+    assert groups["g-same"].scopes == [scopes["first"].scope_id, scopes["other"].scope_id]
+    assert store.get_users_groups() == {"user-1": [users_group_id]}
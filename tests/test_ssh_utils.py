@@ -0,0 +1,50 @@
+import base64
+import os
+import tempfile
+
+import certifi
+import pytest
+
+from builder import ssh_utils
+
+CUSTOM_CA = b"-----BEGIN CERTIFICATE-----\ncustom\n-----END CERTIFICATE-----\n"
+
+
+@pytest.fixture
+def temp_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, "gettempdir", lambda: str(tmp_path))
+    monkeypatch.setattr(certifi, "where", certifi.where)
+    for name in ("REQUESTS_CA_BUNDLE", "WEBSOCKET_CLIENT_CA_BUNDLE"):
+        monkeypatch.delenv(name, raising=False)
+    return tmp_path
+
+
+def test_merged_bundle_is_private(temp_dir):
+    base_bundle = certifi.where()
+    assert ssh_utils.add_custom_certificate(base64.b64encode(CUSTOM_CA).decode())
+
+    path = os.environ["REQUESTS_CA_BUNDLE"]
+    assert os.path.dirname(path) == str(temp_dir / f"rbac-builder-certs-{os.getuid()}")
+    assert os.stat(os.path.dirname(path)).st_mode & 0o777 == 0o700
+    with open(path, "rb") as bundle:
+        assert bundle.read() == ssh_utils.merged_certificate(base_bundle, CUSTOM_CA)
+
+
+def test_planted_bundle_is_replaced(temp_dir):
+    content = ssh_utils.merged_certificate(certifi.where(), CUSTOM_CA)
+    path = os.path.join(ssh_utils.certificate_dir(), "custom_ca.pem")
+    with open(path, "wb") as bundle:
+        bundle.write(b"another ca")
+
+    assert not ssh_utils.is_written(path, content)
+    ssh_utils.write_merged_certificate(path, content)
+    assert ssh_utils.is_written(path, content)
+
+
+def test_shared_directory_is_rejected(temp_dir):
+    path = temp_dir / f"rbac-builder-certs-{os.getuid()}"
+    path.mkdir(mode=0o777)
+    path.chmod(0o777)
+
+    with pytest.raises(Exception, match="owned and accessible only by the current user"):
+        ssh_utils.certificate_dir()
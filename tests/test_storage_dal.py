@@ -0,0 +1,45 @@
+import time
+
+import pytest
+
+from benchmarks.fake_postgrest import FakePostgrest, fake_jwt
+from builder.storage_dal import StorageDal
+from tests.conftest import ACCOUNT_ID
+
+
+@pytest.fixture
+def fake():
+    # the platform returns fewer rows than the builder page size
+    fake = FakePostgrest(max_rows=3).start()
+    yield fake
+    fake.stop()
+
+
+def test_reads_all_pages_when_platform_caps_rows(fake, make_scope, make_group):
+    scopes = [make_scope(f"s{index}") for index in range(8)]
+    fake.dal.upsert_scopes(scopes)
+    fake.dal.upsert_groups([make_group(f"g{index}", [scopes[0].scope_id]) for index in range(3)])
+    dal = StorageDal(url=fake.url, key=fake_jwt(), email="test@example.com", password="test", page_size=5)
+    try:
+        assert sorted(scope.name for scope in dal.get_permission_scopes(ACCOUNT_ID)) == sorted(s.name for s in scopes)
+        assert len(list(dal.get_permission_groups(ACCOUNT_ID))) == 3
+    finally:
+        dal.close()
+
+
+def test_rejected_token_signs_in_again(fake, make_scope):
+    dal = StorageDal(url=fake.url, key=fake_jwt(), email="test@example.com", password="test", http_backoff=0)
+    try:
+        scope = make_scope("s1")
+        dal.upsert_scopes([scope])
+        # signed in a minute ago, so a sign in is due only because the token is rejected
+        dal.sign_in_time = time.time() - 60
+        fake.revoke_tokens()
+
+        # both the postgrest client and the rpc calls use the new token
+        assert [s.name for s in dal.get_permission_scopes(ACCOUNT_ID)] == ["s1"]
+        assert dal.get_robusta_users() == []
+        assert dal.apply_account_rbac(ACCOUNT_ID, [scope], [])["upserted_scopes"] == 0
+        assert len(fake.issued_tokens) == 2
+    finally:
+        dal.close()
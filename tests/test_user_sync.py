@@ -0,0 +1,131 @@
+import os
+
+import pytest
+
+from builder import config_builder
+from builder.config_builder import load_account_configs, ConfigValidationError, accounts_users_configs
+from builder.memory_dal import MemoryStorageDal
+from builder.model import User
+from builder.robusta_store import RobustaStore
+from builder.runner import RbacRunner, APPLIED
+from builder.user_sync import desired_users_groups, user_matches
+
+ACCOUNT_CONFIG = """
+account_id: {account_id}
+{users}
+scopes:
+  - name: all
+    type: cluster
+    clusters:
+      {cluster}: ["*"]
+groups:
+  - name: sso
+    type: cluster
+    provider_group_id: p1
+    permissions: []
+    scopes: [all]
+"""
+
+USERS = [User(id="u-alice", email="alice@example.com"), User(id="u-bob", email="bob@example.com")]
+
+
+def account_config(account_id: str, users: str = "", cluster: str = "cl1") -> str:
+    return ACCOUNT_CONFIG.format(account_id=account_id, users=users, cluster=cluster)
+
+
+@pytest.fixture
+def no_env_users(monkeypatch):
+    monkeypatch.setattr(config_builder, "SYNC_USERS_GROUPS", True)
+    monkeypatch.setattr(config_builder, "ALLOWED_USERS", [])
+    monkeypatch.setattr(config_builder, "ACCOUNT_SSO_GROUP", "")
+    monkeypatch.setattr(config_builder, "CLUSTER_ADMIN_GROUPS", {})
+    monkeypatch.setattr(config_builder, "USERS_EMAIL_DOMAIN", "")
+
+
+def test_desired_users_groups(make_scope, make_group):
+    scope = make_scope("all", scope_type="cluster", scope_data={"cl1": ["*"]})
+    sso = make_group("sso", [scope.scope_id], scope_type="cluster")
+    admins = make_group("admins", [scope.scope_id], scope_type="cluster")
+
+    desired = desired_users_groups(
+        users=USERS,
+        scopes={"all": scope},
+        groups={"sso": sso, "admins": admins},
+        allowed_users=["alice", "bob@example.com"],
+        cluster_admin_groups={"cl1": ["alice"]},
+        account_sso_group="sso",
+        email_domain="example.com",
+    )
+
+    assert desired == {"u-alice": {sso.group_id, admins.group_id}, "u-bob": {sso.group_id}}
+
+
+def test_user_names_match_only_the_email_domain():
+    users = [User(id="u-admin", email="admin@example.com"), User(id="u-other", email="admin@other.com")]
+
+    assert [user.id for user in users if user_matches(user, ["admin"], "example.com")] == ["u-admin"]
+    assert [user.id for user in users if user_matches(user, ["admin"])] == []
+    assert [user.id for user in users if user_matches(user, ["ADMIN@other.com"])] == ["u-other"]
+
+
+def test_no_user_is_managed_without_allowed_users():
+    assert desired_users_groups(USERS, {}, {}, allowed_users=[], cluster_admin_groups={}, account_sso_group="") == {}
+
+
+def test_users_are_assigned_only_to_their_accounts(write_config, no_env_users):
+    write_config(account_config("a1", 'users: {allowed_users: [alice@example.com], account_sso_group: sso}'), "a1.yaml")
+    write_config(account_config("a2", 'users: {allowed_users: [bob@example.com], account_sso_group: sso}'), "a2.yaml")
+    path = write_config(account_config("a3"), "a3.yaml")
+    configs = load_account_configs(os.path.dirname(path), max_workers=1)
+    dal = MemoryStorageDal(users=USERS)
+
+    results = RbacRunner(store_factory=lambda: RobustaStore(dal=dal)).run(configs)
+
+    assert [result.status for result in results] == [APPLIED] * 3
+    group_accounts = {group_id: group["account_id"] for group_id, group in dal.groups.items()}
+    assert {user_id: [group_accounts[group_id] for group_id in group_ids]
+            for user_id, group_ids in dal.user_groups.items()} == {"u-alice": ["a1"], "u-bob": ["a2"]}
+
+
+def test_env_users_are_rejected_with_multiple_accounts(write_config, no_env_users, monkeypatch):
+    write_config(account_config("a1"), "a1.yaml")
+    path = write_config(account_config("a2"), "a2.yaml")
+    configs = load_account_configs(os.path.dirname(path), max_workers=1)
+    monkeypatch.setattr(config_builder, "ALLOWED_USERS", ["alice@example.com"])
+
+    with pytest.raises(ConfigValidationError):
+        accounts_users_configs(configs)
+
+
+def test_env_users_apply_to_a_single_account(write_config, no_env_users, monkeypatch):
+    configs = load_account_configs(write_config(account_config("a1")), max_workers=1)
+    monkeypatch.setattr(config_builder, "ALLOWED_USERS", ["alice"])
+    monkeypatch.setattr(config_builder, "ACCOUNT_SSO_GROUP", "sso")
+    monkeypatch.setattr(config_builder, "USERS_EMAIL_DOMAIN", "example.com")
+
+    assert accounts_users_configs(configs) == {
+        "a1": {"allowed_users": ["alice"], "cluster_admin_groups": {}, "account_sso_group": "sso",
+               "email_domain": "example.com"}
+    }
+
+
+def test_env_users_require_allowed_users(write_config, no_env_users, monkeypatch):
+    configs = load_account_configs(write_config(account_config("a1")), max_workers=1)
+    monkeypatch.setattr(config_builder, "ACCOUNT_SSO_GROUP", "sso")
+
+    with pytest.raises(ConfigValidationError, match="allowed_users is required"):
+        accounts_users_configs(configs)
+
+
+def test_users_are_not_synced_without_opt_in(write_config, no_env_users, monkeypatch):
+    path = write_config(account_config("a1", 'users: {allowed_users: [alice@example.com]}'))
+    configs = load_account_configs(path, max_workers=1)
+    monkeypatch.setattr(config_builder, "SYNC_USERS_GROUPS", False)
+
+    assert accounts_users_configs(configs) == {"a1": None}
+
+
+@pytest.mark.parametrize("users", ['users: {account_sso_group: sso}', 'users: {allowed_users: [alice]}'])
+def test_invalid_users_section(write_config, users):
+    with pytest.raises(ConfigValidationError, match="users"):
+        load_account_configs(write_config(account_config("a1", users)), max_workers=1)
@@ -0,0 +1,89 @@
+import io
+
+import pytest
+import yaml
+
+from builder.config_builder import compile_config_file
+from builder.yaml_stream import stream_mapping
+
+
+def stream(content: str, list_keys=("scopes", "groups")):
+    return list(stream_mapping(io.StringIO(content), list_keys=list_keys))
+
+
+def test_list_items_are_streamed_one_by_one():
+    content = """
+account_id: a1
+scopes:
+  - name: s1
+  - name: s2
+other: [1, 2]
+"""
+    assert stream(content) == [
+        ("account_id", "a1"),
+        ("scopes", {"name": "s1"}),
+        ("scopes", {"name": "s2"}),
+        ("other", [1, 2]),
+    ]
+
+
+def test_aliases_are_resolved_across_items():
+    content = """
+scopes:
+  - name: s1
+    clusters: &clusters {cl1: ["*"]}
+  - name: s2
+    clusters: *clusters
+"""
+    assert [value["clusters"] for _, value in stream(content)] == [{"cl1": ["*"]}, {"cl1": ["*"]}]
+
+
+def test_anchored_list_is_yielded_whole():
+    content = """
+scopes: &scopes
+  - name: s1
+copy: *scopes
+"""
+    assert stream(content) == [("scopes", [{"name": "s1"}]), ("copy", [{"name": "s1"}])]
+
+
+def test_empty_document():
+    assert stream("") == []
+
+
+def test_document_must_be_a_mapping():
+    with pytest.raises(yaml.YAMLError):
+        stream("- a\n- b\n")
+
+
+def test_undefined_alias():
+    with pytest.raises(yaml.YAMLError):
+        stream("scopes:\n  - *missing\n")
+
+
+def test_compile_collects_all_item_errors(write_config):
+    path = write_config("""
+scopes:
+  - name: ok
+    type: namespace
+    clusters: {cl1: [default]}
+  - name: bad-type
+    type: other
+    clusters: {cl1: ["*"]}
+  - name: bad-cluster
+    type: cluster
+    clusters: {cl1: [default]}
+groups:
+  - name: g1
+    type: namespace
+    provider_group_id: p1
+    permissions: [NOT_A_PERMISSION]
+    scopes: [ok]
+account_id: a1
+""")
+    compiled = compile_config_file(path)
+
+    # definitions before the account_id are compiled once it's found
+    assert compiled.account_id == "a1"
+    assert [scope.name for scope in compiled.scopes] == ["ok"]
+    assert [error.split(": ")[1] for error in compiled.errors] == ["scopes[1]", "scopes[2]", "groups[0]"]